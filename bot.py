@@ -1,38 +1,36 @@
 import asyncio
+import hmac
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+from datetime import datetime, timezone
 
 from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-
-from config import BOT_TOKEN, DATABASE_URL
-from services.database import Database
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    BOT_TOKEN, DATABASE_URL, REPLICA_DATABASE_URL, REPLICA_MAX_LAG, READ_YOUR_WRITES_WINDOW,
+    WORKERS, LOG_JSON,
+    READY_DB_TIMEOUT, LOOP_LAG_WARN, LOOP_LAG_MAX, ANALYTICS_TOKEN,
+)
+from services.database import Database, create_database
+from services.expiry import ExpiryScheduler
+from services.delivery import deliver
+from services.sharding import ShardSupervisor
+from services.log import setup_logging, UpdateContextMiddleware
+from services.health import LoopLagMonitor, readiness
+from services.tasks import TaskSupervisor
+from services.analytics import MAX_DAYS, build_report
+from services.recurrence import MSK_TZ, following
 from middlewares.rate_limit import RateLimitMiddleware
 from middlewares.access import AccessMiddleware
-from handlers import start, parking, announcements, group
+from handlers import start, parking, announcements, search, export, group
 
 # === Logging ===
 
 logger = logging.getLogger(__name__)
 
-def setup_logging():
-    root = logging.getLogger()
-    root.setLevel(logging.INFO)
-
-    fmt = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-
-    console = logging.StreamHandler()
-    console.setFormatter(fmt)
-    root.addHandler(console)
-
-    file_handler = RotatingFileHandler(
-        "bot.log", maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8"
-    )
-    file_handler.setFormatter(fmt)
-    root.addHandler(file_handler)
-
 
 # === Health check ===
 
@@ -40,10 +38,45 @@ async def health_handler(request):
     return web.Response(text="OK")
 
 
-async def run_web_server():
+async def ready_handler(request):
+    """Deep check: DB ping, pool saturation, background tasks, loop lag."""
+    app = request.app
+    ready, checks = await readiness(
+        app["db"], app["tasks"], app["lag"], LOOP_LAG_MAX, READY_DB_TIMEOUT, app["supervisor"],
+    )
+    if not ready:
+        failed = [name for name, check in checks.items() if not check["ok"]]
+        logger.warning(f"Readiness check failed: {', '.join(failed)}", extra={"checks": checks})
+    return web.json_response({"ready": ready, "checks": checks}, status=200 if ready else 503)
+
+
+async def analytics_handler(request):
+    """Incident series as JSON: GET /analytics?days=N with the ANALYTICS_TOKEN bearer."""
+    # Constant-time compare; bytes, since str operands must be ASCII-only
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {ANALYTICS_TOKEN}".encode()
+    ):
+        return web.json_response({"error": "unauthorized"}, status=401)
+    try:
+        days = int(request.query.get("days", "30"))
+    except ValueError:
+        days = 0
+    if not 1 <= days <= MAX_DAYS:
+        return web.json_response({"error": f"days must be 1..{MAX_DAYS}"}, status=400)
+    return web.json_response(await build_report(request.app["db"], days))
+
+
+async def run_web_server(db: Database, tasks: TaskSupervisor, lag: LoopLagMonitor, supervisor=None):
     app = web.Application()
+    app["db"] = db
+    app["tasks"] = tasks
+    app["lag"] = lag
+    app["supervisor"] = supervisor
     app.router.add_get("/health", health_handler)
+    app.router.add_get("/ready", ready_handler)
     app.router.add_get("/", health_handler)
+    if ANALYTICS_TOKEN:
+        app.router.add_get("/analytics", analytics_handler)
 
     port = int(os.getenv("PORT", "10000"))
     runner = web.AppRunner(app)
@@ -56,64 +89,110 @@ async def run_web_server():
 
 # === Auto-backup ===
 
-async def auto_backup_loop(bot: Bot, db: Database):
-    """Export full DB every 7 days and send to admin."""
+AUTO_BACKUP_INTERVAL = 7 * 24 * 60 * 60  # 7 days
+
+
+async def auto_backup(bot: Bot, db: Database):
+    """Export full DB and send to admin (every 7 days)."""
     from config import ADMIN_ID
     from aiogram.types import BufferedInputFile
 
-    while True:
-        await asyncio.sleep(7 * 24 * 60 * 60)  # 7 days
-        if not ADMIN_ID:
-            continue
-        try:
-            data = await db.export_all_data()
-            file = BufferedInputFile(
-                data.encode("utf-8"), filename="parking_auto_backup.json"
-            )
-            try:
-                await bot.send_document(ADMIN_ID, file, caption="📦 Автоматический бэкап (7 дней)")
-            except Exception as e:
-                logger.error(f"Auto-backup to {ADMIN_ID} failed: {e}")
-            logger.info("Auto-backup sent to admin")
-        except Exception as e:
-            logger.error(f"Auto-backup failed: {e}")
+    if not ADMIN_ID:
+        return "no admin"
+    data = await db.export_all_data()
+    file = BufferedInputFile(
+        data.encode("utf-8"), filename="parking_auto_backup.json"
+    )
+    await bot.send_document(ADMIN_ID, file, caption="📦 Автоматический бэкап (7 дней)")
+    logger.info("Auto-backup sent to admin")
+    return {"bytes": len(data)}
 
 
 # === Expired passes cleanup ===
 
-async def cleanup_loop(db: Database):
-    """Deactivate expired guest passes and reset free spots."""
-    while True:
-        await asyncio.sleep(60 * 60)  # Every hour
+CLEANUP_INTERVAL = 60 * 60  # every hour
+
+
+async def cleanup(db: Database):
+    """Hourly backstop for ExpiryScheduler (e.g. rows written by another process)."""
+    expired = await db.deactivate_expired_passes()
+    if expired > 0:
+        logger.info(f"Deactivated {expired} expired guest passes")
+    reset = await db.expire_free_spots()
+    if reset > 0:
+        logger.info(f"Reset {reset} expired free spots")
+    return {"passes": expired, "spots": reset}
+
+
+# === Retention (partitions, archive, old rows) ===
+
+RETENTION_INTERVAL = 24 * 60 * 60  # daily, first run at startup
+
+
+async def retention(bot: Bot, db: Database):
+    """Pre-create message partitions, archive cold months, purge old rows."""
+    from config import (
+        ADMIN_ID, ARCHIVE_DIR, MESSAGES_RETENTION_MONTHS,
+        REMINDERS_RETENTION_DAYS, GUEST_PASSES_RETENTION_DAYS,
+    )
+    from aiogram.types import FSInputFile
+
+    await db.ensure_message_partitions()
+    archived = await db.archive_message_partitions(MESSAGES_RETENTION_MONTHS, ARCHIVE_DIR)
+    for path in archived:
+        # Render's disk is ephemeral — the admin's chat is the durable copy
+        if not ADMIN_ID:
+            continue
         try:
-            expired = await db.deactivate_expired_passes()
-            if expired > 0:
-                logger.info(f"Deactivated {expired} expired guest passes")
+            await bot.send_document(
+                ADMIN_ID, FSInputFile(path),
+                caption=f"🗄 Архив сообщений: {os.path.basename(path)}",
+            )
         except Exception as e:
-            logger.error(f"Cleanup failed: {e}")
+            logger.error(f"Archive upload {path} failed: {e}")
+
+    reminders = await db.delete_sent_reminders(REMINDERS_RETENTION_DAYS)
+    passes = await db.delete_stale_guest_passes(GUEST_PASSES_RETENTION_DAYS)
+    if archived or reminders or passes:
+        logger.info(
+            f"Retention: {len(archived)} partitions archived, "
+            f"{reminders} reminders and {passes} guest passes deleted"
+        )
+    return {"partitions": len(archived), "reminders": reminders, "guest_passes": passes}
 
 
 # === Reminders loop ===
 
-async def reminders_loop(bot: Bot, db: Database):
-    """Check for pending reminders every 60 seconds and send them."""
-    while True:
-        await asyncio.sleep(60)
-        try:
-            pending = await db.get_pending_reminders()
-            for r in pending:
-                try:
-                    await bot.send_message(
-                        r["user_id"],
-                        f"⏰ <b>Напоминание об оплате</b>\n\n"
-                        f"Место <b>{r['spot_number']}</b> — пора оплатить парковку!",
-                        parse_mode="HTML",
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send reminder {r['id']} to {r['user_id']}: {e}")
-                await db.mark_reminder_sent(r["id"])
-        except Exception as e:
-            logger.error(f"Reminders loop error: {e}")
+REMINDERS_INTERVAL = 60  # seconds
+
+
+async def send_reminders(bot: Bot, db: Database):
+    """Send the pending reminders (checked every 60 seconds).
+
+    A recurring reminder is moved on to its next occurrence instead of being
+    marked sent.
+    """
+    pending = await db.get_pending_reminders()
+    now = datetime.now(timezone.utc)
+    for r in pending:
+        next_at = following(r["rule"], r["remind_at"], r["repeat_until"], now)
+        next_text = (
+            f"\n\n🔁 Следующее: {next_at.astimezone(MSK_TZ).strftime('%d.%m.%Y %H:%M')} МСК"
+            if next_at else ""
+        )
+        if not r["delivery_status"]:
+            await deliver(db, r["user_id"], lambda: bot.send_message(
+                r["user_id"],
+                f"⏰ <b>Напоминание об оплате</b>\n\n"
+                f"Место <b>{r['spot_number']}</b> — пора оплатить парковку!"
+                f"{next_text}",
+                parse_mode="HTML",
+            ))
+        if next_at:
+            await db.reschedule_reminder(r["id"], next_at)
+        else:
+            await db.mark_reminder_sent(r["id"])
+    return len(pending)
 
 
 # === Startup broadcast ===
@@ -130,25 +209,97 @@ async def startup_broadcast(bot: Bot, db: Database):
     users = await db.get_all_approved_users()
     sent = 0
     for user in users:
-        try:
-            await bot.send_message(
-                user["telegram_id"],
-                "🔄 <b>Бот обновлён!</b>\n\nМеню обновлено — все функции доступны через кнопки ниже.",
-                parse_mode="HTML",
-                reply_markup=main_menu_keyboard(),
-            )
+        _, failure = await deliver(db, user["telegram_id"], lambda: bot.send_message(
+            user["telegram_id"],
+            "🔄 <b>Бот обновлён!</b>\n\nМеню обновлено — все функции доступны через кнопки ниже.",
+            parse_mode="HTML",
+            reply_markup=main_menu_keyboard(),
+        ))
+        if not failure:
             sent += 1
-        except Exception as e:
-            logger.warning(f"Startup broadcast failed for {user['telegram_id']}: {e}")
 
     await db.set_setting("last_broadcast_version", BOT_VERSION)
     logger.info(f"Startup broadcast done: {sent} users notified (version {BOT_VERSION})")
+    return sent
+
+
+# === Dispatcher ===
+
+def build_dispatcher(db: Database) -> Dispatcher:
+    dp = Dispatcher()
+    dp.update.outer_middleware(UpdateContextMiddleware())
+
+    # Middlewares (order matters: rate_limit first, then access)
+    dp.message.middleware(RateLimitMiddleware())
+    dp.message.middleware(AccessMiddleware(db))
+    dp.callback_query.middleware(AccessMiddleware(db))
+
+    # Routers (order matters: specific first, catch-all last)
+    dp.include_router(start.router)
+    dp.include_router(parking.router)
+    dp.include_router(announcements.router)
+    dp.include_router(search.router)
+    dp.include_router(export.router)
+    dp.include_router(group.router)  # Group handler last (catch-all for groups)
+    return dp
+
+
+# === Sharded mode (WORKERS > 0) ===
+
+async def start_worker(index: int, events):
+    """Runs in each shard process: handles the updates routed to it."""
+    # One rotating file per process — they can't safely share bot.log
+    setup_logging(f"bot.shard-{index}.log", LOG_JSON)
+    db = create_database(DATABASE_URL)
+    await db.connect(
+        DATABASE_URL, migrate=False, replica_url=REPLICA_DATABASE_URL,
+        replica_max_lag=REPLICA_MAX_LAG, read_your_writes=READ_YOUR_WRITES_WINDOW,
+    )
+    # Deadlines are scheduled by the ingress, which owns the ExpiryScheduler
+    db.expiry_listener = lambda kind, deadline: events.put_nowait((kind, deadline))
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=None))
+    return bot, build_dispatcher(db), db
+
+
+POLL_TIMEOUT = 30  # seconds a getUpdates long poll waits for updates
+POLL_BACKOFF_MAX = 60
+
+
+async def ingress_loop(bot: Bot, dp: Dispatcher, supervisor: ShardSupervisor):
+    """Long-poll Telegram and hand every update to its user's shard.
+
+    The offset only moves past an update once supervisor.route() has recorded
+    it in its shard's backlog, which is replayed if a worker crashes. Telegram
+    drops an update at the next getUpdates after that, so delivery is
+    at-most-once across an ingress restart: updates routed but not yet
+    finished by a worker (the "backlog" in /ready) are lost with the process.
+    """
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates,
+            )
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            logger.error(f"getUpdates failed, retrying in {backoff}s: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+            continue
+        backoff = 1
+        for update in updates:
+            supervisor.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
 
 
 # === Main ===
 
 async def main():
-    setup_logging()
+    setup_logging("bot.log", LOG_JSON)
     logger.info("Starting Parking Bot...")
 
     if not BOT_TOKEN:
@@ -160,39 +311,51 @@ async def main():
         return
 
     # Database
-    db = Database()
-    await db.connect(DATABASE_URL)
+    db = create_database(DATABASE_URL)
+    await db.connect(
+        DATABASE_URL, replica_url=REPLICA_DATABASE_URL,
+        replica_max_lag=REPLICA_MAX_LAG, read_your_writes=READ_YOUR_WRITES_WINDOW,
+    )
 
     # Bot & dispatcher
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=None))
-    dp = Dispatcher()
-
-    # Middlewares (order matters: rate_limit first, then access)
-    dp.message.middleware(RateLimitMiddleware())
-    dp.message.middleware(AccessMiddleware(db))
-    dp.callback_query.middleware(AccessMiddleware(db))
-
-    # Routers (order matters: specific first, catch-all last)
-    dp.include_router(start.router)
-    dp.include_router(parking.router)
-    dp.include_router(announcements.router)
-    dp.include_router(group.router)  # Group handler last (catch-all for groups)
+    dp = build_dispatcher(db)
+
+    # Background tasks — supervised, restarted with backoff, reported by /ready
+    expiry = ExpiryScheduler(db)
+    db.expiry_listener = expiry.schedule
+    lag = LoopLagMonitor(warn_after=LOOP_LAG_WARN)
+    tasks = TaskSupervisor()
+    tasks.service("expiry", expiry.run)
+    tasks.service("loop_lag", lag.run)
+    tasks.every("auto_backup", lambda: auto_backup(bot, db), AUTO_BACKUP_INTERVAL)
+    tasks.every("cleanup", lambda: cleanup(db), CLEANUP_INTERVAL)
+    tasks.every("retention", lambda: retention(bot, db), RETENTION_INTERVAL, first_run=0)
+    tasks.every("reminders", lambda: send_reminders(bot, db), REMINDERS_INTERVAL)
+    tasks.once("startup_broadcast", lambda: startup_broadcast(bot, db))
+    supervisor = None
+    if WORKERS > 0 and db.bus is None:
+        # Caches are invalidated in-process only — worker processes would go stale
+        logger.warning("WORKERS needs the Postgres backend; running in a single process")
+    elif WORKERS > 0:
+        supervisor = ShardSupervisor(WORKERS, start_worker, on_event=expiry.schedule)
+        supervisor.start()
 
     # Web server for health checks
-    web_runner = await run_web_server()
-
-    # Background tasks
-    asyncio.create_task(auto_backup_loop(bot, db))
-    asyncio.create_task(cleanup_loop(db))
-    asyncio.create_task(reminders_loop(bot, db))
-    asyncio.create_task(startup_broadcast(bot, db))
+    web_runner = await run_web_server(db, tasks, lag, supervisor)
 
-    logger.info("Bot is running!")
+    logger.info("Bot is running!" + (f" ({WORKERS} shard workers)" if supervisor else ""))
 
     try:
-        await dp.start_polling(bot)
+        if supervisor:
+            await ingress_loop(bot, dp, supervisor)
+        else:
+            await dp.start_polling(bot)
     finally:
         logger.info("Shutting down...")
+        if supervisor:
+            await supervisor.stop()
+        await tasks.stop()
         await web_runner.cleanup()
         await db.close()
         await bot.session.close()
@@ -4,7 +4,12 @@ from dotenv import load_dotenv
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# postgresql://… or sqlite:///parking.db (embedded, single process — see services/sqlite_database.py)
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional streaming replica for read-heavy queries (history, /map, /stats, exports)
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+REPLICA_MAX_LAG = 5.0  # seconds; a replica further behind is skipped
+READ_YOUR_WRITES_WINDOW = 10.0  # seconds a user's reads stay on the primary after a write
 
 # Admin — единственный главный администратор
 _admin_str = os.getenv("ADMIN_ID", "0")
@@ -14,6 +19,30 @@ ADMIN_ID: int = int(_admin_str) if _admin_str and _admin_str.strip().isdigit() e
 RATE_LIMIT_MESSAGES = 10
 RATE_LIMIT_PERIOD = 60  # seconds
 
+# Alerts to the same spot within this window are merged into one DM (edited) and one log row
+ALERT_COALESCE_WINDOW = 10 * 60  # seconds
+
+# Logging — bot.log is always JSON lines; LOG_JSON=1 makes the console JSON too
+LOG_JSON = os.getenv("LOG_JSON", "") == "1"
+
+# GET /analytics?days=N (JSON) is served only when set; send "Authorization: Bearer <token>"
+ANALYTICS_TOKEN = os.getenv("ANALYTICS_TOKEN")
+
+# Readiness (/ready)
+READY_DB_TIMEOUT = 2  # seconds for the DB ping, including waiting for a pool connection
+LOOP_LAG_WARN = 0.5  # seconds; each probe over this is logged
+LOOP_LAG_MAX = 2.0  # seconds; worst lag in the last minute over this means not ready
+
+# Sharded mode — 0 runs everything in one process; N > 0 starts one ingress
+# process that polls Telegram and N worker processes keyed by user id
+WORKERS = int(os.getenv("WORKERS", "0"))
+
+# Retention — messages are archived by whole monthly partitions
+MESSAGES_RETENTION_MONTHS = 12
+REMINDERS_RETENTION_DAYS = 90
+GUEST_PASSES_RETENTION_DAYS = 90
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+
 # Bot version — bump to broadcast updated menu to all users on next deploy
 BOT_VERSION = "2.3"
 
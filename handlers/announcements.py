@@ -6,6 +6,8 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 
+from services.delivery import deliver
+
 logger = logging.getLogger(__name__)
 router = Router()
 
@@ -93,16 +95,15 @@ async def announce_send(callback: CallbackQuery, state: FSMContext, db, **kwargs
     await callback.answer()
 
     for user in users:
-        try:
-            await bot.send_message(
-                user["telegram_id"],
-                f"📢 <b>Объявление</b>\n\n{text}",
-                parse_mode="HTML",
-            )
-            sent += 1
-        except Exception as e:
+        _, failure = await deliver(db, user["telegram_id"], lambda: bot.send_message(
+            user["telegram_id"],
+            f"📢 <b>Объявление</b>\n\n{text}",
+            parse_mode="HTML",
+        ))
+        if failure:
             failed += 1
-            logger.warning(f"Announce delivery failed for {user['telegram_id']}: {e}")
+        else:
+            sent += 1
 
     await callback.message.edit_text(
         f"✅ Объявление отправлено: {sent} получили, {failed} не доставлено."
@@ -0,0 +1,107 @@
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+
+from aiogram import Router
+from aiogram.filters import Command
+from aiogram.types import Message, FSInputFile
+
+from config import STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED, STATUS_BANNED
+from config import SOURCE_GROUP, SOURCE_PRIVATE, SOURCE_NOTIFY
+from services.paging import parse_filters
+from services.recurrence import MSK_TZ, parse_date
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+_FILTER_KEYS = {
+    "статус": "status", "status": "status",
+    "места": "spots", "spots": "spots",
+    "с": "since", "since": "since",
+    "по": "until", "until": "until",
+}
+_SPOT_RANGE_RE = re.compile(r"^(\d+)(?:[-–](\d+))?$")
+_STATUSES = {
+    "users": (STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED, STATUS_BANNED),
+    "pending": (),
+    "messages": (SOURCE_GROUP, SOURCE_NOTIFY, SOURCE_PRIVATE),
+}
+_CAPTIONS = {
+    "users": "👥 Пользователи и места",
+    "pending": "⏳ Заявки на регистрацию",
+    "messages": "💬 Сообщения",
+}
+
+USAGE = (
+    "📤 <b>Экспорт в CSV</b>\n\n"
+    "<code>/export users|pending|messages [статус:…] [места:100-200] [с:01.03.2026] [по:15.03.2026]</code>\n\n"
+    "<b>users</b> — пользователи с их местами, статус: "
+    f"{', '.join(_STATUSES['users'])}\n"
+    "<b>pending</b> — заявки, ожидающие одобрения\n"
+    "<b>messages</b> — сообщения, статус — источник: "
+    f"{', '.join(_STATUSES['messages'])}\n\n"
+    "«с/по» — дата регистрации для пользователей и дата отправки для сообщений.\n"
+    "Пример: <code>/export messages места:100-150 с:01.03.2026</code>"
+)
+
+
+def parse_export_args(kind: str, args: str) -> dict:
+    """``/export`` filters → export_csv keyword arguments. Raises ValueError."""
+    parsed, rest = parse_filters(args, _FILTER_KEYS)
+    filters = {}
+    for key, field, value in parsed:
+        if field == "status":
+            if value.lower() not in _STATUSES[kind]:
+                raise ValueError(f"«{key}:» для {kind}: {', '.join(_STATUSES[kind]) or 'не поддерживается'}")
+            filters["status"] = value.lower()
+        elif field == "spots":
+            match = _SPOT_RANGE_RE.match(value)
+            if not match:
+                raise ValueError(f"«{key}:» ожидает номер или диапазон, например 100-200")
+            filters["spot_from"] = int(match[1])
+            filters["spot_to"] = int(match[2] or match[1])
+        else:
+            try:
+                day = parse_date(value)
+            except ValueError:
+                raise ValueError(f"«{key}:» ожидает дату ДД.ММ.ГГГГ")
+            # "по" is inclusive — up to the start of the next day
+            filters[field] = day + timedelta(days=1) if field == "until" else day
+    if rest:
+        raise ValueError(f"Непонятный фильтр: {rest.split()[0]}")
+    return filters
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, db, is_moderator: bool, **kwargs):
+    if message.chat.type != "private" or not is_moderator:
+        return
+
+    args = message.text.split(maxsplit=2)
+    kind = args[1].lower() if len(args) > 1 else ""
+    if kind not in _STATUSES:
+        await message.answer(USAGE, parse_mode="HTML")
+        return
+    try:
+        filters = parse_export_args(kind, args[2] if len(args) > 2 else "")
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}\n\n{USAGE}", parse_mode="HTML")
+        return
+
+    fd, path = tempfile.mkstemp(suffix=".csv.gz")
+    os.close(fd)
+    try:
+        count = await db.export_csv(kind, path, **filters)
+        filename = f"{kind}_{datetime.now(MSK_TZ):%Y%m%d_%H%M}.csv.gz"
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"{_CAPTIONS[kind]}: {count} строк",
+        )
+        logger.info(f"Export {kind} {filters} by {message.from_user.id}: {count} rows")
+    except Exception as e:
+        logger.error(f"Export {kind} failed: {e}")
+        await message.answer(f"❌ Ошибка экспорта: {e}")
+    finally:
+        os.remove(path)
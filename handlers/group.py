@@ -4,11 +4,85 @@ import logging
 from aiogram import Router, Bot
 from aiogram.types import Message
 
-from config import SOURCE_GROUP
+from config import SOURCE_GROUP, ALERT_COALESCE_WINDOW
+from services.alerts import remember_dms, send_summary
+from services.delivery import fan_out
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+MAX_SPOTS_PER_MENTION = 10
+
+# A spot number: 1–4 digits that aren't part of a word, a time (10:00), a date
+# (01.03, 01/03/2026), a range/phone fragment (123-45) or a count ("2 машины")
+_SPOT = (
+    r"(?<![\w+./:-])\d{1,4}(?![\w]|[.:/-]\d)"
+    r"(?!\s*(?:машин|авто|раз\b|раза\b|мин|час|шт))"
+)
+_SEPARATOR = r"\s*(?:,|\bи\b|\band\b|&)\s*"
+# "142", "142, 143", "142 и 143", "142 & 143", "№142 и №143"
+_SPOT_LIST = rf"(?:№\s*)?{_SPOT}(?:{_SEPARATOR}(?:№\s*)?{_SPOT})*"
+# A list counts as spots after a spot keyword ("место 142", "м/м 142, 143",
+# "№142") or at the very start of the text ("@bot 142 перегородили выезд")
+_SPOT_KEYWORD = r"\bмест(?:о|а|у|ом|е)?\b[\s:]*|\bм/м\s*"
+_SPOT_LIST_RE = re.compile(rf"(?:{_SPOT_KEYWORD}|^\s*)(?P<spots>{_SPOT_LIST})", re.IGNORECASE)
+_BARE_SPOT_LIST_RE = re.compile(_SPOT_LIST, re.IGNORECASE)
+_SEPARATOR_RE = re.compile(rf"^(?:{_SEPARATOR}|\s*)$", re.IGNORECASE)
+_EDGE_SEPARATOR_RE = re.compile(rf"^{_SEPARATOR}|{_SEPARATOR}$", re.IGNORECASE)
+_SPOT_NUMBER_RE = re.compile(r"\d+")
+_SPACE_BEFORE_PUNCT_RE = re.compile(r"\s+([,.;:!?])")
+# Russian phone numbers: +7 (999) 123-45-67, 8 999 123 45 67, 89991234567
+_PHONE_RE = re.compile(
+    r"(?<!\w)(?:\+\d{1,3}|8)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?!\d)"
+)
+
+
+def parse_spot_mentions(text: str) -> tuple[list[int], str]:
+    """Spot numbers referenced in ``text`` (in order, deduplicated) and the text
+    with those numbers removed.
+
+    Numbers count as spots after a spot keyword or at the start of the text;
+    without either, the first list of numbers that aren't counts is taken.
+    Times, dates, phone numbers and counts are kept as text; the spot keyword
+    and the separators between spots are removed along with the numbers.
+    """
+    phones = [m.span() for m in _PHONE_RE.finditer(text)]
+
+    def in_phone(start: int, end: int) -> bool:
+        return any(s < end and start < e for s, e in phones)
+
+    spans = [
+        m.span() for m in _SPOT_LIST_RE.finditer(text) if not in_phone(*m.span("spots"))
+    ]
+    if not spans:
+        first = next(
+            (m for m in _BARE_SPOT_LIST_RE.finditer(text) if not in_phone(*m.span())), None
+        )
+        if first:
+            spans.append(first.span())
+    # "место 142 и место 143" — lists joined only by a separator are one mention
+    merged: list[tuple[int, int]] = []
+    for start, end in spans:
+        if merged and _SEPARATOR_RE.match(text[merged[-1][1]:start]):
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    spans = merged
+
+    spots: list[int] = []
+    kept = []
+    pos = 0
+    for start, end in spans:
+        for number in _SPOT_NUMBER_RE.findall(text[start:end]):
+            if int(number) not in spots:
+                spots.append(int(number))
+        kept.append(text[pos:start])
+        pos = end
+    kept.append(text[pos:])
+    rest = _SPACE_BEFORE_PUNCT_RE.sub(r"\1", " ".join("".join(kept).split()))
+    # "Место 142 и ещё 5 машин" — no "и" left dangling at the front
+    return spots, _EDGE_SEPARATOR_RE.sub("", rest.strip(" ,.:;—-")).strip(" ,.:;—-")
+
 
 @router.message()
 async def handle_group_message(message: Message, db, **kwargs):
@@ -45,73 +119,118 @@ async def handle_group_message(message: Message, db, **kwargs):
             sender_label = "Житель"
             reply_spot = None
 
-        # Remove mention (case-insensitive), find spot number; preserve original case
+        # Remove mention (case-insensitive), find spot numbers; preserve original case
         clean = re.sub(re.escape(bot_mention), "", message.text, flags=re.IGNORECASE).strip()
-        numbers = re.findall(r"\b(\d{1,4})\b", clean)
+        spot_numbers, message_text = parse_spot_mentions(clean)
 
-        if not numbers:
+        if not spot_numbers:
             await message.reply(
                 f"Укажите номер парковочного места.\n"
                 f"Пример: @{bot_info.username} 142 перегородили выезд"
             )
             return
+        if len(spot_numbers) > MAX_SPOTS_PER_MENTION:
+            await message.reply(f"Можно указать не больше {MAX_SPOTS_PER_MENTION} мест за раз.")
+            return
 
-        spot_number = int(numbers[0])
-        owners = await db.get_spot_owners(spot_number)
+        owners_by_spot = await db.get_owners_for_spots(spot_numbers)
+        known = [n for n in spot_numbers if n in owners_by_spot]
+        unknown = [n for n in spot_numbers if n not in owners_by_spot]
 
-        if not owners:
-            await message.reply(f"Место {spot_number} не зарегистрировано в системе.")
+        if not known:
+            if len(unknown) == 1:
+                await message.reply(f"Место {unknown[0]} не зарегистрировано в системе.")
+            else:
+                await message.reply(f"Места {_join(unknown)} не зарегистрированы в системе.")
             return
 
-        # Build message text (remove spot number from clean text)
-        message_text = re.sub(r"\b" + numbers[0] + r"\b", "", clean, count=1).strip()
         if not message_text:
             message_text = "Обращение по поводу вашего места"
 
-        # Log
-        await db.add_message(message.from_user.id, spot_number, message_text, SOURCE_GROUP)
+        # Log — one row per spot, or merged into the spot's open alert window
+        alerts = {}
+        for n in known:
+            alerts[n] = await db.coalesce_alert(
+                n, ALERT_COALESCE_WINDOW, message.from_user.id, sender_label, message_text, SOURCE_GROUP,
+            )
+        fresh = [n for n in known if alerts[n][0]]
+        repeated = [n for n in known if not alerts[n][0]]
+
+        # One DM per owner, even if they own several of the mentioned spots
+        owner_spots: dict[int, list[int]] = {}
+        for n in fresh:
+            for o in owners_by_spot[n]:
+                if not o["delivery_status"]:
+                    owner_spots.setdefault(o["telegram_id"], []).append(n)
 
-        # DM all owners
         reply_hint = (
             f"\n\n💡 Ответить: напишите в группе <code>@{bot_info.username} {reply_spot} ваш текст</code>"
             if reply_spot else ""
         )
-        sent = 0
-        for owner in owners:
-            try:
-                await bot.send_message(
-                    owner["telegram_id"],
-                    f"💬 <b>Сообщение из группы</b>\n\n"
-                    f"По поводу места <b>{spot_number}</b>:\n"
-                    f"«{message_text}»\n\n"
-                    f"От: {sender_label}"
-                    f"{reply_hint}",
-                    parse_mode="HTML",
-                )
-                sent += 1
-            except Exception as e:
-                logger.error(f"Failed to DM owner {owner['telegram_id']}: {e}")
-
-        if sent == 0:
+        results = await fan_out(
+            db,
+            owner_spots,
+            lambda owner_id: bot.send_message(
+                owner_id,
+                f"💬 <b>Сообщение из группы</b>\n\n"
+                f"По поводу {_spots_of(owner_spots[owner_id], bold=True)}:\n"
+                f"«{message_text}»\n\n"
+                f"От: {sender_label}"
+                f"{reply_hint}",
+                parse_mode="HTML",
+            ),
+        )
+        notified = {n for uid, (_, failure) in results.items() if not failure for n in owner_spots[uid]}
+        # Only a DM about a single spot can later be edited into that spot's summary
+        for n in fresh:
+            await remember_dms(db, bot, n, alerts[n][1], {
+                uid: result.message_id for uid, (result, failure) in results.items()
+                if not failure and owner_spots[uid] == [n]
+            })
+        for n in repeated:
+            recipients = [o["telegram_id"] for o in owners_by_spot[n] if not o["delivery_status"]]
+            summary_results = await send_summary(db, bot, n, alerts[n][1], recipients)
+            if any(not failure for _, failure in summary_results.values()):
+                notified.add(n)
+        missed = [n for n in known if n not in notified]
+
+        if not notified:
             await message.reply(
-                f"⚠️ Не удалось уведомить владельца места {spot_number}.\n"
+                f"⚠️ Не удалось уведомить владельца {_spots_of(known)}.\n"
                 f"Владелец должен написать боту /start в личные сообщения."
             )
             return
 
+        notified_label = _spots_of([n for n in known if n in notified])
+        warnings = ""
+        if missed:
+            warnings += f"\n⚠️ Не удалось уведомить владельца {_spots_of(missed)}."
+        if unknown:
+            warnings += f"\n❓ Не зарегистрированы: {_join(unknown)}."
+
         # Try DM to sender, fallback to group reply
         if message.from_user:
             try:
                 await bot.send_message(
                     message.from_user.id,
-                    f"✅ Уведомление отправлено владельцу места {spot_number}.",
+                    f"✅ Уведомление отправлено владельцу {notified_label}.{warnings}",
                 )
-                await message.reply("✅ Уведомление отправлено.")
+                await message.reply("✅ Уведомление отправлено." + warnings)
             except Exception:
                 await message.reply(
-                    f"✅ Владелец места {spot_number} уведомлён.\n"
+                    f"✅ Владелец {notified_label} уведомлён.{warnings}\n"
                     f"Чтобы получать ответы в личку — напишите боту: @{bot_info.username}"
                 )
 
     except Exception as e:
         logger.error(f"handle_group_message error: {e}", exc_info=True)
+
+
+def _join(numbers: list[int]) -> str:
+    return ", ".join(str(n) for n in numbers)
+
+
+def _spots_of(numbers: list[int], bold: bool = False) -> str:
+    """Genitive: "места 142" / "мест 142, 143"."""
+    joined = f"<b>{_join(numbers)}</b>" if bold else _join(numbers)
+    return f"места {joined}" if len(numbers) == 1 else f"мест {joined}"
@@ -5,11 +5,21 @@ from aiogram import Router, F, Bot
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import (
+    Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton,
+    InlineKeyboardMarkup, InlineKeyboardButton,
+)
 
-from config import MENU_BUTTONS, SOURCE_NOTIFY, CANCEL_TEXT
+from config import MENU_BUTTONS, SOURCE_NOTIFY, SOURCE_REPORT, CANCEL_TEXT, ALERT_COALESCE_WINDOW
+from services.alerts import remember_dms, send_summary
+from services.delivery import fan_out
+from services.paging import fetch_page, nav_keyboard, parse_nav, compress_ranges, encode_cursor, decode_cursor
+from services.recurrence import MSK_TZ, describe_rule, parse_rule
 
 UK_PHONE = "+78007752411"
+HISTORY_PAGE_SIZE = 10
+MAP_SPOTS_PAGE_SIZE = 300  # spot numbers per "Все места" page
+
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -27,6 +37,7 @@ class HistoryState(StatesGroup):
 class ReminderState(StatesGroup):
     selecting_spot = State()
     waiting_for_datetime = State()
+    waiting_for_repeat = State()
 
 
 class DirectoryState(StatesGroup):
@@ -94,6 +105,8 @@ async def my_spot(message: Message, db, is_approved: bool, **kwargs):
     lines.append("")
     lines.append("📊 <b>Статистика за 30 дней</b>")
     lines.append(f"  ✉️ Сообщений по вашим местам: <b>{stats['messages_received']}</b>")
+    if stats["messages_sent"]:
+        lines.append(f"  📤 Отправлено вами: <b>{stats['messages_sent']}</b>")
     if stats["last_message"]:
         lm = stats["last_message"]
         lm_date = lm["created_at"].astimezone(msk_tz).strftime("%d.%m %H:%M")
@@ -173,31 +186,48 @@ async def notify_message(message: Message, state: FSMContext, db, **kwargs):
     # Get sender's spots for context
     sender_spots = await db.get_user_spots(message.from_user.id)
     sender_spot_text = ", ".join(str(s["spot_number"]) for s in sender_spots) if sender_spots else "?"
+    reporter = f"Место {sender_spot_text}" if sender_spots else "Житель"
 
-    # Log the message
-    await db.add_message(message.from_user.id, spot_number, text, SOURCE_NOTIFY)
+    # Log the message — merged into the spot's open alert window, if there is one
+    opened, alert = await db.coalesce_alert(
+        spot_number, ALERT_COALESCE_WINDOW, message.from_user.id, reporter, text, SOURCE_NOTIFY,
+    )
 
-    # Notify all owners
+    # Notify all owners at once (skip those known to have blocked the bot)
     owners = await db.get_spot_owners(spot_number)
+    recipients = [o["telegram_id"] for o in owners if not o["delivery_status"]]
     bot: Bot = message.bot
-    sent = 0
-    for owner in owners:
-        try:
-            await bot.send_message(
-                owner["telegram_id"],
+    if opened:
+        results = await fan_out(
+            db,
+            recipients,
+            lambda owner_id: bot.send_message(
+                owner_id,
                 f"✉️ <b>Сообщение от А/М {sender_spot_text}</b>\n\n"
                 f"По поводу места <b>{spot_number}</b>:\n"
                 f"«{text}»",
                 parse_mode="HTML",
-            )
-            sent += 1
-        except Exception as e:
-            logger.error(f"Failed to notify owner of spot {spot_number}: {e}")
+            ),
+        )
+        await remember_dms(db, bot, spot_number, alert, {
+            owner_id: result.message_id for owner_id, (result, failure) in results.items() if not failure
+        })
+    else:
+        # Repeat alert — the owners' DM is edited into a summary instead
+        results = await send_summary(db, bot, spot_number, alert, recipients)
+    sent = sum(1 for _, failure in results.values() if not failure)
 
     if sent > 0:
         owner_word = "владелец" if sent == 1 else f"владельцы ({sent})"
+        missed = len(owners) - sent
+        missed_text = f"\n⚠️ Не доставлено: {missed} (бот заблокирован или недоступен)." if missed else ""
+        if not opened:
+            missed_text += (
+                f"\nℹ️ Об этом месте уже сообщали — ваше сообщение добавлено "
+                f"к уведомлению (обращений: {alert['alerts']})."
+            )
         await message.answer(
-            f"✅ {owner_word.capitalize()} места {spot_number} уведомлён(ы)!",
+            f"✅ {owner_word.capitalize()} места {spot_number} уведомлён(ы)!{missed_text}",
             reply_markup=main_menu_keyboard(),
         )
     else:
@@ -225,7 +255,7 @@ async def history_start(message: Message, state: FSMContext, db, is_approved: bo
 
     if len(spots) == 1:
         # Show messages for the single spot directly
-        await _show_history(message, db, spots[0]["spot_number"])
+        await _show_history(message, db, str(spots[0]["spot_number"]))
         return
 
     # Multiple spots — ask which one
@@ -246,8 +276,7 @@ async def history_spot(message: Message, state: FSMContext, db, **kwargs):
     text = message.text.strip().lower()
 
     if text in ("все", "all"):
-        messages_list = await db.get_messages_for_user_spots(message.from_user.id, 10)
-        await _format_history(message, messages_list, "всем вашим местам")
+        await _show_history(message, db, "all", restore_menu=True)
         await state.clear()
         return
 
@@ -269,24 +298,88 @@ async def history_spot(message: Message, state: FSMContext, db, **kwargs):
         )
         return
 
-    await _show_history(message, db, spot_number)
+    await _show_history(message, db, str(spot_number), restore_menu=True)
     await state.clear()
 
 
-async def _show_history(message: Message, db, spot_number: int):
-    messages_list = await db.get_messages_for_spot(spot_number, 10)
-    await _format_history(message, messages_list, f"месту {spot_number}")
+@router.callback_query(F.data.startswith("hist_"))
+async def history_page(callback: CallbackQuery, db, is_approved: bool, **kwargs):
+    """Older/newer navigation — edits the history message in place."""
+    if not is_approved:
+        await callback.answer("Вы не зарегистрированы", show_alert=True)
+        return
 
+    # Format: hist_{all|spot}_{o|n}_{created_at µs}.{message_id}
+    try:
+        _, scope, direction, key = callback.data.split("_", 3)
+        cursor = decode_cursor(key)
+    except ValueError:
+        await callback.answer()
+        return
 
-async def _format_history(message: Message, messages_list, label: str):
-    if not messages_list:
-        await message.answer(
-            f"Нет сообщений по {label}.",
-            reply_markup=main_menu_keyboard(),
-        )
+    if scope != "all":
+        spots = await db.get_user_spots(callback.from_user.id)
+        if int(scope) not in (s["spot_number"] for s in spots):
+            await callback.answer("Это не ваше место", show_alert=True)
+            return
+
+    if direction == "o":
+        rows, has_more = await _fetch_history_page(db, callback.from_user.id, scope, before=cursor)
+        has_older, has_newer = has_more, True
+    else:
+        rows, has_more = await _fetch_history_page(db, callback.from_user.id, scope, after=cursor)
+        has_older, has_newer = True, has_more
+
+    if not rows:
+        # Cursor points past deleted rows — start over from the newest page
+        rows, has_older = await _fetch_history_page(db, callback.from_user.id, scope)
+        has_newer = False
+
+    text, keyboard = _format_history(rows, scope, has_older, has_newer)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
+
+async def _show_history(message: Message, db, scope: str, restore_menu: bool = False):
+    rows, has_older = await _fetch_history_page(db, message.from_user.id, scope)
+    text, keyboard = _format_history(rows, scope, has_older, False)
+    if keyboard is None:
+        await message.answer(text, parse_mode="HTML", reply_markup=main_menu_keyboard())
         return
+    # A message can carry either the reply menu or inline navigation, not both
+    if restore_menu:
+        await message.answer("Главное меню.", reply_markup=main_menu_keyboard())
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+
+async def _fetch_history_page(db, user_id: int, scope: str, before=None, after=None):
+    """One keyset page (newest first) plus whether more rows exist in that direction."""
+    limit = HISTORY_PAGE_SIZE + 1
+    if scope == "all":
+        rows = await db.get_messages_for_user_spots(user_id, limit, before=before, after=after)
+    else:
+        rows = await db.get_messages_for_spot(int(scope), limit, before=before, after=after)
+
+    has_more = len(rows) > HISTORY_PAGE_SIZE
+    if has_more:
+        # The extra row is the one farthest from the cursor
+        rows = rows[1:] if after is not None else rows[:-1]
+    return rows, has_more
+
+
+def _history_cursor(scope: str, direction: str, row) -> str:
+    return f"hist_{scope}_{direction}_{encode_cursor(row['created_at'], row['id'])}"
+
 
-    lines = [f"📨 <b>Последние сообщения по {label}:</b>\n"]
+def _format_history(messages_list, scope: str, has_older: bool, has_newer: bool):
+    label = "всем вашим местам" if scope == "all" else f"месту {scope}"
+    if not messages_list:
+        return f"Нет сообщений по {label}.", None
+
+    if has_newer:
+        lines = [f"📨 <b>Более ранние сообщения по {label}:</b>\n"]
+    else:
+        lines = [f"📨 <b>Последние сообщения по {label}:</b>\n"]
     for m in messages_list:
         date = m["created_at"].strftime("%d.%m %H:%M")
         from_name = m.get("from_name") or "Неизвестный"
@@ -296,7 +389,17 @@ async def _format_history(message: Message, messages_list, label: str):
             f"   {m['message_text']}"
         )
 
-    await message.answer("\n".join(lines), parse_mode="HTML", reply_markup=main_menu_keyboard())
+    buttons = []
+    if has_older:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Старее", callback_data=_history_cursor(scope, "o", messages_list[-1]),
+        ))
+    if has_newer:
+        buttons.append(InlineKeyboardButton(
+            text="Новее ➡️", callback_data=_history_cursor(scope, "n", messages_list[0]),
+        ))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return "\n".join(lines), keyboard
 
 
 # === Reminder (Напомнить об оплате) ===
@@ -315,13 +418,8 @@ async def reminder_start(message: Message, state: FSMContext, db, is_approved: b
     # Show active reminders
     active = await db.get_user_reminders(message.from_user.id)
     if active:
-        lines = ["<b>Активные напоминания:</b>\n"]
-        for r in active:
-            # Convert UTC to MSK (UTC+3) for display
-            msk_time = r["remind_at"].astimezone(timezone(timedelta(hours=3)))
-            lines.append(f"⏰ Место {r['spot_number']} — {msk_time.strftime('%d.%m.%Y %H:%M')} МСК")
-        lines.append("")
-        await message.answer("\n".join(lines), parse_mode="HTML")
+        text, keyboard = _format_reminders(active)
+        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
 
     if len(spots) == 1:
         await state.update_data(spot_number=spots[0]["spot_number"])
@@ -346,6 +444,37 @@ async def reminder_start(message: Message, state: FSMContext, db, is_approved: b
         await state.set_state(ReminderState.selecting_spot)
 
 
+def _format_reminders(active) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Active reminders with a cancel button each (a recurring one is cancelled as a whole)."""
+    if not active:
+        return "Активных напоминаний нет.", None
+    lines = ["<b>Активные напоминания:</b>\n"]
+    buttons = []
+    for r in active:
+        msk_time = r["remind_at"].astimezone(MSK_TZ)
+        line = f"⏰ #{r['id']} Место {r['spot_number']} — {msk_time.strftime('%d.%m.%Y %H:%M')} МСК"
+        if r["rule"]:
+            line += f"\n     🔁 {describe_rule(r['rule'], r['repeat_until'])}"
+        lines.append(line)
+        buttons.append([InlineKeyboardButton(text=f"❌ Отменить #{r['id']}", callback_data=f"remdel_{r['id']}")])
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@router.callback_query(F.data.startswith("remdel_"))
+async def reminder_cancel(callback: CallbackQuery, db, **kwargs):
+    # Format: remdel_{reminder_id}
+    try:
+        reminder_id = int(callback.data.split("_")[1])
+    except ValueError:
+        await callback.answer()
+        return
+
+    cancelled = await db.cancel_reminder(callback.from_user.id, reminder_id)
+    text, keyboard = _format_reminders(await db.get_user_reminders(callback.from_user.id))
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer("Напоминание отменено" if cancelled else "Напоминание уже неактивно")
+
+
 @router.message(ReminderState.selecting_spot)
 async def reminder_select_spot(message: Message, state: FSMContext, db, **kwargs):
     text = message.text.strip()
@@ -405,15 +534,56 @@ async def reminder_datetime(message: Message, state: FSMContext, db, **kwargs):
         )
         return
 
+    await state.update_data(remind_at=dt_utc.isoformat())
+    await message.answer(
+        "🔁 <b>Повторять напоминание?</b>\n\n"
+        "• <b>нет</b> — один раз\n"
+        f"• <b>ежемесячно</b> — каждый месяц {dt_msk.day}-го, "
+        "или <b>ежемесячно 31</b> — в указанный день (в коротких месяцах — в последний)\n"
+        "• <b>каждые 30 дней</b> — с заданным интервалом\n\n"
+        "Можно добавить срок: <b>ежемесячно до 31.12.2026</b>",
+        parse_mode="HTML",
+        reply_markup=_repeat_keyboard(),
+    )
+    await state.set_state(ReminderState.waiting_for_repeat)
+
+
+def _repeat_keyboard() -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="Нет"), KeyboardButton(text="Ежемесячно")],
+            [KeyboardButton(text=CANCEL_TEXT)],
+        ],
+        resize_keyboard=True,
+    )
+
+
+@router.message(ReminderState.waiting_for_repeat)
+async def reminder_repeat(message: Message, state: FSMContext, db, **kwargs):
     data = await state.get_data()
     spot_number = data["spot_number"]
+    remind_at = datetime.fromisoformat(data["remind_at"])
+
+    try:
+        rule, repeat_until = parse_rule(message.text or "", remind_at)
+    except ValueError as e:
+        await message.answer(
+            f"{e}. Ответьте «нет», «ежемесячно», «ежемесячно 15» или «каждые 30 дней» "
+            f"(можно добавить «до ДД.ММ.ГГГГ»):",
+            reply_markup=_repeat_keyboard(),
+        )
+        return
 
-    reminder_id = await db.add_reminder(message.from_user.id, spot_number, dt_utc)
+    reminder_id = await db.add_reminder(
+        message.from_user.id, spot_number, remind_at, rule=rule, repeat_until=repeat_until,
+    )
 
+    repeat_line = f"Повтор: {describe_rule(rule, repeat_until)}\n" if rule else ""
     await message.answer(
         f"✅ <b>Напоминание установлено!</b>\n\n"
         f"Место: {spot_number}\n"
-        f"Когда: {dt_msk.strftime('%d.%m.%Y %H:%M')} МСК\n"
+        f"Когда: {remind_at.astimezone(MSK_TZ).strftime('%d.%m.%Y %H:%M')} МСК\n"
+        f"{repeat_line}"
         f"Номер: #{reminder_id}",
         parse_mode="HTML",
         reply_markup=main_menu_keyboard(),
@@ -488,10 +658,8 @@ async def find_free(message: Message, db, is_approved: bool, **kwargs):
         await message.answer("Вы не зарегистрированы. Используйте /start")
         return
 
-    free_spots = await db.get_free_spots()
+    actual = await db.get_free_spots()
     msk_tz = timezone(timedelta(hours=3))
-    now_utc = datetime.now(timezone.utc)
-    actual = [s for s in free_spots if not s["free_until"] or s["free_until"] > now_utc]
 
     if not actual:
         await message.answer(
@@ -529,19 +697,15 @@ async def cmd_map(message: Message, db, is_approved: bool, **kwargs):
     if message.chat.type != "private" or not is_approved:
         return
 
-    all_spots_rows = await db.get_all_spots()
-    free_spots = await db.get_free_spots()
+    total_spots = await db.count_spot_numbers()
+    actual_free = await db.get_free_spots()
     active_passes = await db.get_all_active_guest_passes()
 
     msk_tz = timezone(timedelta(hours=3))
-    now_utc = datetime.now(timezone.utc)
-
-    unique_spots = sorted(set(s["spot_number"] for s in all_spots_rows))
-    actual_free = [s for s in free_spots if not s["free_until"] or s["free_until"] > now_utc]
 
     lines = [
         "🗺 <b>Карта парковки</b>\n",
-        f"Всего зарегистрировано мест: <b>{len(unique_spots)}</b>\n",
+        f"Всего зарегистрировано мест: <b>{total_spots}</b>\n",
     ]
 
     if actual_free:
@@ -567,14 +731,42 @@ async def cmd_map(message: Message, db, is_approved: bool, **kwargs):
             )
         lines.append("")
 
-    if unique_spots:
-        spots_str = ", ".join(str(n) for n in unique_spots)
-        if len(spots_str) > 1500:
-            spots_str = spots_str[:1500] + "…"
-        lines.append(f"📋 Все места: {spots_str}")
-
     await message.answer("\n".join(lines), parse_mode="HTML", reply_markup=main_menu_keyboard())
 
+    # Separate message: the inline pager can't share one with the reply keyboard
+    if total_spots:
+        text, keyboard = await _render_spots_page(db)
+        await message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("spots_"))
+async def spots_page(callback: CallbackQuery, db, is_approved: bool, **kwargs):
+    if not is_approved:
+        await callback.answer()
+        return
+
+    # Format: spots_{p|n}_{spot_number}
+    try:
+        direction, key = parse_nav(callback.data)
+        cursor = int(key)
+    except ValueError:
+        await callback.answer()
+        return
+
+    text, keyboard = await _render_spots_page(db, direction, cursor)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
+async def _render_spots_page(db, direction: str = None, cursor: int = None):
+    numbers, has_prev, has_next = await fetch_page(
+        db.get_spot_numbers_page, MAP_SPOTS_PAGE_SIZE, direction, cursor,
+    )
+    if not numbers:
+        return "📋 Мест пока нет.", None
+    keyboard = nav_keyboard("spots", numbers, str, has_prev, has_next)
+    return f"📋 Все места: {compress_ranges(numbers)}", keyboard
+
 
 # === Report (Жалоба) ===
 
@@ -670,23 +862,18 @@ async def _deliver_report(message: Message, state: FSMContext, db, text: str, ph
     body = text if text else "<i>(без описания)</i>"
 
     bot: Bot = message.bot
-    staff_ids = await db.get_staff_ids()
-    delivered = 0
-    for sid in staff_ids:
-        try:
-            if photo_id:
-                await bot.send_photo(
-                    sid, photo_id,
-                    caption=header + body,
-                    parse_mode="HTML",
-                )
-            else:
-                await bot.send_message(sid, header + body, parse_mode="HTML")
-            delivered += 1
-        except Exception as e:
-            logger.warning(f"Report delivery to staff {sid} failed: {e}")
+    # photo_id is the file_id Telegram already holds for the user's photo, so
+    # every copy is a reference send — nothing is re-uploaded per moderator
+    async def send(sid: int):
+        if photo_id:
+            return await bot.send_photo(sid, photo_id, caption=header + body, parse_mode="HTML")
+        return await bot.send_message(sid, header + body, parse_mode="HTML")
+
+    results = await fan_out(db, await db.get_staff_ids(), send)
+    delivered = sum(1 for _, failure in results.values() if not failure)
 
     if delivered:
+        await db.record_incident(SOURCE_REPORT)
         await message.answer(
             f"✅ Жалоба отправлена администрации ({delivered} получили).",
             reply_markup=main_menu_keyboard(),
@@ -740,7 +927,8 @@ async def show_help(message: Message, db, is_approved: bool, is_admin: bool, is_
         "(сообщения за 30 дней, последнее сообщение, активные напоминания и гости).\n\n"
 
         f"<b>{MENU_BUTTONS['history']}</b>\n"
-        "Просмотреть последние сообщения по вашим местам.\n\n"
+        "Просмотреть сообщения по вашим местам. Кнопки «Старее»/«Новее» "
+        "листают историю в том же сообщении.\n\n"
 
         f"<b>{MENU_BUTTONS['find_free']}</b>\n"
         "Список мест, временно отмеченных владельцами как свободные. "
@@ -748,7 +936,8 @@ async def show_help(message: Message, db, is_approved: bool, is_admin: bool, is_
 
         f"<b>{MENU_BUTTONS['reminder']}</b>\n"
         "Установить напоминание об оплате парковки. Укажите дату и время "
-        "(московское) — бот пришлёт уведомление.\n\n"
+        "(московское) — бот пришлёт уведомление. Можно повторять ежемесячно "
+        "или каждые N дней; активные напоминания отменяются кнопкой в списке.\n\n"
 
         f"<b>{MENU_BUTTONS['add_spot']}</b>\n"
         "Добавить ещё одно парковочное место к вашему аккаунту.\n\n"
@@ -771,6 +960,7 @@ async def show_help(message: Message, db, is_approved: bool, is_admin: bool, is_
         "напишите в группе:\n"
         "<code>@Samolet_parking_bot 142 перегородили выезд</code>\n"
         "Бот отправит владельцу(ам) места 142 личное сообщение.\n"
+        "Можно указать несколько мест: <code>@Samolet_parking_bot 142 и 143 перекрыли выезд</code>\n"
     )
 
     if is_moderator:
@@ -779,7 +969,10 @@ async def show_help(message: Message, db, is_approved: bool, is_admin: bool, is_
 
             "<b>Команды:</b>\n"
             "/pending — список заявок на регистрацию\n"
-            "/announce — отправить объявление всем\n\n"
+            "/announce — отправить объявление всем\n"
+            "/search — поиск по сообщениям (текст, место:N, от:UserID, с:/по: дата)\n"
+            "/export users|pending|messages — CSV (статус:, места:N-M, с:/по: дата)\n"
+            "/unreachable — владельцы, которым бот не может написать\n\n"
 
             "<b>Управление местами:</b>\n"
             "<code>/spot info 142</code> — кто владелец(ы) места\n"
@@ -794,6 +987,7 @@ async def show_help(message: Message, db, is_approved: bool, is_admin: bool, is_
 
             "/users — все пользователи, их статусы и места\n"
             "/stats — статистика\n"
+            "/analytics [дней] — обращения по дням, часам и местам (по умолчанию 30 дней)\n"
             "/backup — скачать полный бэкап БД (JSON)\n"
             "/restore — загрузить бэкап для восстановления\n"
             "/approve UserID — одобрить пользователя вручную\n\n"
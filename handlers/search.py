@@ -0,0 +1,159 @@
+import html
+import logging
+from datetime import datetime, timedelta
+
+from aiogram import Router, F
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+
+from services.paging import encode_cursor, decode_cursor, parse_filters
+from services.recurrence import MSK_TZ, parse_date
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+SEARCH_PAGE_SIZE = 5
+
+_FILTER_KEYS = {
+    "место": "spot", "spot": "spot",
+    "от": "sender", "from": "sender",
+    "с": "since", "since": "since",
+    "по": "until", "until": "until",
+}
+
+USAGE = (
+    "🔎 <b>Поиск по сообщениям</b>\n\n"
+    "<code>/search текст [место:142] [от:UserID] [с:01.03.2026] [по:15.03.2026]</code>\n\n"
+    "Текст ищется по сообщениям и ответам (с учётом словоформ). "
+    "Поддерживаются «кавычки» для фразы, <code>or</code> и <code>-слово</code>.\n"
+    "Пример: <code>/search белая машина место:142 с:01.03.2026</code>"
+)
+
+
+def parse_search_args(args: str) -> dict:
+    """Split ``/search`` arguments into free text and filters. Raises ValueError."""
+    params = {"text": "", "spot": None, "sender": None, "since": None, "until": None}
+    filters, params["text"] = parse_filters(args, _FILTER_KEYS)
+    for key, field, value in filters:
+        if field in ("spot", "sender"):
+            if not value.isdigit():
+                raise ValueError(f"«{key}:» ожидает число")
+            params[field] = int(value)
+        else:
+            try:
+                day = parse_date(value)
+            except ValueError:
+                raise ValueError(f"«{key}:» ожидает дату ДД.ММ.ГГГГ")
+            # "по" is inclusive — search up to the start of the next day
+            params[field] = (day + timedelta(days=1) if field == "until" else day).isoformat()
+    return params
+
+
+async def _run_search(db, params: dict, before=None, after=None):
+    """One page of results (newest first) plus whether more exist in that direction."""
+    rows = await db.search_messages(
+        params["text"],
+        spot_number=params["spot"],
+        from_user_id=params["sender"],
+        since=datetime.fromisoformat(params["since"]) if params["since"] else None,
+        until=datetime.fromisoformat(params["until"]) if params["until"] else None,
+        limit=SEARCH_PAGE_SIZE + 1,
+        before=before,
+        after=after,
+    )
+    has_more = len(rows) > SEARCH_PAGE_SIZE
+    if has_more:
+        rows = rows[1:] if after is not None else rows[:-1]
+    return rows, has_more
+
+
+def _cursor(direction: str, row) -> str:
+    return f"srch_{direction}_{encode_cursor(row['created_at'], row['id'])}"
+
+
+def _format_results(rows, params: dict, has_older: bool, has_newer: bool):
+    title = html.escape(params["text"]) if params["text"] else "все сообщения"
+    if not rows:
+        return f"🔎 По запросу «{title}» ничего не найдено.", None
+
+    lines = [f"🔎 <b>Результаты: «{title}»</b>\n"]
+    for m in rows:
+        date = m["created_at"].astimezone(MSK_TZ).strftime("%d.%m.%Y %H:%M")
+        from_name = html.escape(m["from_name"] or "Неизвестный")
+        lines.append(
+            f"<b>{date}</b> — {from_name} (<code>{m['from_user_id']}</code>) "
+            f"→ место {m['to_spot']} [{m['source']}]\n"
+            f"   «{html.escape(m['message_text'])}»"
+        )
+        if m["reply_text"]:
+            lines.append(f"   ↩️ {html.escape(m['reply_text'])}")
+
+    buttons = []
+    if has_older:
+        buttons.append(InlineKeyboardButton(text="⬅️ Старее", callback_data=_cursor("o", rows[-1])))
+    if has_newer:
+        buttons.append(InlineKeyboardButton(text="Новее ➡️", callback_data=_cursor("n", rows[0])))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return "\n".join(lines), keyboard
+
+
+@router.message(Command("search"))
+async def cmd_search(message: Message, state: FSMContext, db, is_moderator: bool, **kwargs):
+    if message.chat.type != "private" or not is_moderator:
+        return
+
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer(USAGE, parse_mode="HTML")
+        return
+
+    try:
+        params = parse_search_args(args[1])
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}\n\n{USAGE}", parse_mode="HTML")
+        return
+    if not any(params.values()):
+        await message.answer(USAGE, parse_mode="HTML")
+        return
+
+    rows, has_older = await _run_search(db, params)
+    # Paging callbacks only carry the cursor; the query itself lives in FSM data
+    await state.update_data(search=params)
+    text, keyboard = _format_results(rows, params, has_older, False)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("srch_"))
+async def search_page(callback: CallbackQuery, state: FSMContext, db, is_moderator: bool, **kwargs):
+    if not is_moderator:
+        await callback.answer("Только для модератора или администратора", show_alert=True)
+        return
+
+    params = (await state.get_data()).get("search")
+    if not params:
+        await callback.answer("Поиск устарел — повторите /search", show_alert=True)
+        return
+
+    # Format: srch_{o|n}_{created_at µs}.{message_id}
+    try:
+        _, direction, key = callback.data.split("_", 2)
+        cursor = decode_cursor(key)
+    except ValueError:
+        await callback.answer()
+        return
+
+    if direction == "o":
+        rows, has_more = await _run_search(db, params, before=cursor)
+        has_older, has_newer = has_more, True
+    else:
+        rows, has_more = await _run_search(db, params, after=cursor)
+        has_older, has_newer = True, has_more
+
+    if not rows:
+        rows, has_older = await _run_search(db, params)
+        has_newer = False
+
+    text, keyboard = _format_results(rows, params, has_older, has_newer)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
@@ -1,3 +1,4 @@
+import html
 import io
 import json
 import logging
@@ -13,6 +14,13 @@ from aiogram.types import (
 )
 
 from config import MENU_BUTTONS, CANCEL_TEXT
+from services.analytics import MAX_DAYS, build_report, format_report
+from services.paging import fetch_page, nav_keyboard, parse_nav, compress_ranges, encode_cursor, decode_cursor
+from services.recurrence import MSK_TZ
+
+USERS_PAGE_SIZE = 20
+UNREACHABLE_PAGE_SIZE = 20
+
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -101,10 +109,14 @@ async def cmd_start(message: Message, state: FSMContext, db, is_admin: bool, is_
                 "\n\n🛡 <b>Модерация:</b>\n"
                 "/pending — заявки на одобрение\n"
                 "/announce — объявление\n"
-                "/spot — управление местами\n\n"
+                "/spot — управление местами\n"
+                "/search — поиск по сообщениям\n"
+                "/export — выгрузка в CSV\n"
+                "/unreachable — недоступные владельцы\n\n"
                 "👑 <b>Администрирование:</b>\n"
                 "/users — все пользователи\n"
                 "/stats — статистика\n"
+                "/analytics — аналитика обращений\n"
                 "/backup — экспорт БД\n"
                 "/restore — импорт БД\n"
                 "/mod — управление модераторами"
@@ -114,7 +126,10 @@ async def cmd_start(message: Message, state: FSMContext, db, is_admin: bool, is_
                 "\n\n🛡 <b>Модерация:</b>\n"
                 "/pending — заявки на одобрение\n"
                 "/announce — объявление\n"
-                "/spot — управление местами"
+                "/spot — управление местами\n"
+                "/search — поиск по сообщениям\n"
+                "/export — выгрузка в CSV\n"
+                "/unreachable — недоступные владельцы"
             )
         await message.answer(
             f"Вы уже зарегистрированы! Используйте меню ниже.{staff_hint}",
@@ -190,16 +205,19 @@ async def registration_spot(message: Message, state: FSMContext, db, is_admin: b
             )
             return
 
-        # Save user
-        await db.add_user(message.from_user.id, message.from_user.username, name)
+        # Save user, then status (+ spots for staff) — all or nothing
+        async with db.unit_of_work() as uow:
+            await uow.add_user(message.from_user.id, message.from_user.username, name)
+            if is_moderator:
+                # Auto-approve staff (admin + moderators)
+                await uow.add_spots(message.from_user.id, spots, status="approved")
+            else:
+                # Explicitly set to pending (covers re-registration after rejection)
+                await uow.set_user_status(message.from_user.id, "pending")
 
         spots_text = ", ".join(str(s) for s in spots)
 
         if is_moderator:
-            # Auto-approve staff (admin + moderators)
-            await db.set_user_status(message.from_user.id, "approved")
-            for spot_number in spots:
-                await db.add_spot(spot_number, message.from_user.id)
             await state.clear()
             if is_admin:
                 await message.answer(
@@ -213,6 +231,7 @@ async def registration_spot(message: Message, state: FSMContext, db, is_admin: b
                     f"👑 Администрирование:\n"
                     f"/users — пользователи\n"
                     f"/stats — статистика\n"
+                    f"/analytics — аналитика\n"
                     f"/backup — экспорт БД\n"
                     f"/restore — импорт БД\n"
                     f"/mod — управление модераторами",
@@ -230,8 +249,6 @@ async def registration_spot(message: Message, state: FSMContext, db, is_admin: b
                     reply_markup=main_menu_keyboard(),
                 )
         else:
-            # Explicitly set to pending (covers re-registration after rejection)
-            await db.set_user_status(message.from_user.id, "pending")
             await state.clear()
             await message.answer(
                 f"✅ Заявка отправлена!\n\n"
@@ -371,16 +388,9 @@ async def approve_user_multi(callback: CallbackQuery, db, is_moderator: bool, **
     if spots_match:
         spot_numbers = [int(n.strip()) for n in spots_match.group(1).split(",") if n.strip().isdigit()]
 
-    await db.set_user_status(user_id, "approved")
-
-    assigned = []
-    failed = []
-    for spot_number in spot_numbers:
-        success = await db.add_spot(spot_number, user_id)
-        if success:
-            assigned.append(str(spot_number))
-        else:
-            failed.append(str(spot_number))
+    added = await db.add_spots(user_id, spot_numbers, status="approved")
+    assigned = [str(n) for n in added]
+    failed = [str(n) for n in dict.fromkeys(spot_numbers) if n not in added]
 
     result = f"\n\n✅ Одобрено! Места: {', '.join(assigned)}"
     if failed:
@@ -419,10 +429,11 @@ async def approve_user(callback: CallbackQuery, db, is_moderator: bool, **kwargs
     user_id = int(parts[1])
     spot_number = int(parts[2]) if len(parts) > 2 else 0
 
-    await db.set_user_status(user_id, "approved")
+    async with db.unit_of_work() as uow:
+        await uow.set_user_status(user_id, "approved")
+        success = spot_number > 0 and await uow.add_spot(spot_number, user_id)
 
     if spot_number > 0:
-        success = await db.add_spot(spot_number, user_id)
         if not success:
             await callback.message.edit_text(
                 callback.message.text + "\n\n⚠️ Место уже занято! Пользователь одобрен, но место не назначено.",
@@ -513,45 +524,112 @@ async def cmd_pending(message: Message, db, is_moderator: bool, **kwargs):
         )
 
 
+@router.message(Command("unreachable"))
+async def cmd_unreachable(message: Message, db, is_moderator: bool, **kwargs):
+    """Owners the bot can't DM (blocked it or never opened the chat)."""
+    if message.chat.type != "private" or not is_moderator:
+        return
+
+    text, keyboard = await _render_unreachable_page(db)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("unrc_"))
+async def unreachable_page(callback: CallbackQuery, db, is_moderator: bool, **kwargs):
+    if not is_moderator:
+        await callback.answer("Только для модератора или администратора", show_alert=True)
+        return
+
+    # Format: unrc_{p|n}_{delivery_failed_at µs}.{telegram_id}
+    try:
+        direction, key = parse_nav(callback.data)
+        cursor = decode_cursor(key)
+    except ValueError:
+        await callback.answer()
+        return
+
+    text, keyboard = await _render_unreachable_page(db, direction, cursor)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
+
+def _unreachable_key(row) -> str:
+    return encode_cursor(row["delivery_failed_at"], row["telegram_id"])
+
+
+async def _render_unreachable_page(db, direction: str = None, cursor: tuple = None):
+    rows, has_prev, has_next = await fetch_page(
+        db.get_unreachable_owners_page, UNREACHABLE_PAGE_SIZE, direction, cursor
+    )
+    if not rows:
+        return "✅ Все владельцы мест доступны для уведомлений.", None
+
+    reasons = {"blocked": "заблокировал бота", "chat_not_found": "не начинал диалог"}
+    lines = ["📵 <b>Недоступные владельцы:</b>\n"]
+    for o in rows:
+        spots = compress_ranges(o["spots"])
+        since = o["delivery_failed_at"].astimezone(MSK_TZ).strftime("%d.%m %H:%M")
+        lines.append(
+            f"• {html.escape(o['name'])} (@{html.escape(o['username'] or '—')}) — места {spots}\n"
+            f"  {reasons.get(o['delivery_status'], o['delivery_status'])} с {since}, "
+            f"<code>{o['telegram_id']}</code>"
+        )
+    lines.append("\nПосле того как пользователь напишет боту, он снова будет получать уведомления.")
+    return "\n".join(lines), nav_keyboard("unrc", rows, _unreachable_key, has_prev, has_next)
+
+
 @router.message(Command("users"))
 async def cmd_users(message: Message, db, is_admin: bool, **kwargs):
     if message.chat.type != "private" or not is_admin:
         return
 
     try:
-        import html as _html
-        users = await db.get_all_users()
-        if not users:
-            await message.answer("Пользователей нет.")
-            return
-
-        status_icon = {"approved": "✅", "pending": "⏳", "rejected": "❌", "banned": "🚫"}
-        lines = ["<b>Пользователи:</b>\n"]
-        for u in users:
-            spots = await db.get_user_spots(u["telegram_id"])
-            spot_nums = ", ".join(str(s["spot_number"]) for s in spots) if spots else "—"
-            icon = status_icon.get(u["status"], "❓")
-            name = _html.escape(str(u["name"] or "—"))
-            username = _html.escape(str(u["username"] or "—"))
-            lines.append(f"{icon} {name} | {spot_nums} | @{username} | <code>{u['telegram_id']}</code>")
-
-        chunks = []
-        current = ""
-        for line in lines:
-            if len(current) + len(line) + 1 > 4000:
-                chunks.append(current)
-                current = line
-            else:
-                current = current + "\n" + line if current else line
-        if current:
-            chunks.append(current)
-        for chunk in chunks:
-            await message.answer(chunk, parse_mode="HTML")
+        text, keyboard = await _render_users_page(db)
+        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
     except Exception as e:
         logger.error(f"cmd_users error: {e}", exc_info=True)
         await message.answer(f"❌ Ошибка: {e}")
 
 
+@router.callback_query(F.data.startswith("usrs_"))
+async def users_page(callback: CallbackQuery, db, is_admin: bool, **kwargs):
+    if not is_admin:
+        await callback.answer("Только для администратора", show_alert=True)
+        return
+
+    # Format: usrs_{p|n}_{created_at µs}.{telegram_id}
+    try:
+        direction, key = parse_nav(callback.data)
+        cursor = decode_cursor(key)
+    except ValueError:
+        await callback.answer()
+        return
+
+    text, keyboard = await _render_users_page(db, direction, cursor)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
+
+def _users_key(row) -> str:
+    return encode_cursor(row["created_at"], row["telegram_id"])
+
+
+async def _render_users_page(db, direction: str = None, cursor: tuple = None):
+    rows, has_prev, has_next = await fetch_page(db.get_users_page, USERS_PAGE_SIZE, direction, cursor)
+    if not rows:
+        return "Пользователей нет.", None
+
+    status_icon = {"approved": "✅", "pending": "⏳", "rejected": "❌", "banned": "🚫"}
+    lines = ["<b>Пользователи:</b>\n"]
+    for u in rows:
+        spot_nums = compress_ranges(u["spots"]) or "—"
+        icon = status_icon.get(u["status"], "❓")
+        name = html.escape(str(u["name"] or "—")[:64])
+        username = html.escape(str(u["username"] or "—"))
+        lines.append(f"{icon} {name} | {spot_nums} | @{username} | <code>{u['telegram_id']}</code>")
+    return "\n".join(lines), nav_keyboard("usrs", rows, _users_key, has_prev, has_next)
+
+
 @router.message(Command("approve"))
 async def cmd_approve(message: Message, db, is_admin: bool, **kwargs):
     """/approve <user_id> — force-approve any user (admin only)."""
@@ -606,12 +684,30 @@ async def cmd_stats(message: Message, db, is_admin: bool, **kwargs):
         f"📊 <b>Статистика</b>\n\n"
         f"Пользователей: {stats['users_total']} (одобрено: {stats['users_approved']}, ожидают: {stats['users_pending']})\n"
         f"Мест занято: {stats['spots_total']} (свободно временно: {stats['spots_free']})\n"
-        f"Сообщений: {stats['messages_total']}\n"
+        f"Сообщений: {stats['messages_total']} (за 7 дней: {stats['messages_week']})\n"
         f"Активных гостевых: {stats['guests_active']}",
         parse_mode="HTML",
     )
 
 
+@router.message(Command("analytics"))
+async def cmd_analytics(message: Message, db, is_admin: bool, **kwargs):
+    if message.chat.type != "private" or not is_admin:
+        return
+
+    # /analytics [дней]
+    args = (message.text or "").split()
+    days = 30
+    if len(args) > 1:
+        if not args[1].isdigit() or not 1 <= int(args[1]) <= MAX_DAYS:
+            await message.answer(f"Использование: /analytics [дней], от 1 до {MAX_DAYS}")
+            return
+        days = int(args[1])
+
+    report = await build_report(db, days)
+    await message.answer(format_report(report), parse_mode="HTML")
+
+
 @router.message(Command("backup"))
 async def cmd_backup(message: Message, db, is_admin: bool, **kwargs):
     if message.chat.type != "private" or not is_admin:
@@ -686,7 +782,13 @@ async def spotconflict_approve(callback: CallbackQuery, db, is_moderator: bool,
     user_id = int(parts[2])
     spot_number = int(parts[3])
 
-    user = await db.get_user(user_id)
+    async with db.unit_of_work() as uow:
+        user = await uow.get_user(user_id)
+        if user:
+            # Add spot to new user (as co-owner)
+            await uow.add_spot(spot_number, user_id)
+            owners = await uow.get_spot_owners(spot_number)
+
     if not user:
         await callback.message.edit_text(
             callback.message.text + f"\n\n⚠️ Пользователь {user_id} не найден.",
@@ -695,9 +797,6 @@ async def spotconflict_approve(callback: CallbackQuery, db, is_moderator: bool,
         await callback.answer()
         return
 
-    # Add spot to new user (as co-owner)
-    await db.add_spot(spot_number, user_id)
-
     # Notify new owner
     bot: Bot = callback.bot
     try:
@@ -710,7 +809,6 @@ async def spotconflict_approve(callback: CallbackQuery, db, is_moderator: bool,
         logger.error(f"Failed to notify user {user_id}: {e}")
 
     # Notify existing owners
-    owners = await db.get_spot_owners(spot_number)
     for owner in owners:
         if owner["telegram_id"] != user_id:
             try:
@@ -934,6 +1032,15 @@ async def remove_spot_number(message: Message, state: FSMContext, db, **kwargs):
 
 # === Admin: manage spots for any user ===
 
+SPOT_USAGE = (
+    "🛡 <b>Управление местами</b>\n\n"
+    "<code>/spot add НомерМеста[,Номер…] UserID</code> — назначить место(а)\n"
+    "<code>/spot remove НомерМеста</code> — освободить место (у всех)\n"
+    "<code>/spot info НомерМеста</code> — инфо о месте\n"
+    "<code>/spot force НомерМеста UserID</code> — добавить совладельца"
+)
+
+
 @router.message(Command("spot"))
 async def cmd_admin_spot(message: Message, state: FSMContext, db, is_moderator: bool, **kwargs):
     """Staff command: /spot add/remove/info/force"""
@@ -943,55 +1050,56 @@ async def cmd_admin_spot(message: Message, state: FSMContext, db, is_moderator:
     parts = message.text.strip().split()
 
     if len(parts) < 2:
-        await message.answer(
-            "🛡 <b>Управление местами</b>\n\n"
-            "<code>/spot add НомерМеста UserID</code> — назначить место\n"
-            "<code>/spot remove НомерМеста</code> — освободить место (у всех)\n"
-            "<code>/spot info НомерМеста</code> — инфо о месте\n"
-            "<code>/spot force НомерМеста UserID</code> — добавить совладельца",
-            parse_mode="HTML",
-        )
+        await message.answer(SPOT_USAGE, parse_mode="HTML")
         return
 
     action = parts[1].lower()
 
     if action == "add" and len(parts) >= 4:
-        spot_number = int(parts[2])
+        # One or several spots: /spot add 142,143 UserID
+        items = [n.strip() for n in parts[2].split(",") if n.strip()]
+        if not items or not all(n.isdigit() for n in items) or not parts[3].isdigit():
+            await message.answer(SPOT_USAGE, parse_mode="HTML")
+            return
+        spot_numbers = [int(n) for n in items]
         user_id = int(parts[3])
 
-        user = await db.get_user(user_id)
+        async with db.unit_of_work() as uow:
+            user = await uow.get_user(user_id)
+            added = await uow.add_spots(user_id, spot_numbers) if user else []
         if not user:
             await message.answer(f"Пользователь {user_id} не найден.")
             return
 
-        existing_owners = await db.get_spot_owners(spot_number)
-        success = await db.add_spot(spot_number, user_id)
-        if success:
-            await message.answer(f"✅ Место {spot_number} назначено {user['name']} ({user_id})")
-        else:
-            await message.answer(
-                f"⚠️ Место {spot_number} уже принадлежит этому пользователю.\n"
-                f"Используйте <code>/spot force {spot_number} {user_id}</code> для добавления совладельца.",
-                parse_mode="HTML",
-            )
+        already = [n for n in dict.fromkeys(spot_numbers) if n not in added]
+        lines = []
+        if added:
+            if len(added) == 1:
+                lines.append(f"✅ Место {added[0]} назначено {user['name']} ({user_id})")
+            else:
+                lines.append(f"✅ Места {', '.join(map(str, added))} назначены {user['name']} ({user_id})")
+        if already:
+            lines.append(f"⚠️ Уже принадлежат этому пользователю: {', '.join(map(str, already))}")
+        await message.answer("\n".join(lines))
 
     elif action == "force" and len(parts) >= 4:
         spot_number = int(parts[2])
         user_id = int(parts[3])
 
-        user = await db.get_user(user_id)
+        async with db.unit_of_work() as uow:
+            user = await uow.get_user(user_id)
+            # Add as co-owner (won't duplicate due to UNIQUE constraint)
+            success = bool(user) and await uow.add_spot(spot_number, user_id)
+            existing_owners = await uow.get_spot_owners(spot_number) if success else []
+
         if not user:
             await message.answer(f"Пользователь {user_id} не найден.")
             return
-
-        # Add as co-owner (won't duplicate due to UNIQUE constraint)
-        success = await db.add_spot(spot_number, user_id)
         if not success:
             await message.answer(f"Место {spot_number} уже принадлежит {user['name']}.")
             return
 
         # Notify existing owners
-        existing_owners = await db.get_spot_owners(spot_number)
         bot: Bot = message.bot
         for owner in existing_owners:
             if owner["telegram_id"] != user_id:
@@ -30,6 +30,9 @@ class AccessMiddleware(BaseMiddleware):
             if user:
                 data["user_status"] = user["status"]
                 data["is_approved"] = user["status"] == "approved"
+                # Writing to the bot in private proves the DM works again
+                if user["delivery_status"] and self._is_private(event):
+                    await self.db.set_delivery_status(user_id, None)
             else:
                 data["user_status"] = "new"
                 data["is_approved"] = False
@@ -40,3 +43,9 @@ class AccessMiddleware(BaseMiddleware):
             data["is_approved"] = False
 
         return await handler(event, data)
+
+    @staticmethod
+    def _is_private(event: Message | CallbackQuery) -> bool:
+        if isinstance(event, CallbackQuery):
+            return bool(event.message) and event.message.chat.type == "private"
+        return event.chat.type == "private"
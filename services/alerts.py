@@ -0,0 +1,77 @@
+import html
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from services.delivery import fan_out
+
+logger = logging.getLogger(__name__)
+
+# Coalescing of alerts to one spot (Database.coalesce_alert): the first alert
+# of a window is sent as usual and its DMs are remembered; every later alert in
+# the window edits those DMs into one summary instead of sending a new one.
+# Owners without a remembered DM (it covered several spots, or failed) get the
+# summary as a new message, which is remembered for the next merge.
+
+MAX_SHOWN_REPORTS = 5
+
+
+def render_summary(spot_number: int, state: dict) -> str:
+    """The merged DM: counter, the latest texts and who reported."""
+    reports = state["reports"]
+    lines = [f"🔔 <b>Обращений по месту {spot_number}: {state['alerts']}</b>", ""]
+    if len(reports) > MAX_SHOWN_REPORTS:
+        lines.append(f"<i>…и ещё {len(reports) - MAX_SHOWN_REPORTS} ранее</i>")
+    for reporter, text in reports[-MAX_SHOWN_REPORTS:]:
+        lines.append(f"«{html.escape(text)}» — {html.escape(reporter)}")
+    reporters = dict.fromkeys(reporter for reporter, _ in reports)
+    lines += ["", f"Сообщили: {html.escape(', '.join(reporters))}"]
+    return "\n".join(lines)
+
+
+async def remember_dms(db, bot: Bot, spot_number: int, state: dict, sent: dict[int, int]) -> None:
+    """Store the DMs just sent for a window. If alerts were merged into it
+    while they were on the way, bring them up to date right away."""
+    if not sent:
+        return
+    latest = await db.add_alert_dms(spot_number, state["message_id"], sent)
+    if latest is None or latest["alerts"] <= state["alerts"]:
+        return
+    text = render_summary(spot_number, latest)
+    await fan_out(
+        db, sent,
+        lambda owner_id: bot.edit_message_text(
+            text, chat_id=owner_id, message_id=sent[owner_id], parse_mode="HTML",
+        ),
+    )
+
+
+async def send_summary(db, bot: Bot, spot_number: int, state: dict, owner_ids) -> dict:
+    """Deliver a merged alert: edit each owner's DM of the window, or send one.
+
+    Returns fan_out results.
+    """
+    text = render_summary(spot_number, state)
+    dms = state["dms"]
+
+    async def send(owner_id: int):
+        if owner_id in dms:
+            try:
+                return await bot.edit_message_text(
+                    text, chat_id=owner_id, message_id=dms[owner_id], parse_mode="HTML",
+                )
+            except TelegramBadRequest as e:
+                if "not modified" in e.message:
+                    return None
+                # Deleted by the owner or too old to edit — send a fresh one
+                logger.info(f"Alert DM to {owner_id} not editable ({e.message}), resending")
+        return await bot.send_message(owner_id, text, parse_mode="HTML")
+
+    results = await fan_out(db, owner_ids, send)
+    sent = {
+        owner_id: result.message_id for owner_id, (result, failure) in results.items()
+        if result is not None and result.message_id != dms.get(owner_id)
+    }
+    await remember_dms(db, bot, spot_number, state, sent)
+    return results
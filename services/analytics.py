@@ -0,0 +1,106 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+from config import SOURCE_GROUP, SOURCE_PRIVATE, SOURCE_NOTIFY, SOURCE_REPORT
+from services.database import ACTIVITY_UTC_OFFSET_HOURS, activity_today
+
+# Incident time series for admins, built from the incident_hourly and
+# spot_daily_activity rollups — never from a scan of messages. The hourly rows
+# are summed into Moscow-time days, ISO weeks and hours of the day here.
+
+SOURCES = (SOURCE_GROUP, SOURCE_NOTIFY, SOURCE_PRIVATE, SOURCE_REPORT)
+SOURCE_LABELS = {
+    SOURCE_GROUP: "💬 Группа",
+    SOURCE_NOTIFY: "✉️ Сообщить А/М",
+    SOURCE_PRIVATE: "📩 Личные",
+    SOURCE_REPORT: "🚨 Жалобы",
+}
+TOP_SPOTS = 10
+MAX_DAYS = 730
+_TZ = timezone(timedelta(hours=ACTIVITY_UTC_OFFSET_HOURS))
+_SPARK = "▁▂▃▄▅▆▇█"
+
+
+async def build_report(db, days: int = 30) -> dict:
+    """Incidents over the last ``days`` Moscow-time days (today included), JSON-ready."""
+    until = activity_today()
+    since = until - timedelta(days=days - 1)
+    hours = await db.get_incident_hours(datetime.combine(since, time(), _TZ))
+    top = await db.get_top_spots(since, TOP_SPOTS)
+
+    sources = list(SOURCES) + sorted({r["source"] for r in hours} - set(SOURCES))
+    daily = {since + timedelta(days=i): dict.fromkeys(sources, 0) for i in range(days)}
+    by_hour = [0] * 24
+    for r in hours:
+        local = r["hour"].astimezone(_TZ)
+        bucket = daily.get(local.date())
+        if bucket is None:  # a row written after ``until`` rolled over
+            continue
+        bucket[r["source"]] += r["incidents"]
+        by_hour[local.hour] += r["incidents"]
+
+    weekly: dict[str, dict] = {}
+    for day, counts in daily.items():
+        year, week, _ = day.isocalendar()
+        entry = weekly.setdefault(
+            f"{year}-W{week:02d}", {"start": day.isoformat(), **dict.fromkeys(sources, 0)}
+        )
+        for source, n in counts.items():
+            entry[source] += n
+
+    totals = {s: sum(c[s] for c in daily.values()) for s in sources}
+    return {
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "days": days,
+        "sources": sources,
+        "totals": {**totals, "all": sum(totals.values())},
+        "daily": [
+            {"day": day.isoformat(), **counts, "total": sum(counts.values())}
+            for day, counts in daily.items()
+        ],
+        "weekly": [
+            {"week": week, **counts, "total": sum(counts[s] for s in sources)}
+            for week, counts in weekly.items()
+        ],
+        "hours": by_hour,
+        "top_spots": [{"spot": r["spot_number"], "messages": r["received"]} for r in top],
+    }
+
+
+def sparkline(values: list[int]) -> str:
+    peak = max(values, default=0)
+    if not peak:
+        return _SPARK[0] * len(values)
+    return "".join(_SPARK[round(v * (len(_SPARK) - 1) / peak)] for v in values)
+
+
+def format_report(report: dict) -> str:
+    """/analytics message (HTML)."""
+    since = date.fromisoformat(report["since"]).strftime("%d.%m.%Y")
+    until = date.fromisoformat(report["until"]).strftime("%d.%m.%Y")
+    totals = report["totals"]
+    lines = [f"📈 <b>Аналитика</b> ({since} — {until})", "", f"Всего обращений: {totals['all']}"]
+    for source in report["sources"]:
+        lines.append(f"  {SOURCE_LABELS.get(source, source)}: {totals[source]}")
+
+    daily = [d["total"] for d in report["daily"]]
+    lines += ["", "<b>По дням:</b>", f"<code>{sparkline(daily)}</code>"]
+
+    if len(report["weekly"]) > 1:
+        lines += ["", "<b>По неделям:</b>"]
+        for week in report["weekly"][-8:]:
+            start = date.fromisoformat(week["start"]).strftime("%d.%m")
+            lines.append(f"  с {start}: {week['total']}")
+
+    by_hour = report["hours"]
+    if any(by_hour):
+        busiest = sorted(range(24), key=lambda h: (-by_hour[h], h))[:3]
+        lines += [
+            "", "<b>По часам (МСК):</b>", f"<code>{sparkline(by_hour)}</code>",
+            "Пик: " + ", ".join(f"{h:02d}:00 ({by_hour[h]})" for h in busiest if by_hour[h]),
+        ]
+
+    if report["top_spots"]:
+        lines += ["", "<b>Чаще всего пишут местам:</b>"]
+        lines += [f"  №{s['spot']} — {s['messages']}" for s in report["top_spots"]]
+    return "\n".join(lines)
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from typing import Callable
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache_invalidation"
+HEARTBEAT = 30  # seconds between liveness pings on the LISTEN connection
+MAX_BACKOFF = 30
+
+# Installed by Database._create_tables. Payload is "<entity>:<key>"; the key is
+# read from the row by column name (TG_ARGV[1]) and is "*" for TRUNCATE.
+TRIGGER_FUNCTION_DDL = f"""
+    CREATE OR REPLACE FUNCTION notify_cache_invalidation() RETURNS trigger AS $$
+    BEGIN
+        IF TG_LEVEL = 'STATEMENT' THEN
+            PERFORM pg_notify('{CHANNEL}', TG_ARGV[0] || ':*');
+            RETURN NULL;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM pg_notify('{CHANNEL}', TG_ARGV[0] || ':' || (to_jsonb(OLD) ->> TG_ARGV[1]));
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM pg_notify('{CHANNEL}', TG_ARGV[0] || ':' || (to_jsonb(NEW) ->> TG_ARGV[1]));
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+"""
+
+# (entity, table, key column)
+WATCHED = [
+    ("users", "users", "telegram_id"),
+    ("moderators", "moderators", "telegram_id"),
+    ("spots", "parking_spots", "spot_number"),
+    ("user_spots", "parking_spots", "user_id"),
+    ("settings", "bot_settings", "key"),
+    ("messages", "messages", "to_spot"),
+]
+
+
+async def install_triggers(conn) -> None:
+    async with conn.transaction():
+        # Replicas start concurrently; serialize the DDL between them
+        await conn.execute(f"SELECT pg_advisory_xact_lock(hashtext('{CHANNEL}'))")
+        await conn.execute(TRIGGER_FUNCTION_DDL)
+        for entity, table, column in WATCHED:
+            name = f"cache_inv_{entity}"
+            await conn.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+            await conn.execute(
+                f"CREATE TRIGGER {name} AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation('{entity}', '{column}')"
+            )
+            await conn.execute(f"DROP TRIGGER IF EXISTS {name}_truncate ON {table}")
+            await conn.execute(
+                f"CREATE TRIGGER {name}_truncate AFTER TRUNCATE ON {table} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_invalidation('{entity}', '')"
+            )
+
+
+class InvalidationBus:
+    """LISTENs on a dedicated connection and forwards invalidations.
+
+    ``dispatch(entity, key)`` is called for every notification. ``flush_all()``
+    is called whenever the connection is (re)established or lost, since
+    notifications sent while nobody was listening are gone for good.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        dispatch: Callable[[str, str], None],
+        flush_all: Callable[[], None],
+    ):
+        self.dsn = dsn
+        self.dispatch = dispatch
+        self.flush_all = flush_all
+        self._task: asyncio.Task | None = None
+        self.connected = False
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _on_notify(self, conn, pid, channel, payload: str) -> None:
+        entity, _, key = payload.partition(":")
+        try:
+            self.dispatch(entity, key or "*")
+        except Exception as e:
+            logger.error(f"Cache invalidation handler for {payload} failed: {e}")
+
+    async def _run(self) -> None:
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda c: lost.set())
+                await conn.add_listener(CHANNEL, self._on_notify)
+                self.connected = True
+                self.flush_all()
+                backoff = 1
+                logger.info("Cache invalidation bus listening")
+
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), HEARTBEAT)
+                    except asyncio.TimeoutError:
+                        # A half-open TCP connection never fires the termination listener
+                        await asyncio.wait_for(conn.fetchval("SELECT 1"), 5)
+                logger.warning("Cache invalidation bus connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation bus error: {e}")
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            self.flush_all()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
@@ -1,30 +1,415 @@
+import asyncio
+import functools
+import gzip
 import json
 import logging
-from datetime import datetime, timezone
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timezone, timedelta
 
 import asyncpg
 
+from services.cache_bus import CHANNEL, InvalidationBus, install_triggers
+from services.history_cache import HistoryCache
+from services.log import user_id_var
+
 logger = logging.getLogger(__name__)
 
+_MESSAGES_DDL = """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+        from_user_id BIGINT REFERENCES users(telegram_id),
+        to_spot INTEGER NOT NULL,
+        message_text TEXT NOT NULL,
+        reply_text TEXT,
+        source TEXT NOT NULL DEFAULT 'private',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        search_tsv tsvector GENERATED ALWAYS AS (
+            to_tsvector('russian', coalesce(message_text, '') || ' ' || coalesce(reply_text, ''))
+        ) STORED,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+"""
+_MESSAGE_COLUMNS = ["id", "from_user_id", "to_spot", "message_text", "reply_text", "source", "created_at"]
+_PARTITION_RE = re.compile(r"^messages_y(\d{4})m(\d{2})$")
+
+
+def _month_start(dt: datetime) -> datetime:
+    dt = dt.astimezone(timezone.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def _next_month(month: datetime) -> datetime:
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def _partition_name(month: datetime) -> str:
+    return f"messages_y{month.year:04d}m{month.month:02d}"
+
+
+async def _ensure_message_partitions(conn, start: datetime, end: datetime) -> None:
+    """Create the monthly messages partitions covering [start, end] (UTC months)."""
+    month = _month_start(start)
+    while month <= end:
+        upper = _next_month(month)
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF messages "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+        month = upper
+
+
+# Activity rollup days are Moscow dates (UTC+3, no DST) — what residents call "today"
+ACTIVITY_UTC_OFFSET_HOURS = 3
+
+# spot_daily_activity: per spot and day, messages to the spot (received) and
+# messages from its owners (sent, counted once on the sender's lowest spot so
+# summing a user's spots doesn't double count). Kept by a trigger, so COPY,
+# restores and every process feed it; archiving messages leaves it intact.
+_ACTIVITY_DDL = """
+    CREATE TABLE IF NOT EXISTS spot_daily_activity (
+        spot_number INTEGER NOT NULL,
+        day DATE NOT NULL,
+        received INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (spot_number, day)
+    )
+"""
+_ACTIVITY_DAY = f"(created_at AT TIME ZONE 'UTC' + INTERVAL '{ACTIVITY_UTC_OFFSET_HOURS} hours')::date"
+_ACTIVITY_TRIGGER_DDL = f"""
+    CREATE OR REPLACE FUNCTION roll_up_spot_activity() RETURNS trigger AS $$
+    DECLARE
+        d DATE := (NEW.created_at AT TIME ZONE 'UTC' + INTERVAL '{ACTIVITY_UTC_OFFSET_HOURS} hours')::date;
+    BEGIN
+        INSERT INTO spot_daily_activity (spot_number, day, received) VALUES (NEW.to_spot, d, 1)
+        ON CONFLICT (spot_number, day) DO UPDATE SET received = spot_daily_activity.received + 1;
+        INSERT INTO spot_daily_activity (spot_number, day, sent)
+        SELECT MIN(spot_number), d, 1 FROM parking_spots WHERE user_id = NEW.from_user_id
+        HAVING MIN(spot_number) IS NOT NULL
+        ON CONFLICT (spot_number, day) DO UPDATE SET sent = spot_daily_activity.sent + 1;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+"""
+# One-off fill from the messages still on disk (sent uses today's spot owners)
+_ACTIVITY_BACKFILL = [
+    f"""INSERT INTO spot_daily_activity (spot_number, day, received)
+        SELECT to_spot, {_ACTIVITY_DAY}, COUNT(*) FROM messages GROUP BY 1, 2""",
+    f"""INSERT INTO spot_daily_activity (spot_number, day, sent)
+        SELECT s.spot_number, {_ACTIVITY_DAY.replace("created_at", "m.created_at")}, COUNT(*)
+        FROM messages m
+        JOIN (SELECT user_id, MIN(spot_number) AS spot_number FROM parking_spots GROUP BY user_id) s
+          ON s.user_id = m.from_user_id
+        GROUP BY 1, 2
+        ON CONFLICT (spot_number, day) DO UPDATE SET sent = EXCLUDED.sent""",
+]
+
+
+# incident_hourly: incidents per UTC hour and source — messages via trigger,
+# staff reports (which have no messages row) via record_incident()
+_INCIDENT_DDL = """
+    CREATE TABLE IF NOT EXISTS incident_hourly (
+        hour TIMESTAMPTZ NOT NULL,
+        source TEXT NOT NULL,
+        incidents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, source)
+    )
+"""
+_INCIDENT_TRIGGER_DDL = """
+    CREATE OR REPLACE FUNCTION roll_up_incidents() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO incident_hourly (hour, source, incidents)
+        VALUES (date_trunc('hour', NEW.created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', NEW.source, 1)
+        ON CONFLICT (hour, source) DO UPDATE SET incidents = incident_hourly.incidents + 1;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql
+"""
+_INCIDENT_BACKFILL = [
+    """INSERT INTO incident_hourly (hour, source, incidents)
+       SELECT date_trunc('hour', created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', source, COUNT(*)
+       FROM messages GROUP BY 1, 2""",
+]
+
+# (table, DDL, trigger function DDL, function, trigger, one-off backfill)
+_ROLLUPS = [
+    (
+        "spot_daily_activity",
+        [_ACTIVITY_DDL, "CREATE INDEX IF NOT EXISTS idx_spot_daily_activity_day ON spot_daily_activity (day)"],
+        _ACTIVITY_TRIGGER_DDL, "roll_up_spot_activity", "spot_activity_rollup", _ACTIVITY_BACKFILL,
+    ),
+    (
+        "incident_hourly", [_INCIDENT_DDL],
+        _INCIDENT_TRIGGER_DDL, "roll_up_incidents", "incident_rollup", _INCIDENT_BACKFILL,
+    ),
+]
+
+
+def activity_today() -> date:
+    return (datetime.now(timezone.utc) + timedelta(hours=ACTIVITY_UTC_OFFSET_HOURS)).date()
+
+
+HISTORY_CACHE_ENTRIES = 1000  # newest history pages kept (spots + users' spot unions)
+
+REPLICA_CHECK_INTERVAL = 5  # seconds between replica lag probes
+REPLICA_RETRY_AFTER = 30  # seconds a failed replica is skipped
+
+# Replication delay: 0 when the standby has replayed everything it received
+_REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Failures that mean "the replica is unusable", not "the query is wrong"
+_REPLICA_ERRORS = (
+    OSError, asyncio.TimeoutError, asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError, asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError, asyncpg.QueryCanceledError,
+    asyncpg.SerializationError,  # hot standby: "conflict with recovery"
+)
+
+
+def read_only(method):
+    """Route a pure read to the replica pool when it's safe.
+
+    Falls back to the primary when there is no healthy replica, inside a
+    unit of work, for a user who wrote within ``read_your_writes`` seconds,
+    and when the replica fails mid-query.
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        route = "replica" if self._replica_usable() else "primary"
+        token = self._read_route.set(route)
+        try:
+            try:
+                return await method(self, *args, **kwargs)
+            except _REPLICA_ERRORS as e:
+                if route != "replica":
+                    raise
+                self._replica_failed(e)
+            self._read_route.set("primary")
+            return await method(self, *args, **kwargs)
+        finally:
+            self._read_route.reset(token)
+    return wrapper
+
+
+def writes(method):
+    """Mark a write: the acting user then reads from the primary for a while."""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            self._note_write()
+    return wrapper
+
+
+EXPORT_KINDS = ("users", "pending", "messages")
+
+# alert_windows: the open coalescing window of each alerted spot (one row per
+# spot, reused). reports is a JSON list of [reporter, text] in arrival order,
+# dms a JSON {owner_id: Telegram message id} of the DMs to edit on a merge.
+_ALERT_WINDOWS_DDL = """
+    CREATE TABLE IF NOT EXISTS alert_windows (
+        spot_number INTEGER PRIMARY KEY,
+        opened_at TIMESTAMPTZ NOT NULL,
+        alerts INTEGER NOT NULL DEFAULT 1,
+        message_id INTEGER,
+        reports TEXT NOT NULL,
+        dms TEXT NOT NULL DEFAULT '{}'
+    )
+"""
+
 
 class Database:
+    # A user's spots as one "12 140 141" cell (aggregate over an ordered subquery s)
+    _SPOT_LIST_SQL = "string_agg(CAST(s.spot_number AS TEXT), ' ' ORDER BY s.spot_number)"
+
     def __init__(self):
         self.pool = None
-
-    async def connect(self, database_url: str):
+        self.replica_pool = None
+        self.replica_max_lag = 0.0
+        self.read_your_writes = 0.0
+        self.replica_lag: float | None = None
+        self._replica_down_until = 0.0
+        self._replica_url = None
+        self._replica_task: asyncio.Task | None = None
+        # user_id -> monotonic time of their last write (read-your-writes window)
+        self._recent_writers: dict[int, float] = {}
+        # Set by @read_only for the duration of the call: "replica" or "primary"
+        self._read_route: ContextVar = ContextVar(f"read_route_{id(self)}", default=None)
+        # Called as listener(kind, deadline) after a write that sets an expiry
+        # ("spot" for free_until, "pass" for guest passes) — see services/expiry.py
+        self.expiry_listener = None
+        # Moderator ids are read on every update (AccessMiddleware) — cache them
+        self._moderator_cache: frozenset[int] | None = None
+        self._moderator_version = 0
+        # entity -> handlers(key); fed locally and by the LISTEN/NOTIFY bus
+        self._invalidation_handlers: dict[str, list] = {}
+        self.add_invalidation_handler("moderators", lambda key: self.invalidate_moderators())
+        # Newest history page per spot / per user's spots (see _cached_history)
+        self.history_cache = HistoryCache(HISTORY_CACHE_ENTRIES)
+        self.add_invalidation_handler("messages", self._history_handler(self.history_cache.invalidate_spot))
+        self.add_invalidation_handler("user_spots", self._history_handler(self.history_cache.invalidate_user))
+        self.add_invalidation_handler("users", self._history_handler(self.history_cache.invalidate_sender))
+        self.bus: InvalidationBus | None = None
+        # Connection pinned by unit_of_work() for the current task (and tasks it spawns)
+        self._uow_conn: ContextVar = ContextVar(f"uow_conn_{id(self)}", default=None)
+
+    async def connect(
+        self,
+        database_url: str,
+        migrate: bool = True,
+        replica_url: str = None,
+        replica_max_lag: float = 5.0,
+        read_your_writes: float = 10.0,
+    ):
         self.pool = await asyncpg.create_pool(
             database_url, min_size=1, max_size=5
         )
-        await self._create_tables()
+        # Shard workers skip DDL — the ingress process has already run it
+        if migrate:
+            await self._create_tables()
+        self.bus = InvalidationBus(database_url, self._dispatch_invalidation, self._flush_caches)
+        self.bus.start()
+        if replica_url:
+            self.replica_max_lag = replica_max_lag
+            self.read_your_writes = read_your_writes
+            try:
+                self.replica_pool = await asyncpg.create_pool(
+                    replica_url, min_size=1, max_size=5
+                )
+            except _REPLICA_ERRORS as e:
+                # Reads work without it; the lag probe keeps retrying
+                logger.error(f"Replica unavailable, reading from primary: {e}")
+            self._replica_url = replica_url
+            self._replica_task = asyncio.create_task(self._replica_monitor())
         logger.info("Database connected and tables created")
 
     async def close(self):
+        if self.bus:
+            await self.bus.stop()
+        if self._replica_task:
+            self._replica_task.cancel()
+        if self.replica_pool:
+            await self.replica_pool.close()
         if self.pool:
             await self.pool.close()
             logger.info("Database connection closed")
 
+    # === Unit of work ===
+
+    @asynccontextmanager
+    async def _acquire(self):
+        """The unit of work's connection if one is open, else a pooled one
+        (from the replica inside a routed @read_only call)."""
+        conn = self._uow_conn.get()
+        if conn is not None:
+            yield conn
+            return
+        pool = self.replica_pool if self._read_route.get() == "replica" else self.pool
+        async with pool.acquire() as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Run several Database calls on one connection and one transaction::
+
+            async with db.unit_of_work() as uow:
+                await uow.add_user(...)
+                await uow.add_spots(...)
+
+        Every method called inside the block (on ``uow`` or on ``db``) joins
+        the transaction; it commits on exit and rolls back on an exception.
+        Nested blocks become savepoints. Keep Telegram calls outside — the
+        transaction holds row locks — and don't share the block between
+        concurrent tasks: a connection runs one query at a time.
+        """
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                token = self._uow_conn.set(conn)
+                try:
+                    yield self
+                finally:
+                    self._uow_conn.reset(token)
+        self._note_write()
+
+    # === Read replica ===
+
+    def _note_write(self) -> None:
+        user_id = user_id_var.get()
+        if user_id is None or not self.replica_pool:
+            return
+        now = time.monotonic()
+        self._recent_writers[user_id] = now
+        if len(self._recent_writers) > 1000:
+            self._recent_writers = {
+                uid: t for uid, t in self._recent_writers.items()
+                if now - t < self.read_your_writes
+            }
+
+    def _replica_healthy(self) -> bool:
+        return (
+            self.replica_pool is not None
+            and self.replica_lag is not None
+            and self.replica_lag <= self.replica_max_lag
+            and time.monotonic() >= self._replica_down_until
+        )
+
+    def _replica_usable(self) -> bool:
+        if self._uow_conn.get() is not None or not self._replica_healthy():
+            return False
+        user_id = user_id_var.get()
+        wrote_at = self._recent_writers.get(user_id) if user_id is not None else None
+        return wrote_at is None or time.monotonic() - wrote_at >= self.read_your_writes
+
+    def _replica_failed(self, error: Exception) -> None:
+        self._replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+        logger.warning(f"Replica read failed, using primary for {REPLICA_RETRY_AFTER}s: {error}")
+
+    async def _replica_monitor(self) -> None:
+        while True:
+            try:
+                if self.replica_pool is None:
+                    self.replica_pool = await asyncpg.create_pool(
+                        self._replica_url, min_size=1, max_size=5
+                    )
+                lag = await asyncio.wait_for(self.replica_pool.fetchval(_REPLICA_LAG_SQL), 5)
+                self.replica_lag = float(lag)
+                if self.replica_lag > self.replica_max_lag:
+                    logger.warning(f"Replica lag {self.replica_lag:.1f}s — reading from primary")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.replica_lag = None
+                logger.warning(f"Replica lag check failed: {e}")
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+
+    def replica_stats(self) -> dict | None:
+        if not self._replica_url:
+            return None
+        return {"lag": self.replica_lag, "routing": self._replica_healthy()}
+
+    async def ping(self, timeout: float) -> None:
+        """SELECT 1, including the wait for a free connection, within ``timeout``."""
+        await asyncio.wait_for(self.pool.fetchval("SELECT 1"), timeout)
+
+    def pool_stats(self) -> dict:
+        return {
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "max": self.pool.get_max_size(),
+        }
+
     async def _create_tables(self):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     telegram_id BIGINT PRIMARY KEY,
@@ -34,6 +419,13 @@ class Database:
                     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
                 )
             """)
+            # Delivery tracking: 'blocked' / 'chat_not_found' while DMs can't reach the user
+            await conn.execute(
+                "ALTER TABLE users ADD COLUMN IF NOT EXISTS delivery_status TEXT"
+            )
+            await conn.execute(
+                "ALTER TABLE users ADD COLUMN IF NOT EXISTS delivery_failed_at TIMESTAMPTZ"
+            )
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS parking_spots (
                     id SERIAL PRIMARY KEY,
@@ -59,17 +451,14 @@ class Database:
                     END IF;
                 END $$
             """)
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id SERIAL PRIMARY KEY,
-                    from_user_id BIGINT REFERENCES users(telegram_id),
-                    to_spot INTEGER NOT NULL,
-                    message_text TEXT NOT NULL,
-                    reply_text TEXT,
-                    source TEXT NOT NULL DEFAULT 'private',
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
-                )
-            """)
+            # messages is range-partitioned by month on created_at; the id
+            # sequence is standalone so a legacy table can hand it over
+            await conn.execute("CREATE SEQUENCE IF NOT EXISTS messages_id_seq")
+            await conn.execute(_MESSAGES_DDL)
+            await self._partition_messages(conn)
+            await conn.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+            now = datetime.now(timezone.utc)
+            await _ensure_message_partitions(conn, now, now + timedelta(days=62))
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS guest_passes (
                     id SERIAL PRIMARY KEY,
@@ -104,18 +493,28 @@ class Database:
                     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
                 )
             """)
+            # Recurring reminders — see services/recurrence.py
+            await conn.execute("ALTER TABLE reminders ADD COLUMN IF NOT EXISTS rule TEXT")
+            await conn.execute(
+                "ALTER TABLE reminders ADD COLUMN IF NOT EXISTS repeat_until TIMESTAMPTZ"
+            )
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS bot_settings (
                     key TEXT PRIMARY KEY,
                     value TEXT NOT NULL
                 )
             """)
+            await conn.execute(_ALERT_WINDOWS_DDL)
 
             # Indexes for hot queries (idempotent — CREATE INDEX IF NOT EXISTS)
             await conn.execute(
                 "CREATE INDEX IF NOT EXISTS idx_messages_to_spot_created "
                 "ON messages (to_spot, created_at DESC)"
             )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_search "
+                "ON messages USING GIN (search_tsv)"
+            )
             await conn.execute(
                 "CREATE INDEX IF NOT EXISTS idx_messages_from_user "
                 "ON messages (from_user_id)"
@@ -128,6 +527,14 @@ class Database:
                 "CREATE INDEX IF NOT EXISTS idx_parking_spots_number "
                 "ON parking_spots (spot_number)"
             )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_parking_spots_free "
+                "ON parking_spots (spot_number) WHERE is_temporary_free = TRUE"
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_guest_passes_active_expires "
+                "ON guest_passes (expires_at) WHERE is_active = TRUE"
+            )
             await conn.execute(
                 "CREATE INDEX IF NOT EXISTS idx_reminders_pending "
                 "ON reminders (is_sent, remind_at) WHERE is_sent = FALSE"
@@ -140,16 +547,99 @@ class Database:
                 "CREATE INDEX IF NOT EXISTS idx_users_status "
                 "ON users (status)"
             )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_created "
+                "ON users (created_at, telegram_id)"
+            )
+
+            await self._install_rollups(conn)
+
+            # NOTIFY triggers feeding every process's cache invalidation bus
+            await install_triggers(conn)
+
+    async def _install_rollups(self, conn) -> None:
+        for table, ddl, function_ddl, function, trigger, backfill in _ROLLUPS:
+            async with conn.transaction():
+                created = await conn.fetchval(f"SELECT to_regclass('{table}') IS NULL")
+                for statement in ddl:
+                    await conn.execute(statement)
+                await conn.execute(function_ddl)
+                await conn.execute(f"DROP TRIGGER IF EXISTS {trigger} ON messages")
+                await conn.execute(
+                    f"CREATE TRIGGER {trigger} AFTER INSERT ON messages "
+                    f"FOR EACH ROW EXECUTE FUNCTION {function}()"
+                )
+                if created:
+                    # Hold off inserts so no message is both backfilled and triggered
+                    await conn.execute("LOCK TABLE messages IN SHARE ROW EXCLUSIVE MODE")
+                    for statement in backfill:
+                        await conn.execute(statement)
+                    logger.info(f"{table} backfilled from messages")
+
+    # === Cache invalidation ===
+
+    def add_invalidation_handler(self, entity: str, handler) -> None:
+        """Register ``handler(key)`` for writes to ``entity`` (key "*" = everything).
+
+        Entities and keys come from cache_bus.WATCHED triggers, so writes from
+        other processes and manual SQL are seen too.
+        """
+        self._invalidation_handlers.setdefault(entity, []).append(handler)
+
+    def _dispatch_invalidation(self, entity: str, key: str) -> None:
+        for handler in self._invalidation_handlers.get(entity, []):
+            handler(key)
+
+    def _flush_caches(self) -> None:
+        for entity in self._invalidation_handlers:
+            self._dispatch_invalidation(entity, "*")
+
+    def _history_handler(self, invalidate):
+        def handler(key: str) -> None:
+            if key == "*":
+                self.history_cache.clear()
+            else:
+                invalidate(int(key))
+        return handler
+
+    async def _partition_messages(self, conn) -> None:
+        """One-off migration of a plain messages table to monthly partitions."""
+        relkind = await conn.fetchval(
+            "SELECT relkind::text FROM pg_class WHERE oid = 'messages'::regclass"
+        )
+        if relkind != "r":
+            return
+
+        logger.info("Migrating messages to a partitioned table...")
+        columns = ", ".join(_MESSAGE_COLUMNS)
+        async with conn.transaction():
+            await conn.execute("ALTER TABLE messages RENAME TO messages_legacy")
+            await conn.execute(
+                "ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey"
+            )
+            await conn.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+            await conn.execute(_MESSAGES_DDL)
+
+            oldest = await conn.fetchval("SELECT MIN(created_at) FROM messages_legacy")
+            now = datetime.now(timezone.utc)
+            await _ensure_message_partitions(conn, oldest or now, now + timedelta(days=62))
+
+            result = await conn.execute(
+                f"INSERT INTO messages ({columns}) SELECT {columns} FROM messages_legacy"
+            )
+            await conn.execute("DROP TABLE messages_legacy")
+        logger.info(f"messages partitioned: {result.split()[-1]} rows moved")
 
     # === Bot Settings ===
 
     async def get_setting(self, key: str):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("SELECT value FROM bot_settings WHERE key = $1", key)
             return row["value"] if row else None
 
+    @writes
     async def set_setting(self, key: str, value: str) -> None:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 "INSERT INTO bot_settings (key, value) VALUES ($1, $2) "
                 "ON CONFLICT (key) DO UPDATE SET value = $2",
@@ -158,46 +648,62 @@ class Database:
 
     # === Moderators ===
 
+    def invalidate_moderators(self) -> None:
+        self._moderator_cache = None
+        self._moderator_version += 1
+
+    async def _moderator_ids(self) -> frozenset[int]:
+        if self._moderator_cache is not None:
+            return self._moderator_cache
+        version = self._moderator_version
+        async with self._acquire() as conn:
+            rows = await conn.fetch("SELECT telegram_id FROM moderators")
+        ids = frozenset(r["telegram_id"] for r in rows)
+        # Don't store a set that was invalidated while we were loading it
+        if version == self._moderator_version:
+            self._moderator_cache = ids
+        return ids
+
+    @writes
     async def add_moderator(self, telegram_id: int) -> bool:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             result = await conn.execute(
                 "INSERT INTO moderators (telegram_id) VALUES ($1) ON CONFLICT DO NOTHING",
                 telegram_id,
             )
-            return result != "INSERT 0 0"
+        self.invalidate_moderators()
+        return result != "INSERT 0 0"
 
+    @writes
     async def remove_moderator(self, telegram_id: int) -> bool:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             result = await conn.execute(
                 "DELETE FROM moderators WHERE telegram_id = $1", telegram_id
             )
-            return result != "DELETE 0"
+        self.invalidate_moderators()
+        return result != "DELETE 0"
 
     async def is_moderator(self, telegram_id: int) -> bool:
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow(
-                "SELECT 1 FROM moderators WHERE telegram_id = $1", telegram_id
-            )
-            return row is not None
+        return telegram_id in await self._moderator_ids()
 
     async def get_all_moderators(self) -> list[int]:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("SELECT telegram_id FROM moderators")
             return [r["telegram_id"] for r in rows]
 
     async def get_staff_ids(self) -> set[int]:
         """Возвращает set из ADMIN_ID + все модераторы из БД."""
         from config import ADMIN_ID
-        mods = await self.get_all_moderators()
-        staff = set(mods)
+        staff = set(await self._moderator_ids())
         if ADMIN_ID:
             staff.add(ADMIN_ID)
         return staff
 
     # === Users ===
 
+    @writes
     async def add_user(self, telegram_id: int, username: str, name: str) -> None:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 """INSERT INTO users (telegram_id, username, name)
                    VALUES ($1, $2, $3)
@@ -207,69 +713,152 @@ class Database:
             )
 
     async def get_user(self, telegram_id: int):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetchrow(
                 "SELECT * FROM users WHERE telegram_id = $1", telegram_id
             )
 
+    @writes
     async def set_user_status(self, telegram_id: int, status: str) -> None:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 "UPDATE users SET status = $1 WHERE telegram_id = $2",
                 status, telegram_id,
             )
 
     async def get_users_by_status(self, status: str):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 "SELECT * FROM users WHERE status = $1 ORDER BY created_at", status
             )
 
     async def get_all_approved_users(self):
-        async with self.pool.acquire() as conn:
+        """Approved users reachable by DM (broadcast recipients)."""
+        async with self._acquire() as conn:
             return await conn.fetch(
-                "SELECT * FROM users WHERE status = 'approved' ORDER BY created_at"
+                """SELECT * FROM users
+                   WHERE status = 'approved' AND delivery_status IS NULL
+                   ORDER BY created_at"""
+            )
+
+    @writes
+    async def set_delivery_status(self, telegram_id: int, status: str | None) -> None:
+        """Mark a user unreachable (status) or reachable again (None)."""
+        async with self._acquire() as conn:
+            await conn.execute(
+                """UPDATE users SET delivery_status = $2::text,
+                   delivery_failed_at = CASE WHEN $2::text IS NULL THEN NULL ELSE NOW() END
+                   WHERE telegram_id = $1""",
+                telegram_id, status,
             )
 
+    @read_only
+    async def get_unreachable_owners_page(self, limit: int, after: tuple = None, before: tuple = None):
+        """Keyset page of spot owners whose DMs currently fail, most recent
+        failure first, i.e. descending by (delivery_failed_at, telegram_id).
+
+        ``after``/``before`` is the (delivery_failed_at, telegram_id) of the
+        edge row of the neighbouring page.
+        """
+        where, order, args = "", "DESC", [limit]
+        if after is not None:
+            where, args = "AND (u.delivery_failed_at, u.telegram_id) < ($2, $3)", [limit, *after]
+        elif before is not None:
+            where, order, args = "AND (u.delivery_failed_at, u.telegram_id) > ($2, $3)", "ASC", [limit, *before]
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                f"""SELECT u.telegram_id, u.name, u.username, u.delivery_status,
+                           u.delivery_failed_at,
+                           array_agg(ps.spot_number ORDER BY ps.spot_number) AS spots
+                    FROM users u
+                    JOIN parking_spots ps ON ps.user_id = u.telegram_id
+                    WHERE u.delivery_status IS NOT NULL {where}
+                    GROUP BY u.telegram_id
+                    ORDER BY u.delivery_failed_at {order}, u.telegram_id {order}
+                    LIMIT $1""",
+                *args,
+            )
+        return rows[::-1] if before is not None else rows
+
+    @read_only
     async def get_all_users(self):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch("SELECT * FROM users ORDER BY created_at")
 
+    @read_only
+    async def get_users_page(self, limit: int, after: tuple = None, before: tuple = None):
+        """Keyset page of users with their spots, ascending by (created_at, telegram_id).
+
+        ``after``/``before`` is the (created_at, telegram_id) of the edge row
+        of the neighbouring page.
+        """
+        where, order, args = "", "ASC", [limit]
+        if after is not None:
+            where, args = "WHERE (u.created_at, u.telegram_id) > ($2, $3)", [limit, *after]
+        elif before is not None:
+            where, order, args = "WHERE (u.created_at, u.telegram_id) < ($2, $3)", "DESC", [limit, *before]
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                f"""SELECT u.telegram_id, u.name, u.username, u.status, u.created_at,
+                           ARRAY(SELECT ps.spot_number FROM parking_spots ps
+                                 WHERE ps.user_id = u.telegram_id
+                                 ORDER BY ps.spot_number) AS spots
+                    FROM users u
+                    {where}
+                    ORDER BY u.created_at {order}, u.telegram_id {order}
+                    LIMIT $1""",
+                *args,
+            )
+        return rows[::-1] if before is not None else rows
+
     # === Parking Spots ===
 
     async def add_spot(self, spot_number: int, user_id: int) -> bool:
         """Assign spot to user. Returns False if this user already has this spot."""
-        async with self.pool.acquire() as conn:
-            existing = await conn.fetchrow(
-                "SELECT * FROM parking_spots WHERE spot_number = $1 AND user_id = $2",
-                spot_number, user_id,
-            )
-            if existing:
-                return False
-            await conn.execute(
-                """INSERT INTO parking_spots (spot_number, user_id)
-                   VALUES ($1, $2)""",
-                spot_number, user_id,
-            )
-            return True
+        return bool(await self.add_spots(user_id, [spot_number]))
+
+    @writes
+    async def add_spots(self, user_id: int, spot_numbers: list[int], status: str = None) -> list[int]:
+        """Assign several spots to a user in one statement; returns the newly added ones.
+
+        If ``status`` is given, the user's status is set in the same transaction.
+        """
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                if status is not None:
+                    await conn.execute(
+                        "UPDATE users SET status = $1 WHERE telegram_id = $2",
+                        status, user_id,
+                    )
+                rows = await conn.fetch(
+                    """INSERT INTO parking_spots (spot_number, user_id)
+                       SELECT DISTINCT unnest($2::int[]), $1
+                       ON CONFLICT (spot_number, user_id) DO NOTHING
+                       RETURNING spot_number""",
+                    user_id, spot_numbers,
+                )
+        added = {r["spot_number"] for r in rows}
+        if added:
+            self.history_cache.invalidate_user(user_id)
+        return [n for n in dict.fromkeys(spot_numbers) if n in added]
 
     async def get_spot(self, spot_number: int):
         """Get first parking_spots row for a spot (check if spot exists)."""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetchrow(
                 "SELECT * FROM parking_spots WHERE spot_number = $1", spot_number
             )
 
     async def get_spot_rows(self, spot_number: int):
         """Get all parking_spots rows for a spot (multiple owners)."""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 "SELECT * FROM parking_spots WHERE spot_number = $1", spot_number
             )
 
     async def get_spot_owners(self, spot_number: int):
         """Get all users who own a spot."""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 """SELECT u.* FROM users u
                    JOIN parking_spots ps ON u.telegram_id = ps.user_id
@@ -277,58 +866,126 @@ class Database:
                 spot_number,
             )
 
+    async def get_owners_for_spots(self, spot_numbers: list[int]) -> dict[int, list]:
+        """Owners of several spots in one query: {spot_number: [user rows]}.
+
+        Spots nobody owns are absent from the result.
+        """
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                """SELECT ps.spot_number, u.* FROM users u
+                   JOIN parking_spots ps ON u.telegram_id = ps.user_id
+                   WHERE ps.spot_number = ANY($1::int[])
+                   ORDER BY ps.spot_number""",
+                spot_numbers,
+            )
+        owners: dict[int, list] = {}
+        for r in rows:
+            owners.setdefault(r["spot_number"], []).append(r)
+        return owners
+
     async def get_spot_owner(self, spot_number: int):
         """Get the first user who owns a spot (backward compat)."""
         owners = await self.get_spot_owners(spot_number)
         return owners[0] if owners else None
 
     async def get_user_spots(self, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 """SELECT * FROM parking_spots WHERE user_id = $1
                    ORDER BY spot_number""",
                 user_id,
             )
 
+    @writes
     async def remove_spot(self, spot_number: int, user_id: int) -> bool:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             result = await conn.execute(
                 "DELETE FROM parking_spots WHERE spot_number = $1 AND user_id = $2",
                 spot_number, user_id,
             )
-            return result != "DELETE 0"
+        self.history_cache.invalidate_spot(spot_number)
+        return result != "DELETE 0"
 
+    @writes
     async def force_remove_spot(self, spot_number: int) -> bool:
         """Admin: remove spot regardless of owner."""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             result = await conn.execute(
                 "DELETE FROM parking_spots WHERE spot_number = $1",
                 spot_number,
             )
-            return result != "DELETE 0"
+        self.history_cache.invalidate_spot(spot_number)
+        return result != "DELETE 0"
 
+    @writes
     async def set_spot_free(
         self, spot_number: int, is_free: bool, free_until=None
     ) -> None:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 """UPDATE parking_spots
                    SET is_temporary_free = $1, free_until = $2
                    WHERE spot_number = $3""",
                 is_free, free_until, spot_number,
             )
+        if is_free:
+            self._notify_expiry("spot", free_until)
+
+    @writes
+    async def expire_free_spots(self, now=None) -> int:
+        """Reset spots whose free_until has passed. Returns the number reset."""
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                """UPDATE parking_spots SET is_temporary_free = FALSE, free_until = NULL
+                   WHERE is_temporary_free = TRUE AND free_until <= COALESCE($1, NOW())""",
+                now,
+            )
+            return int(result.split()[-1])
 
+    @read_only
     async def get_free_spots(self):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 """SELECT ps.*, u.name FROM parking_spots ps
                    JOIN users u ON ps.user_id = u.telegram_id
                    WHERE ps.is_temporary_free = TRUE
+                   AND (ps.free_until IS NULL OR ps.free_until > NOW())
                    ORDER BY ps.spot_number"""
             )
 
+    @read_only
+    async def get_spot_numbers_page(self, limit: int, after: int = None, before: int = None) -> list[int]:
+        """Keyset page of distinct registered spot numbers, ascending."""
+        async with self._acquire() as conn:
+            if after is not None:
+                rows = await conn.fetch(
+                    """SELECT DISTINCT spot_number FROM parking_spots WHERE spot_number > $1
+                       ORDER BY spot_number LIMIT $2""",
+                    after, limit,
+                )
+            elif before is not None:
+                rows = await conn.fetch(
+                    """SELECT DISTINCT spot_number FROM parking_spots WHERE spot_number < $1
+                       ORDER BY spot_number DESC LIMIT $2""",
+                    before, limit,
+                )
+                rows = rows[::-1]
+            else:
+                rows = await conn.fetch(
+                    "SELECT DISTINCT spot_number FROM parking_spots ORDER BY spot_number LIMIT $1",
+                    limit,
+                )
+        return [r["spot_number"] for r in rows]
+
+    @read_only
+    async def count_spot_numbers(self) -> int:
+        async with self._acquire() as conn:
+            return await conn.fetchval("SELECT COUNT(DISTINCT spot_number) FROM parking_spots")
+
+    @read_only
     async def get_all_spots(self):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 """SELECT ps.*, u.name, u.username FROM parking_spots ps
                    JOIN users u ON ps.user_id = u.telegram_id
@@ -337,78 +994,190 @@ class Database:
 
     # === Messages ===
 
+    @writes
     async def add_message(
         self, from_user_id: int, to_spot: int, message_text: str, source: str
     ) -> int:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow(
                 """INSERT INTO messages (from_user_id, to_spot, message_text, source)
                    VALUES ($1, $2, $3, $4) RETURNING id""",
                 from_user_id, to_spot, message_text, source,
             )
-            return row["id"]
+        # The bus would get there too, but not before this user's next read
+        self.history_cache.invalidate_spot(to_spot)
+        return row["id"]
 
+    @writes
     async def set_message_reply(self, message_id: int, reply_text: str) -> None:
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE messages SET reply_text = $1 WHERE id = $2",
+        async with self._acquire() as conn:
+            to_spot = await conn.fetchval(
+                "UPDATE messages SET reply_text = $1 WHERE id = $2 RETURNING to_spot",
                 reply_text, message_id,
             )
-
-    async def get_messages_for_spot(self, spot_number: int, limit: int = 10):
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                """SELECT m.*, u.name as from_name FROM messages m
-                   LEFT JOIN users u ON m.from_user_id = u.telegram_id
-                   WHERE m.to_spot = $1
-                   ORDER BY m.created_at DESC LIMIT $2""",
-                spot_number, limit,
+        if to_spot is not None:
+            self.history_cache.invalidate_spot(to_spot)
+
+    @read_only
+    async def get_messages_for_spot(
+        self, spot_number: int, limit: int = 10, before=None, after=None
+    ):
+        """Messages for a spot, newest first.
+
+        ``before``/``after`` are ``(created_at, id)`` keyset cursors: the page
+        strictly older/newer than that message. The newest page is cached.
+        """
+        where = "m.to_spot = $1"
+        if before is None and after is None:
+            return await self._cached_history(("spot", spot_number), where, [spot_number], limit)
+        return await self._fetch_messages_page(where, [spot_number], limit, before, after)
+
+    @read_only
+    async def get_messages_for_user_spots(
+        self, user_id: int, limit: int = 10, before=None, after=None
+    ):
+        """Get messages for all spots owned by a user (same cursors as above)."""
+        where = "m.to_spot IN (SELECT spot_number FROM parking_spots WHERE user_id = $1)"
+        if before is None and after is None:
+            return await self._cached_history(("user", user_id), where, [user_id], limit)
+        return await self._fetch_messages_page(where, [user_id], limit, before, after)
+
+    @read_only
+    async def search_messages(
+        self, text: str = "", spot_number: int = None, from_user_id: int = None,
+        since=None, until=None, limit: int = 10, before=None, after=None,
+    ):
+        """Staff search over message and reply text (Russian FTS), newest first."""
+        conditions = []
+        args = []
+        if text:
+            args.append(text)
+            conditions.append(f"m.search_tsv @@ websearch_to_tsquery('russian', ${len(args)})")
+        if spot_number is not None:
+            args.append(spot_number)
+            conditions.append(f"m.to_spot = ${len(args)}")
+        if from_user_id is not None:
+            args.append(from_user_id)
+            conditions.append(f"m.from_user_id = ${len(args)}")
+        if since is not None:
+            args.append(since)
+            conditions.append(f"m.created_at >= ${len(args)}")
+        if until is not None:
+            args.append(until)
+            conditions.append(f"m.created_at < ${len(args)}")
+        where = " AND ".join(conditions) if conditions else "TRUE"
+        return await self._fetch_messages_page(where, args, limit, before, after)
+
+    async def _cached_history(self, key: tuple, where: str, args: list, limit: int):
+        """Newest history page through history_cache.
+
+        Misses are read from the primary: a lagging replica could cache a page
+        without the very message that invalidated it.
+        """
+        rows = self.history_cache.get(key, limit)
+        if rows is not None:
+            return rows
+        version = self.history_cache.version
+        token = self._read_route.set("primary")
+        try:
+            rows = await self._fetch_messages_page(where, args, limit, None, None)
+            if key[0] == "user":
+                spots = [r["spot_number"] for r in await self.get_user_spots(key[1])]
+            else:
+                spots = [key[1]]
+        finally:
+            self._read_route.reset(token)
+        self.history_cache.put(key, limit, rows, spots, version)
+        return rows
+
+    async def _fetch_messages_page(self, where: str, args: list, limit: int, before, after):
+        # The plain created_at bound lets idx_messages_to_spot_created serve the
+        # range scan; the row comparison only breaks ties on identical timestamps.
+        query = (
+            "SELECT m.id, m.from_user_id, m.to_spot, m.message_text, m.reply_text, "
+            "m.source, m.created_at, u.name as from_name FROM messages m "
+            "LEFT JOIN users u ON m.from_user_id = u.telegram_id "
+            f"WHERE {where} "
+        )
+        args = list(args)
+        n = len(args)
+        if before is not None:
+            query += (
+                f"AND m.created_at <= ${n + 1} AND (m.created_at, m.id) < (${n + 1}, ${n + 2}) "
+                f"ORDER BY m.created_at DESC, m.id DESC LIMIT ${n + 3}"
             )
-
-    async def get_messages_for_user_spots(self, user_id: int, limit: int = 10):
-        """Get messages for all spots owned by a user."""
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                """SELECT m.*, u.name as from_name FROM messages m
-                   LEFT JOIN users u ON m.from_user_id = u.telegram_id
-                   WHERE m.to_spot IN (
-                       SELECT spot_number FROM parking_spots WHERE user_id = $1
-                   )
-                   ORDER BY m.created_at DESC LIMIT $2""",
-                user_id, limit,
+            args += [before[0], before[1], limit]
+        elif after is not None:
+            query += (
+                f"AND m.created_at >= ${n + 1} AND (m.created_at, m.id) > (${n + 1}, ${n + 2}) "
+                f"ORDER BY m.created_at ASC, m.id ASC LIMIT ${n + 3}"
             )
+            args += [after[0], after[1], limit]
+        else:
+            query += f"ORDER BY m.created_at DESC, m.id DESC LIMIT ${n + 1}"
+            args.append(limit)
+
+        async with self._acquire() as conn:
+            rows = await conn.fetch(query, *args)
+        if after is not None:
+            rows = list(reversed(rows))
+        return rows
 
     # === Reminders ===
 
-    async def add_reminder(self, user_id: int, spot_number: int, remind_at) -> int:
-        async with self.pool.acquire() as conn:
+    @writes
+    async def add_reminder(
+        self, user_id: int, spot_number: int, remind_at, rule: str = None, repeat_until=None
+    ) -> int:
+        """``rule``/``repeat_until`` make it recurring (see services/recurrence.py)."""
+        async with self._acquire() as conn:
             row = await conn.fetchrow(
-                """INSERT INTO reminders (user_id, spot_number, remind_at)
-                   VALUES ($1, $2, $3) RETURNING id""",
-                user_id, spot_number, remind_at,
+                """INSERT INTO reminders (user_id, spot_number, remind_at, rule, repeat_until)
+                   VALUES ($1, $2, $3, $4, $5) RETURNING id""",
+                user_id, spot_number, remind_at, rule, repeat_until,
             )
             return row["id"]
 
     async def get_pending_reminders(self):
         """Get reminders that are due and not yet sent."""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
-                """SELECT r.*, u.name as user_name FROM reminders r
+                """SELECT r.*, u.name as user_name, u.delivery_status FROM reminders r
                    JOIN users u ON r.user_id = u.telegram_id
                    WHERE r.is_sent = FALSE AND r.remind_at <= NOW()
                    ORDER BY r.remind_at"""
             )
 
+    @writes
     async def mark_reminder_sent(self, reminder_id: int):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 "UPDATE reminders SET is_sent = TRUE WHERE id = $1",
                 reminder_id,
             )
 
+    @writes
+    async def reschedule_reminder(self, reminder_id: int, remind_at) -> None:
+        """Move a recurring reminder that just fired on to its next occurrence."""
+        async with self._acquire() as conn:
+            await conn.execute(
+                "UPDATE reminders SET remind_at = $2 WHERE id = $1 AND is_sent = FALSE",
+                reminder_id, remind_at,
+            )
+
+    @writes
+    async def cancel_reminder(self, user_id: int, reminder_id: int) -> bool:
+        """Delete one of the user's active reminders (the whole series if recurring)."""
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                "DELETE FROM reminders WHERE id = $1 AND user_id = $2 AND is_sent = FALSE",
+                reminder_id, user_id,
+            )
+            return result.split()[-1] != "0"
+
     async def get_user_reminders(self, user_id: int):
         """Get active (unsent) reminders for a user."""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 """SELECT * FROM reminders
                    WHERE user_id = $1 AND is_sent = FALSE
@@ -418,19 +1187,21 @@ class Database:
 
     # === Guest Passes ===
 
+    @writes
     async def add_guest_pass(
         self, host_user_id: int, guest_info: str, spot_number: int, expires_at
     ) -> int:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow(
                 """INSERT INTO guest_passes (host_user_id, guest_info, spot_number, expires_at)
                    VALUES ($1, $2, $3, $4) RETURNING id""",
                 host_user_id, guest_info, spot_number, expires_at,
             )
-            return row["id"]
+        self._notify_expiry("pass", expires_at)
+        return row["id"]
 
     async def get_active_guest_passes(self, host_user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 """SELECT * FROM guest_passes
                    WHERE host_user_id = $1 AND is_active = TRUE
@@ -439,9 +1210,10 @@ class Database:
                 host_user_id,
             )
 
+    @read_only
     async def get_all_active_guest_passes(self):
         """All active guest passes across users (for /map)."""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 """SELECT gp.*, u.name as host_name FROM guest_passes gp
                    JOIN users u ON gp.host_user_id = u.telegram_id
@@ -449,19 +1221,40 @@ class Database:
                    ORDER BY gp.spot_number, gp.expires_at"""
             )
 
-    async def deactivate_expired_passes(self) -> int:
-        async with self.pool.acquire() as conn:
+    @writes
+    async def deactivate_expired_passes(self, now=None) -> int:
+        async with self._acquire() as conn:
             result = await conn.execute(
                 """UPDATE guest_passes SET is_active = FALSE
-                   WHERE is_active = TRUE AND expires_at <= NOW()"""
+                   WHERE is_active = TRUE AND expires_at <= COALESCE($1, NOW())""",
+                now,
             )
             count = int(result.split()[-1])
             return count
 
+    # === Expiry scheduling ===
+
+    def _notify_expiry(self, kind: str, deadline) -> None:
+        if deadline is not None and self.expiry_listener:
+            self.expiry_listener(kind, deadline)
+
+    async def get_upcoming_expiries(self) -> list[tuple]:
+        """Distinct future deadlines as (deadline, kind) — seeds the expiry timer heap."""
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                """SELECT DISTINCT free_until AS deadline, 'spot' AS kind FROM parking_spots
+                   WHERE is_temporary_free = TRUE AND free_until > NOW()
+                   UNION
+                   SELECT DISTINCT expires_at, 'pass' FROM guest_passes
+                   WHERE is_active = TRUE AND expires_at > NOW()"""
+            )
+            return [(r["deadline"], r["kind"]) for r in rows]
+
     # === Announcements ===
 
+    @writes
     async def add_announcement(self, admin_id: int, text: str) -> int:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow(
                 """INSERT INTO announcements (admin_id, text)
                    VALUES ($1, $2) RETURNING id""",
@@ -469,8 +1262,9 @@ class Database:
             )
             return row["id"]
 
+    @read_only
     async def get_recent_announcements(self, limit: int = 5):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetch(
                 "SELECT * FROM announcements ORDER BY created_at DESC LIMIT $1",
                 limit,
@@ -478,22 +1272,20 @@ class Database:
 
     # === Personal Stats (for "Моё место") ===
 
+    @read_only
     async def get_user_personal_stats(self, user_id: int, days: int = 30) -> dict:
-        """Per-user counters: messages received on their spots, last message, active reminders/guests."""
-        async with self.pool.acquire() as conn:
-            messages_received = await conn.fetchval(
-                """SELECT COUNT(*) FROM messages
-                   WHERE to_spot IN (SELECT spot_number FROM parking_spots WHERE user_id = $1)
-                   AND created_at > NOW() - ($2 || ' days')::interval""",
-                user_id, str(days),
-            )
-            last_message = await conn.fetchrow(
-                """SELECT m.created_at, m.message_text, m.to_spot, u.name as from_name
-                   FROM messages m
-                   LEFT JOIN users u ON m.from_user_id = u.telegram_id
-                   WHERE m.to_spot IN (SELECT spot_number FROM parking_spots WHERE user_id = $1)
-                   ORDER BY m.created_at DESC LIMIT 1""",
-                user_id,
+        """Per-user counters: messages to/from their spots over the last ``days``
+        days (from spot_daily_activity), last message, active reminders/guests."""
+        # The newest page of their history, usually already cached
+        latest = await self.get_messages_for_user_spots(user_id, 1)
+        since = activity_today() - timedelta(days=days - 1)
+        async with self._acquire() as conn:
+            activity = await conn.fetchrow(
+                """SELECT COALESCE(SUM(received), 0) AS received, COALESCE(SUM(sent), 0) AS sent
+                   FROM spot_daily_activity
+                   WHERE spot_number IN (SELECT spot_number FROM parking_spots WHERE user_id = $1)
+                   AND day >= $2""",
+                user_id, since,
             )
             active_reminders = await conn.fetchval(
                 "SELECT COUNT(*) FROM reminders WHERE user_id = $1 AND is_sent = FALSE",
@@ -505,8 +1297,9 @@ class Database:
                 user_id,
             )
             return {
-                "messages_received": messages_received or 0,
-                "last_message": dict(last_message) if last_message else None,
+                "messages_received": activity["received"],
+                "messages_sent": activity["sent"],
+                "last_message": dict(latest[0]) if latest else None,
                 "active_reminders": active_reminders or 0,
                 "active_guests": active_guests or 0,
                 "days": days,
@@ -514,8 +1307,9 @@ class Database:
 
     # === Stats ===
 
+    @read_only
     async def get_stats(self) -> dict:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             users_total = await conn.fetchval("SELECT COUNT(*) FROM users")
             users_approved = await conn.fetchval(
                 "SELECT COUNT(*) FROM users WHERE status = 'approved'"
@@ -525,9 +1319,17 @@ class Database:
             )
             spots_total = await conn.fetchval("SELECT COUNT(*) FROM parking_spots")
             spots_free = await conn.fetchval(
-                "SELECT COUNT(*) FROM parking_spots WHERE is_temporary_free = TRUE"
+                """SELECT COUNT(*) FROM parking_spots
+                   WHERE is_temporary_free = TRUE
+                   AND (free_until IS NULL OR free_until > NOW())"""
+            )
+            # From the rollup: all-time (archived months included) without a scan
+            messages = await conn.fetchrow(
+                """SELECT COALESCE(SUM(received), 0) AS total,
+                          COALESCE(SUM(received) FILTER (WHERE day >= $1), 0) AS week
+                   FROM spot_daily_activity""",
+                activity_today() - timedelta(days=6),
             )
-            messages_total = await conn.fetchval("SELECT COUNT(*) FROM messages")
             guests_active = await conn.fetchval(
                 """SELECT COUNT(*) FROM guest_passes
                    WHERE is_active = TRUE AND expires_at > NOW()"""
@@ -538,17 +1340,330 @@ class Database:
                 "users_pending": users_pending,
                 "spots_total": spots_total,
                 "spots_free": spots_free,
-                "messages_total": messages_total,
+                "messages_total": messages["total"],
+                "messages_week": messages["week"],
                 "guests_active": guests_active,
             }
 
+    # === Alert coalescing ===
+
+    @writes
+    async def coalesce_alert(
+        self, spot_number: int, window: float, from_user_id: int,
+        reporter: str, text: str, source: str,
+    ) -> tuple[bool, dict]:
+        """Log an alert to a spot, merging it into the spot's open window.
+
+        The first alert in ``window`` seconds opens the window with a new
+        messages row; later ones are appended to that row and counted.
+        Returns ``(opened, state)``, state being the window's alerts,
+        message_id, reports and dms (see _ALERT_WINDOWS_DDL).
+        """
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=window)
+        async with self.unit_of_work():
+            async with self._acquire() as conn:
+                while True:
+                    row = await conn.fetchrow(
+                        """UPDATE alert_windows SET alerts = alerts + 1
+                           WHERE spot_number = $1 AND opened_at > $2
+                           RETURNING alerts, message_id, reports, dms""",
+                        spot_number, cutoff,
+                    )
+                    if row is not None:
+                        reports = json.loads(row["reports"]) + [[reporter, text]]
+                        await conn.execute(
+                            "UPDATE alert_windows SET reports = $2 WHERE spot_number = $1",
+                            spot_number, json.dumps(reports, ensure_ascii=False),
+                        )
+                        await conn.execute(
+                            "UPDATE messages SET message_text = message_text || $2 WHERE id = $1",
+                            row["message_id"], f"\n+ {reporter}: {text}",
+                        )
+                        opened, alerts, message_id = False, row["alerts"], row["message_id"]
+                        dms = json.loads(row["dms"])
+                        break
+                    # No open window: claim the row, unless a concurrent alert just did
+                    claimed = await conn.fetchval(
+                        """INSERT INTO alert_windows (spot_number, opened_at, alerts, reports, dms)
+                           VALUES ($1, $2, 1, $3, '{}')
+                           ON CONFLICT (spot_number) DO UPDATE
+                           SET opened_at = excluded.opened_at, alerts = 1, message_id = NULL,
+                               reports = excluded.reports, dms = '{}'
+                           WHERE alert_windows.opened_at <= $4
+                           RETURNING spot_number""",
+                        spot_number, now, json.dumps([[reporter, text]], ensure_ascii=False), cutoff,
+                    )
+                    if claimed is None:
+                        continue
+                    message_id = await conn.fetchval(
+                        """INSERT INTO messages (from_user_id, to_spot, message_text, source)
+                           VALUES ($1, $2, $3, $4) RETURNING id""",
+                        from_user_id, spot_number, text, source,
+                    )
+                    await conn.execute(
+                        "UPDATE alert_windows SET message_id = $2 WHERE spot_number = $1",
+                        spot_number, message_id,
+                    )
+                    opened, alerts, reports, dms = True, 1, [[reporter, text]], {}
+                    break
+        self.history_cache.invalidate_spot(spot_number)
+        return opened, {
+            "alerts": alerts,
+            "message_id": message_id,
+            "reports": reports,
+            "dms": {int(k): v for k, v in dms.items()},
+        }
+
+    @writes
+    async def add_alert_dms(self, spot_number: int, message_id: int, dms: dict[int, int]) -> dict | None:
+        """Remember DMs sent for a window; returns its current state, or None
+        if the window has been replaced by a newer one since."""
+        async with self.unit_of_work():
+            async with self._acquire() as conn:
+                # The no-op SET takes the row lock before the read-modify-write
+                row = await conn.fetchrow(
+                    """UPDATE alert_windows SET dms = dms
+                       WHERE spot_number = $1 AND message_id = $2
+                       RETURNING alerts, reports, dms""",
+                    spot_number, message_id,
+                )
+                if row is None:
+                    return None
+                merged = {**json.loads(row["dms"]), **{str(k): v for k, v in dms.items()}}
+                await conn.execute(
+                    "UPDATE alert_windows SET dms = $2 WHERE spot_number = $1",
+                    spot_number, json.dumps(merged),
+                )
+        return {
+            "alerts": row["alerts"],
+            "message_id": message_id,
+            "reports": json.loads(row["reports"]),
+            "dms": {int(k): v for k, v in merged.items()},
+        }
+
+    # === CSV exports ===
+
+    def _export_query(self, kind: str, status: str = None, spot_from: int = None,
+                      spot_to: int = None, since=None, until=None) -> tuple[str, list]:
+        """SELECT for an export and its args; raises ValueError for an unknown kind.
+
+        For users/pending ``status`` is the user status and the period is the
+        registration time; for messages it is the source and the send time.
+        """
+        conditions = []
+        args = []
+        if kind == "messages":
+            if status is not None:
+                args.append(status)
+                conditions.append(f"m.source = ${len(args)}")
+            if spot_from is not None:
+                args.append(spot_from)
+                conditions.append(f"m.to_spot >= ${len(args)}")
+            if spot_to is not None:
+                args.append(spot_to)
+                conditions.append(f"m.to_spot <= ${len(args)}")
+            if since is not None:
+                args.append(since)
+                conditions.append(f"m.created_at >= ${len(args)}")
+            if until is not None:
+                args.append(until)
+                conditions.append(f"m.created_at < ${len(args)}")
+            where = " AND ".join(conditions) if conditions else "TRUE"
+            return f"""SELECT m.id, m.created_at, m.source, m.from_user_id, u.name AS from_name,
+                              m.to_spot, m.message_text, m.reply_text
+                       FROM messages m LEFT JOIN users u ON u.telegram_id = m.from_user_id
+                       WHERE {where}
+                       ORDER BY m.created_at, m.id""", args
+        if kind not in ("users", "pending"):
+            raise ValueError(f"Unknown export: {kind}")
+
+        if kind == "pending":
+            status = "pending"
+        if status is not None:
+            args.append(status)
+            conditions.append(f"u.status = ${len(args)}")
+        if spot_from is not None or spot_to is not None:
+            spot_conditions = ["s.user_id = u.telegram_id"]
+            if spot_from is not None:
+                args.append(spot_from)
+                spot_conditions.append(f"s.spot_number >= ${len(args)}")
+            if spot_to is not None:
+                args.append(spot_to)
+                spot_conditions.append(f"s.spot_number <= ${len(args)}")
+            conditions.append(
+                f"EXISTS (SELECT 1 FROM parking_spots s WHERE {' AND '.join(spot_conditions)})"
+            )
+        if since is not None:
+            args.append(since)
+            conditions.append(f"u.created_at >= ${len(args)}")
+        if until is not None:
+            args.append(until)
+            conditions.append(f"u.created_at < ${len(args)}")
+        where = " AND ".join(conditions) if conditions else "TRUE"
+        return f"""SELECT u.telegram_id, u.username, u.name, u.status, u.created_at,
+                          (SELECT {self._SPOT_LIST_SQL} FROM (
+                               SELECT spot_number FROM parking_spots
+                               WHERE user_id = u.telegram_id ORDER BY spot_number
+                           ) s) AS spots,
+                          u.delivery_status
+                   FROM users u
+                   WHERE {where}
+                   ORDER BY u.created_at, u.telegram_id""", args
+
+    @read_only
+    async def export_csv(self, kind: str, path: str, **filters) -> int:
+        """Stream an export (see _export_query) into a gzipped CSV at ``path``.
+
+        COPY … TO STDOUT hands over CSV chunks that go straight into the gzip
+        file — rows are never built in Python. Returns the row count.
+        """
+        query, args = self._export_query(kind, **filters)
+        gz = await asyncio.to_thread(gzip.open, path, "wb")
+        try:
+            async def write(chunk: bytes):
+                await asyncio.to_thread(gz.write, chunk)
+
+            async with self._acquire() as conn:
+                result = await conn.copy_from_query(
+                    query, *args, format="csv", header=True, output=write,
+                )
+        finally:
+            await asyncio.to_thread(gz.close)
+        return int(result.split()[-1])
+
+    # === Analytics ===
+
+    @writes
+    async def record_incident(self, source: str) -> None:
+        """Count an incident that has no messages row (a staff report)."""
+        hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        async with self._acquire() as conn:
+            await conn.execute(
+                """INSERT INTO incident_hourly (hour, source, incidents) VALUES ($1, $2, 1)
+                   ON CONFLICT (hour, source) DO UPDATE SET incidents = incident_hourly.incidents + 1""",
+                hour, source,
+            )
+
+    @read_only
+    async def get_incident_hours(self, since: datetime):
+        """incident_hourly rows (hour, source, incidents) from ``since``, oldest first."""
+        async with self._acquire() as conn:
+            return await conn.fetch(
+                """SELECT hour, source, incidents FROM incident_hourly
+                   WHERE hour >= $1 ORDER BY hour""",
+                since,
+            )
+
+    @read_only
+    async def get_top_spots(self, since: date, limit: int = 10):
+        """Spots with the most messages received since ``since`` (from spot_daily_activity)."""
+        async with self._acquire() as conn:
+            return await conn.fetch(
+                """SELECT spot_number, SUM(received) AS received FROM spot_daily_activity
+                   WHERE day >= $1
+                   GROUP BY spot_number
+                   HAVING SUM(received) > 0
+                   ORDER BY received DESC, spot_number
+                   LIMIT $2""",
+                since, limit,
+            )
+
+    # === Retention ===
+
+    async def ensure_message_partitions(self, months_ahead: int = 2) -> None:
+        """Pre-create partitions for the current and upcoming months."""
+        now = datetime.now(timezone.utc)
+        async with self._acquire() as conn:
+            await _ensure_message_partitions(conn, now, now + timedelta(days=31 * months_ahead))
+
+    async def _ensure_partitions(self, conn, start: datetime, end: datetime) -> None:
+        await _ensure_message_partitions(conn, start, end)
+
+    async def archive_message_partitions(self, keep_months: int, archive_dir: str) -> list[str]:
+        """Dump partitions older than ``keep_months`` to gzipped CSV, then drop them.
+
+        Returns the archive paths. A partition is only detached once its dump
+        has been written completely.
+        """
+        cutoff = _month_start(datetime.now(timezone.utc))
+        for _ in range(keep_months):
+            cutoff = _month_start(cutoff - timedelta(days=1))
+
+        os.makedirs(archive_dir, exist_ok=True)
+        paths = []
+        async with self._acquire() as conn:
+            names = await conn.fetch(
+                """SELECT c.relname FROM pg_inherits i
+                   JOIN pg_class c ON c.oid = i.inhrelid
+                   WHERE i.inhparent = 'messages'::regclass
+                   ORDER BY c.relname"""
+            )
+            for row in names:
+                name = row["relname"]
+                match = _PARTITION_RE.match(name)
+                if not match:
+                    continue
+                month = datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)
+                if _next_month(month) > cutoff:
+                    continue
+
+                path = os.path.join(archive_dir, f"{name}.csv.gz")
+                gz = await asyncio.to_thread(gzip.open, path, "wb")
+                try:
+                    async def write(chunk: bytes):
+                        await asyncio.to_thread(gz.write, chunk)
+
+                    await conn.copy_from_table(
+                        name, columns=_MESSAGE_COLUMNS, format="csv", header=True, output=write,
+                    )
+                finally:
+                    await asyncio.to_thread(gz.close)
+
+                async with conn.transaction():
+                    await conn.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+                    await conn.execute(f"DROP TABLE {name}")
+                logger.info(f"Archived partition {name} to {path}")
+                paths.append(path)
+            if paths:
+                # Dropping a partition fires no row triggers
+                await conn.execute(f"SELECT pg_notify('{CHANNEL}', 'messages:*')")
+        if paths:
+            self.history_cache.clear()
+        return paths
+
+    @writes
+    async def delete_sent_reminders(self, older_than_days: int) -> int:
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                """DELETE FROM reminders
+                   WHERE is_sent = TRUE AND remind_at < NOW() - make_interval(days => $1)""",
+                older_than_days,
+            )
+            return int(result.split()[-1])
+
+    @writes
+    async def delete_stale_guest_passes(self, older_than_days: int) -> int:
+        """Drop passes that expired (or were deactivated) more than N days ago."""
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                """DELETE FROM guest_passes
+                   WHERE expires_at < NOW() - make_interval(days => $1)""",
+                older_than_days,
+            )
+            return int(result.split()[-1])
+
     # === Backup / Restore ===
 
+    @read_only
     async def export_all_data(self) -> str:
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             users = await conn.fetch("SELECT * FROM users")
             spots = await conn.fetch("SELECT * FROM parking_spots")
-            messages = await conn.fetch("SELECT * FROM messages")
+            messages = await conn.fetch(
+                """SELECT id, from_user_id, to_spot, message_text, reply_text, source, created_at
+                   FROM messages"""
+            )
             guests = await conn.fetch("SELECT * FROM guest_passes")
             announcements = await conn.fetch("SELECT * FROM announcements")
             moderators = await conn.fetch("SELECT * FROM moderators")
@@ -576,6 +1691,7 @@ class Database:
         }
         return json.dumps(data, ensure_ascii=False, indent=2)
 
+    @writes
     async def import_all_data(self, json_str: str) -> dict:
         data = json.loads(json_str)
         counts = {}
@@ -587,7 +1703,7 @@ class Database:
                 return datetime.fromisoformat(value)
             return value
 
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             # Users
             for u in data.get("users", []):
                 await conn.execute(
@@ -612,7 +1728,10 @@ class Database:
                 )
             counts["parking_spots"] = len(data.get("parking_spots", []))
 
-            # Messages
+            # Messages — make sure every month being restored has a partition
+            created = [parse_dt(m["created_at"]) for m in data.get("messages", [])]
+            if created:
+                await self._ensure_partitions(conn, min(created), max(created))
             for m in data.get("messages", []):
                 await conn.execute(
                     """INSERT INTO messages (from_user_id, to_spot, message_text, reply_text, source, created_at)
@@ -651,16 +1770,28 @@ class Database:
                     mod["telegram_id"],
                 )
             counts["moderators"] = len(data.get("moderators", []))
+            self.invalidate_moderators()
 
             # Reminders
             for r in data.get("reminders", []):
                 await conn.execute(
-                    """INSERT INTO reminders (user_id, spot_number, remind_at, is_sent, created_at)
-                       VALUES ($1, $2, $3, $4, $5)
+                    """INSERT INTO reminders
+                       (user_id, spot_number, remind_at, is_sent, created_at, rule, repeat_until)
+                       VALUES ($1, $2, $3, $4, $5, $6, $7)
                        ON CONFLICT DO NOTHING""",
                     r["user_id"], r["spot_number"], parse_dt(r["remind_at"]),
                     r["is_sent"], parse_dt(r["created_at"]),
+                    r.get("rule"), parse_dt(r.get("repeat_until")),
                 )
             counts["reminders"] = len(data.get("reminders", []))
 
+        self.history_cache.clear()
         return counts
+
+
+def create_database(database_url: str) -> Database:
+    """The backend for ``database_url``: SQLite for sqlite:// URLs, Postgres otherwise."""
+    if database_url.startswith("sqlite:"):
+        from services.sqlite_database import SQLiteDatabase
+        return SQLiteDatabase()
+    return Database()
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Iterable
+
+from services.log import LogThrottle
+
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+    TelegramRetryAfter, TelegramServerError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Failure kinds. BLOCKED and CHAT_NOT_FOUND are stored on the user
+# (users.delivery_status) and skipped until the user writes to the bot again.
+BLOCKED = "blocked"
+CHAT_NOT_FOUND = "chat_not_found"
+FLOOD = "flood"
+TRANSIENT = "transient"
+FAILED = "failed"
+
+UNREACHABLE = (BLOCKED, CHAT_NOT_FOUND)
+
+MAX_FLOOD_WAIT = 30  # seconds; longer waits are reported instead of slept
+
+FANOUT_CONCURRENCY = 8  # parallel sends per fan-out
+FANOUT_TIMEOUT = 10  # seconds per recipient
+
+# A broadcast to many dead chats would otherwise log one warning per recipient
+_failure_log = LogThrottle(period=60)
+
+
+def classify_error(error: Exception) -> str:
+    if isinstance(error, TelegramForbiddenError):
+        # "bot can't initiate conversation" — the user never pressed /start
+        if "initiate" in error.message:
+            return CHAT_NOT_FOUND
+        return BLOCKED
+    if isinstance(error, TelegramBadRequest) and "chat not found" in error.message.lower():
+        return CHAT_NOT_FOUND
+    if isinstance(error, TelegramRetryAfter):
+        return FLOOD
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)):
+        return TRANSIENT
+    return FAILED
+
+
+async def deliver(db, user_id: int, send: Callable[[], Awaitable[Any]]) -> tuple[Any, str | None]:
+    """Run ``send()`` for one recipient.
+
+    Returns ``(result, None)`` on success or ``(None, kind)`` on failure.
+    Dead chats are recorded on the user; a short flood wait is slept off
+    and retried once.
+    """
+    for attempt in range(2):
+        try:
+            return await send(), None
+        except Exception as e:
+            kind = classify_error(e)
+            if kind == FLOOD and attempt == 0 and e.retry_after <= MAX_FLOOD_WAIT:
+                await asyncio.sleep(e.retry_after)
+                continue
+            if kind in UNREACHABLE:
+                try:
+                    await db.set_delivery_status(user_id, kind)
+                except Exception as db_error:
+                    logger.error(f"Failed to record {kind} for {user_id}: {db_error}")
+            suppressed = _failure_log.allow((kind, type(e).__name__))
+            if suppressed is not None:
+                more = f" (+{suppressed} similar suppressed)" if suppressed else ""
+                logger.warning(
+                    f"Delivery to {user_id} failed ({kind}): {e}{more}",
+                    extra={"recipient": user_id, "failure": kind},
+                )
+            return None, kind
+    return None, FLOOD
+
+
+async def fan_out(
+    db,
+    recipients: Iterable[int],
+    send: Callable[[int], Awaitable[Any]],
+    concurrency: int = FANOUT_CONCURRENCY,
+    timeout: float = FANOUT_TIMEOUT,
+) -> dict[int, tuple[Any, str | None]]:
+    """Call ``send(user_id)`` for every recipient concurrently.
+
+    At most ``concurrency`` sends are in flight and each is cut off after
+    ``timeout`` seconds. Returns ``{user_id: (result, failure_kind)}`` in
+    recipient order, with the same semantics as :func:`deliver`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id: int):
+        async with semaphore:
+            return user_id, await deliver(
+                db, user_id, lambda: asyncio.wait_for(send(user_id), timeout)
+            )
+
+    return dict(await asyncio.gather(*(one(uid) for uid in dict.fromkeys(recipients))))
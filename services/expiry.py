@@ -0,0 +1,68 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    """Resets free spots and deactivates guest passes exactly at their deadline.
+
+    Deadlines live in a min-heap seeded from the DB at startup and fed by
+    ``Database.expiry_listener`` on every write that sets one. Firing runs the
+    bulk "expire everything due" update for that kind, so stale or duplicate
+    heap entries are harmless.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._heap: list[tuple[datetime, str]] = []
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, kind: str, deadline: datetime) -> None:
+        heapq.heappush(self._heap, (deadline, kind))
+        self._wakeup.set()
+
+    async def load(self) -> None:
+        # Catch up on anything that expired while the bot was down
+        now = datetime.now(timezone.utc)
+        for kind in ("spot", "pass"):
+            await self._expire(kind, now)
+        for deadline, kind in await self.db.get_upcoming_expiries():
+            heapq.heappush(self._heap, (deadline, kind))
+        logger.info(f"Expiry scheduler loaded {len(self._heap)} deadlines")
+
+    async def run(self) -> None:
+        await self.load()
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = (self._heap[0][0] - datetime.now(timezone.utc)).total_seconds()
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    continue  # new deadline — recompute the earliest one
+                except asyncio.TimeoutError:
+                    pass
+
+            now = datetime.now(timezone.utc)
+            due = set()
+            while self._heap and self._heap[0][0] <= now:
+                due.add(heapq.heappop(self._heap)[1])
+            for kind in due:
+                try:
+                    await self._expire(kind, now)
+                except Exception as e:
+                    logger.error(f"Expiry of {kind} failed: {e}")
+
+    async def _expire(self, kind: str, now: datetime) -> None:
+        if kind == "spot":
+            count = await self.db.expire_free_spots(now)
+            label = "free spots reset"
+        else:
+            count = await self.db.deactivate_expired_passes(now)
+            label = "guest passes deactivated"
+        if count:
+            logger.info(f"Expiry: {count} {label}")
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Measures event loop lag: how late a periodic sleep wakes up."""
+
+    def __init__(self, interval: float = 1.0, warn_after: float = 0.5, window: int = 60):
+        self.interval = interval
+        self.warn_after = warn_after
+        self._samples: deque[float] = deque(maxlen=window)
+
+    @property
+    def lag(self) -> float:
+        return self._samples[-1] if self._samples else 0.0
+
+    @property
+    def max_lag(self) -> float:
+        """Worst lag over the last ``window`` probes."""
+        return max(self._samples, default=0.0)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self._samples.append(lag)
+            if lag > self.warn_after:
+                logger.warning(f"Event loop lag {lag * 1000:.0f} ms", extra={"loop_lag_ms": round(lag * 1000)})
+
+
+async def readiness(db, tasks, lag: LoopLagMonitor, max_lag: float,
+                    db_timeout: float, supervisor=None) -> tuple[bool, dict]:
+    """Run every readiness check; returns (ready, report).
+
+    ``tasks`` is the TaskSupervisor, ``supervisor`` the ShardSupervisor (sharded mode).
+    """
+    checks = {}
+
+    try:
+        await db.ping(db_timeout)
+        checks["database"] = {"ok": True}
+    except Exception as e:
+        checks["database"] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    pool = db.pool_stats()
+    # Every connection checked out and the pool can't grow — new queries will queue
+    pool["ok"] = pool["idle"] > 0 or pool["size"] < pool["max"]
+    checks["pool"] = pool
+
+    # Tasks are restarted on failure — not ready only while one keeps failing
+    checks["tasks"] = {"ok": tasks.healthy(), "jobs": tasks.status()}
+
+    checks["loop"] = {
+        "ok": lag.max_lag <= max_lag,
+        "lag_ms": round(lag.lag * 1000),
+        "max_lag_ms": round(lag.max_lag * 1000),
+    }
+
+    if db.bus is not None:  # the SQLite backend invalidates in-process
+        checks["cache_bus"] = {"ok": db.bus.connected}
+
+    replica = db.replica_stats()
+    if replica is not None:
+        # Informational — reads fall back to the primary on their own
+        checks["replica"] = {"ok": True, **replica}
+
+    # Informational
+    checks["history_cache"] = {"ok": True, **db.history_cache.stats()}
+
+    if supervisor:
+        shards = supervisor.status()
+        checks["shards"] = {"ok": all(s["alive"] for s in shards), "workers": shards}
+
+    return all(c["ok"] for c in checks.values()), checks
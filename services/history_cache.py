@@ -0,0 +1,95 @@
+from collections import OrderedDict
+
+
+class HistoryCache:
+    """LRU of the newest history page per spot and per user's spots.
+
+    Keys are ``("spot", spot_number)`` and ``("user", user_id)``. Each entry
+    remembers the spots it covers, so a message to a spot drops exactly the
+    entries showing that spot. Loads started before an invalidation are not
+    stored (``version``), the same guard as the moderator cache.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        # key -> (limit, rows, spots)
+        self._entries: OrderedDict[tuple, tuple[int, list, frozenset]] = OrderedDict()
+        self._by_spot: dict[int, set[tuple]] = {}
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple, limit: int) -> list | None:
+        entry = self._entries.get(key)
+        # A shorter page is enough; a longer one only if the cached page is the whole history
+        if entry is None or (entry[0] < limit and len(entry[1]) >= entry[0]):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1][:limit]
+
+    def put(self, key: tuple, limit: int, rows: list, spots, version: int) -> None:
+        if version != self.version or self.max_entries <= 0:
+            return
+        self._drop(key)
+        spots = frozenset(spots)
+        self._entries[key] = (limit, list(rows), spots)
+        for spot in spots:
+            self._by_spot.setdefault(spot, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key: tuple) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for spot in entry[2]:
+            keys = self._by_spot.get(spot)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_spot[spot]
+        return True
+
+    def invalidate_spot(self, spot_number: int) -> None:
+        """A message to (or an owner change of) the spot."""
+        self.version += 1
+        for key in list(self._by_spot.get(spot_number, ())):
+            self.invalidations += self._drop(key)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """The user's spot list changed."""
+        self.version += 1
+        self.invalidations += self._drop(("user", user_id))
+
+    def invalidate_sender(self, user_id: int) -> None:
+        """The user's row changed — pages showing their name are stale."""
+        self.version += 1
+        stale = [
+            key for key, (_, rows, _) in self._entries.items()
+            if any(r["from_user_id"] == user_id for r in rows)
+        ]
+        for key in stale:
+            self.invalidations += self._drop(key)
+
+    def clear(self) -> None:
+        self.version += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._by_spot.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,150 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+# Set per update by UpdateContextMiddleware; copied onto every record logged while
+# handling it (tasks spawned from a handler inherit the context too)
+update_id_var: ContextVar[int | None] = ContextVar("update_id", default=None)
+user_id_var: ContextVar[int | None] = ContextVar("user_id", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has — anything else came in via ``extra=``
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "update_id"):
+            record.update_id = update_id_var.get()
+        if not hasattr(record, "user_id"):
+            record.user_id = user_id_var.get()
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the stock prepare(), keep the traceback apart from the message
+        # so the JSON formatter can put it in its own field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, update/user ids and extras."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "process": record.processName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(log_file: str | None = "bot.log", json_console: bool = False) -> None:
+    """Log through a queue: callers only enqueue, a listener thread does the I/O.
+
+    The file gets JSON lines; the console gets text unless ``json_console``.
+    """
+    console = logging.StreamHandler()
+    console.setFormatter(JsonFormatter() if json_console else logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+    if log_file:
+        file_handler = RotatingFileHandler(
+            log_file, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = _QueueHandler(log_queue)
+    # Context vars are read in the calling task, before the record is queued
+    queue_handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # flushes whatever is still queued
+
+
+class LogThrottle:
+    """Lets one record per key through every ``period`` seconds.
+
+    ``allow(key)`` returns how many were suppressed since the last one let
+    through, or None if this one should be suppressed too. Keys not let through
+    for a whole period are forgotten as other keys come in, along with their
+    suppressed count, so per-user keys don't pile up.
+    """
+
+    def __init__(self, period: float = 60):
+        self.period = period
+        # Ordered oldest first: a key is re-inserted whenever it is let through
+        self._last: dict[Any, float] = {}
+        self._suppressed: dict[Any, int] = {}
+
+    def allow(self, key) -> int | None:
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < self.period:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return None
+        self._last.pop(key, None)
+        self._last[key] = now  # moved to the end
+        suppressed = self._suppressed.pop(key, 0)
+        self._prune(now)
+        return suppressed
+
+    def _prune(self, now: float) -> None:
+        while True:
+            oldest = next(iter(self._last))
+            if now - self._last[oldest] < self.period:
+                return
+            del self._last[oldest]
+            self._suppressed.pop(oldest, None)
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    """Outer update middleware: tags log records with the update and user ids."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        update_token = update_id_var.set(event.update_id)
+        user_token = user_id_var.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            update_id_var.reset(update_token)
+            user_id_var.reset(user_token)
@@ -0,0 +1,104 @@
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Iterable
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+# Shared by the paged lists (/users, /map): one keyset query and one edited
+# message per page. A list supplies ``fetch(limit, after=key | before=key)``
+# returning rows in list order (ascending by key, or descending for a
+# newest-first list), and ``key_of(row)`` — the callback token of a row (must
+# not contain "_").
+
+Fetch = Callable[..., Awaitable[list]]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Keyset position (created_at, id) → "{µs since epoch}.{id}" for callback data."""
+    return f"{(created_at - _EPOCH) // _MICROSECOND}.{row_id}"
+
+
+def decode_cursor(token: str) -> tuple[datetime, int]:
+    """Inverse of encode_cursor. Raises ValueError."""
+    # Buttons drawn before the shared format separated the parts with "_"
+    ts, row_id = token.replace("_", ".").split(".")
+    return _EPOCH + int(ts) * _MICROSECOND, int(row_id)
+
+
+async def fetch_page(fetch: Fetch, page_size: int, direction: str | None = None, key=None):
+    """One page in ascending order plus whether pages exist before and after it.
+
+    ``direction`` is None for the first page, "n" for the page after ``key``
+    and "p" for the page before it. Falls back to the first page if the
+    requested one is empty (rows deleted since the buttons were drawn).
+    """
+    if direction == "p":
+        rows = await fetch(page_size + 1, before=key)
+        has_prev = len(rows) > page_size
+        rows, has_next = rows[-page_size:], True
+    elif direction == "n":
+        rows = await fetch(page_size + 1, after=key)
+        has_next = len(rows) > page_size
+        rows, has_prev = rows[:page_size], True
+    else:
+        rows, has_prev, has_next = [], False, False
+    if not rows:
+        rows = await fetch(page_size + 1)
+        has_next = len(rows) > page_size
+        rows, has_prev = rows[:page_size], False
+    return rows, has_prev, has_next
+
+
+def nav_keyboard(prefix: str, rows: list, key_of: Callable[[Any], str],
+                 has_prev: bool, has_next: bool) -> InlineKeyboardMarkup | None:
+    """⬅️/➡️ buttons carrying ``{prefix}_{p|n}_{key}`` of the edge rows."""
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"{prefix}_p_{key_of(rows[0])}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=f"{prefix}_n_{key_of(rows[-1])}"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+def parse_nav(data: str) -> tuple[str, str]:
+    """``{prefix}_{p|n}_{key}`` → (direction, key). Raises ValueError."""
+    _, direction, key = data.split("_", 2)
+    if direction not in ("p", "n"):
+        raise ValueError(data)
+    return direction, key
+
+
+@lru_cache
+def _filter_re(keys: tuple[str, ...]) -> re.Pattern:
+    return re.compile(rf"(?<!\S)({'|'.join(map(re.escape, keys))}):(\S+)", re.IGNORECASE)
+
+
+def parse_filters(args: str, keys: dict[str, str]) -> tuple[list[tuple[str, str, str]], str]:
+    """``key:value`` filters of /search and /export → ([(key, field, value)], rest).
+
+    ``keys`` maps every accepted key (aliases included, lower case) to its
+    field; ``rest`` is the remaining text with whitespace collapsed.
+    """
+    pattern = _filter_re(tuple(keys))
+    filters = [(key, keys[key.lower()], value) for key, value in pattern.findall(args)]
+    return filters, " ".join(pattern.sub(" ", args).split())
+
+
+def compress_ranges(numbers: Iterable[int]) -> str:
+    """[1, 2, 3, 5, 7, 8] → "1–3, 5, 7–8" (input must be sorted)."""
+    parts = []
+    start = prev = None
+    for n in numbers:
+        if prev is not None and n == prev + 1:
+            prev = n
+            continue
+        if start is not None:
+            parts.append(str(start) if start == prev else f"{start}–{prev}")
+        start = prev = n
+    if start is not None:
+        parts.append(str(start) if start == prev else f"{start}–{prev}")
+    return ", ".join(parts)
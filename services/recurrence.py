@@ -0,0 +1,95 @@
+import calendar
+import re
+from datetime import datetime, timedelta, timezone
+
+# Recurring reminder rules, stored as text in reminders.rule:
+#   "monthly:N" — every month on day N (the month's last day if it is shorter)
+#   "days:N"    — every N days
+# reminders.repeat_until (optional) ends the series. Only the next occurrence
+# is ever stored: when a reminder fires, the loop moves its remind_at on to
+# next_occurrence(), so due reminders are still one indexed range scan.
+
+MSK_TZ = timezone(timedelta(hours=3))
+MAX_INTERVAL_DAYS = 365
+
+_UNTIL_RE = re.compile(r"\s*\bдо\s+(\d{1,2}\.\d{1,2}\.\d{4})\s*", re.IGNORECASE)
+_NO_REPEAT_RE = re.compile(r"^(?:нет|не повторять|однократно)$", re.IGNORECASE)
+_MONTHLY_RE = re.compile(
+    r"^(?:ежемесячно|каждый месяц)(?:\s+(\d{1,2})(?:-?го|-?е)?(?:\s+числа)?)?$", re.IGNORECASE
+)
+_DAYS_RE = re.compile(r"^(?:каждые|каждый|раз в)\s+(?:(\d{1,3})\s+)?(?:день|дня|дней)$", re.IGNORECASE)
+
+
+def parse_date(value: str) -> datetime:
+    """ДД.ММ.ГГГГ (московское) → начало дня в UTC. Raises ValueError."""
+    return datetime.strptime(value, "%d.%m.%Y").replace(tzinfo=MSK_TZ).astimezone(timezone.utc)
+
+
+def parse_rule(text: str, first: datetime) -> tuple[str | None, datetime | None]:
+    """«нет» / «ежемесячно [N]» / «каждые N дней», optionally «до ДД.ММ.ГГГГ»,
+    → (rule, repeat_until). Monthly defaults to the day of ``first``. Raises ValueError."""
+    text = " ".join(text.split())
+    until = None
+    match = _UNTIL_RE.search(text)
+    if match:
+        # "до" is inclusive — the series ends at the start of the next day
+        until = parse_date(match[1]) + timedelta(days=1)
+        if until <= first:
+            raise ValueError("Дата окончания раньше первого напоминания")
+        text = _UNTIL_RE.sub(" ", text).strip()
+
+    if _NO_REPEAT_RE.match(text):
+        return None, None
+    match = _MONTHLY_RE.match(text)
+    if match:
+        day = int(match[1]) if match[1] else first.astimezone(MSK_TZ).day
+        if not 1 <= day <= 31:
+            raise ValueError("День месяца — от 1 до 31")
+        return f"monthly:{day}", until
+    match = _DAYS_RE.match(text)
+    if match:
+        days = int(match[1]) if match[1] else 1
+        if not 1 <= days <= MAX_INTERVAL_DAYS:
+            raise ValueError(f"Интервал — от 1 до {MAX_INTERVAL_DAYS} дней")
+        return f"days:{days}", until
+    raise ValueError("Не понял, как повторять")
+
+
+def next_occurrence(rule: str, previous: datetime) -> datetime:
+    """The occurrence after ``previous``, at the same Moscow time of day."""
+    kind, value = rule.split(":")
+    value = int(value)
+    if kind == "days":
+        return previous + timedelta(days=value)
+    local = previous.astimezone(MSK_TZ)
+    year, month = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+    day = min(value, calendar.monthrange(year, month)[1])
+    return local.replace(year=year, month=month, day=day).astimezone(timezone.utc)
+
+
+def following(rule: str | None, previous: datetime, until: datetime | None,
+              now: datetime) -> datetime | None:
+    """Next occurrence still ahead of ``now`` (missed ones are skipped, not
+    replayed), or None when the series is over or not recurring."""
+    if rule is None:
+        return None
+    upcoming = next_occurrence(rule, previous)
+    while upcoming <= now:
+        upcoming = next_occurrence(rule, upcoming)
+    if until is not None and upcoming >= until:
+        return None
+    return upcoming
+
+
+def describe_rule(rule: str | None, until: datetime | None = None) -> str:
+    """«ежемесячно, 15-го» / «каждые 30 дн.» (+ «до …»); "" for a one-shot reminder."""
+    if rule is None:
+        return ""
+    kind, value = rule.split(":")
+    text = f"ежемесячно, {value}-го" if kind == "monthly" else (
+        "каждый день" if value == "1" else f"каждые {value} дн."
+    )
+    if until is not None:
+        last_day = until.astimezone(MSK_TZ) - timedelta(days=1)
+        text += f", до {last_day.strftime('%d.%m.%Y')}"
+    return text
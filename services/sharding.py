@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 5  # seconds between worker liveness stamps
+HEARTBEAT_TIMEOUT = 90  # a worker whose event loop is stuck this long is restarted
+MONITOR_INTERVAL = 5
+STOP_TIMEOUT = 15
+
+# spawn, not fork: the ingress process already runs an event loop and a DB pool
+_mp = multiprocessing.get_context("spawn")
+
+
+def shard_for(key: int, shards: int) -> int:
+    """Jump consistent hash: only ~1/N keys move when the shard count changes."""
+    key &= 0xFFFFFFFFFFFFFFFF  # chat ids are negative
+    b, j = -1, 0
+    while j < shards:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def update_key(update: dict) -> int:
+    """Routing key of a raw update: the sender, else the chat, else the update itself.
+
+    Keying by user keeps the user's FSM state (MemoryStorage, per process) and
+    rate limit counters on one worker and their updates in order.
+    """
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return update["update_id"]
+
+
+class _Shard:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.queue = None
+        # Every update up to this sequence number has been fully handled
+        self.acked = _mp.Value("q", 0, lock=False)
+        self.heartbeat = _mp.Value("d", 0.0, lock=False)
+        # Routed but not acked — replayed into a restarted worker
+        self.pending: deque[tuple[int, int, str]] = deque()
+        self.restarts = 0
+        self.crashed_at: int | None = None  # oldest pending seq at the last crash
+
+    def trim(self) -> None:
+        acked = self.acked.value
+        while self.pending and self.pending[0][0] <= acked:
+            self.pending.popleft()
+
+
+class ShardSupervisor:
+    """Ingress side: routes raw updates to N worker processes and keeps them alive.
+
+    ``factory(index, events)`` runs inside each worker, sets up its logging
+    and returns ``(bot, dispatcher, db)``. It must be a module-level coroutine function so
+    it can be pickled for spawn. Workers report expiry deadlines back through
+    ``events``; they are passed to ``on_event(kind, deadline)`` here.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        factory: Callable[[int, Any], Awaitable[tuple]],
+        on_event: Callable[[str, Any], None] | None = None,
+    ):
+        self.factory = factory
+        self.on_event = on_event
+        self.events = _mp.Queue()
+        self.shards = [_Shard(i) for i in range(workers)]
+        self._seq = 0
+        self._tasks: list[asyncio.Task] = []
+
+    def _spawn(self, shard: _Shard) -> None:
+        if shard.queue is not None:
+            # Don't let a dead reader's queue block the ingress at exit
+            shard.queue.cancel_join_thread()
+            shard.queue.close()
+        shard.queue = _mp.Queue()
+        shard.heartbeat.value = time.time()  # grace period while it boots
+        shard.process = _mp.Process(
+            target=run_worker,
+            args=(shard.index, self.factory, shard.queue, self.events,
+                  shard.acked, shard.heartbeat),
+            name=f"shard-{shard.index}",
+            daemon=True,
+        )
+        shard.process.start()
+        shard.trim()
+        for item in shard.pending:
+            shard.queue.put_nowait(item)
+        logger.info(
+            f"Shard {shard.index} started (pid {shard.process.pid}, "
+            f"{len(shard.pending)} updates replayed)"
+        )
+
+    def start(self) -> None:
+        for shard in self.shards:
+            self._spawn(shard)
+        self._tasks = [
+            asyncio.create_task(self._monitor()),
+            asyncio.create_task(self._drain_events()),
+        ]
+
+    def route(self, update: dict) -> None:
+        key = update_key(update)
+        shard = self.shards[shard_for(key, len(self.shards))]
+        self._seq += 1
+        item = (self._seq, key, json.dumps(update, ensure_ascii=False))
+        shard.pending.append(item)
+        shard.queue.put_nowait(item)
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            now = time.time()
+            for shard in self.shards:
+                shard.trim()
+                if not shard.process.is_alive():
+                    reason = f"exited with code {shard.process.exitcode}"
+                elif now - shard.heartbeat.value > HEARTBEAT_TIMEOUT:
+                    reason = f"no heartbeat for {now - shard.heartbeat.value:.0f}s"
+                    shard.process.kill()
+                    await asyncio.to_thread(shard.process.join, STOP_TIMEOUT)
+                else:
+                    continue
+                shard.restarts += 1
+                logger.error(f"Shard {shard.index} {reason} — restarting (#{shard.restarts})")
+                shard.trim()
+                head = shard.pending[0][0] if shard.pending else None
+                if head is not None and head == shard.crashed_at:
+                    # Same oldest update at two crashes in a row — don't crash-loop on it
+                    _, key, payload = shard.pending.popleft()
+                    logger.error(f"Shard {shard.index} dropped update {payload[:200]} (key {key})")
+                    head = shard.pending[0][0] if shard.pending else None
+                shard.crashed_at = head
+                # The old queue may be left corrupted by a killed reader; _spawn makes a new one
+                self._spawn(shard)
+
+    async def _drain_events(self) -> None:
+        while True:
+            event = await asyncio.to_thread(self.events.get)
+            if event is None:
+                return
+            kind, payload = event
+            if self.on_event:
+                try:
+                    self.on_event(kind, payload)
+                except Exception as e:
+                    logger.error(f"Shard event {kind} failed: {e}")
+
+    def status(self) -> list[dict]:
+        now = time.time()
+        return [
+            {
+                "shard": s.index,
+                "alive": s.process.is_alive(),
+                "heartbeat_age": round(now - s.heartbeat.value, 1),
+                "backlog": len(s.pending),
+                "restarts": s.restarts,
+            }
+            for s in self.shards
+        ]
+
+    async def stop(self) -> None:
+        monitor, drain = self._tasks
+        monitor.cancel()
+        for shard in self.shards:
+            shard.queue.put_nowait(None)
+        for shard in self.shards:
+            await asyncio.to_thread(shard.process.join, STOP_TIMEOUT)
+            if shard.process.is_alive():
+                logger.warning(f"Shard {shard.index} did not stop in time — killing")
+                shard.process.kill()
+        # Wakes _drain_events, which is blocked in events.get() on a thread
+        self.events.put_nowait(None)
+        await drain
+
+
+# === Worker process ===
+
+def run_worker(index, factory, queue, events, acked, heartbeat) -> None:
+    # Ctrl+C reaches the whole process group; shutdown is driven by the ingress
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(index, factory, queue, events, acked, heartbeat))
+
+
+async def _worker(index, factory, queue, events, acked, heartbeat) -> None:
+    bot, dp, db = await factory(index, events)
+    # Updates of one user run strictly in order; different users run concurrently
+    locks: dict[int, asyncio.Lock] = {}
+    waiting: dict[int, int] = {}
+    tasks: set[asyncio.Task] = set()
+    # Received, unfinished sequence numbers; insertion order is ascending
+    inflight: dict[int, None] = {}
+    last_seq = 0
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def handle(seq: int, key: int, update: dict):
+        waiting[key] = waiting.get(key, 0) + 1
+        lock = locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error(f"Update {update.get('update_id')} failed: {e}")
+        finally:
+            waiting[key] -= 1
+            if not waiting[key]:
+                del waiting[key], locks[key]
+            del inflight[seq]
+            acked.value = next(iter(inflight)) - 1 if inflight else last_seq
+
+    beat_task = asyncio.create_task(beat())
+    logger.info(f"Shard {index} ready")
+    try:
+        while True:
+            item = await asyncio.to_thread(queue.get)
+            if item is None:
+                break
+            seq, key, payload = item
+            inflight[seq] = None
+            last_seq = seq
+            task = asyncio.create_task(handle(seq, key, json.loads(payload)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+    finally:
+        beat_task.cancel()
+        await db.close()
+        await bot.session.close()
+        logger.info(f"Shard {index} stopped")
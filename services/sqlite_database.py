@@ -0,0 +1,712 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone, timedelta
+from functools import lru_cache
+
+from services.cache_bus import WATCHED
+from services.database import (
+    ACTIVITY_UTC_OFFSET_HOURS, Database, _MESSAGE_COLUMNS, _month_start, _next_month,
+    _partition_name, writes, read_only,
+)
+
+logger = logging.getLogger(__name__)
+
+# Single-node backend: one database file, one connection, no server. Database's
+# portable queries run here unchanged through an asyncpg-shaped connection
+# facade; only the Postgres-specific ones are overridden below. Differences:
+#   - messages is one table (no monthly partitions); retention archives and
+#     deletes by month instead of dropping partitions
+#   - search uses FTS5 with prefix matching instead of the Russian stemmer
+#   - cache invalidation is in-process (no LISTEN/NOTIFY), so sharded mode
+#     and a read replica are not available
+
+# Same text format as strftime('%Y-%m-%d %H:%M:%f') so timestamps compare as strings
+_TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+_NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_PLACEHOLDER_RE = re.compile(r"\$(\d+)")
+
+_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+def _format_ts(dt: datetime) -> str:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    dt = dt.astimezone(timezone.utc)
+    return f"{dt.strftime(_TS_FORMAT)}.{dt.microsecond // 1000:03d}"
+
+
+def _parse_ts(value: bytes) -> datetime:
+    return datetime.fromisoformat(value.decode()).replace(tzinfo=timezone.utc)
+
+
+sqlite3.register_adapter(datetime, _format_ts)
+sqlite3.register_adapter(date, date.isoformat)
+# Applied by declared column type, or by an "alias [type]" column name
+sqlite3.register_converter("TIMESTAMPTZ", _parse_ts)
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter("BOOLEAN", lambda value: value != b"0")
+sqlite3.register_converter("JSON", json.loads)
+
+
+@lru_cache(maxsize=512)
+def _sql(query: str) -> str:
+    """asyncpg's $1 placeholders → SQLite's ?1 (same numbering, reusable)."""
+    return _PLACEHOLDER_RE.sub(r"?\1", query)
+
+
+def sqlite_path(database_url: str) -> str:
+    """sqlite:///bot.db → bot.db, sqlite:////var/bot.db → /var/bot.db, sqlite:// → :memory:"""
+    path = database_url.split(":", 1)[1]
+    if path.startswith("//"):
+        path = path[2:]
+    if path.startswith("/"):
+        path = path[1:]
+    return path or ":memory:"
+
+
+class Record(sqlite3.Row):
+    """sqlite3.Row with asyncpg.Record's ``get``."""
+
+    def get(self, key, default=None):
+        return self[key] if key in self.keys() else default
+
+
+class SQLiteConnection:
+    """The subset of asyncpg.Connection that Database uses, over one sqlite3 connection.
+
+    Every call runs on the connection's own thread, one at a time. ``execute``
+    returns an asyncpg-style status tag ("UPDATE 3") so callers parse both alike.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._depth = 0
+        # Called after a rollback — see SQLiteDatabase.connect
+        self.on_rollback = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def open(self, functions: dict) -> None:
+        def open_():
+            conn = sqlite3.connect(
+                self.path, isolation_level=None,
+                detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            )
+            conn.row_factory = Record
+            for pragma in _PRAGMAS:
+                conn.execute(pragma)
+            for name, (nargs, fn) in functions.items():
+                conn.create_function(name, nargs, fn)
+            return conn
+
+        self._conn = await self._run(open_)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    async def execute(self, query: str, *args) -> str:
+        rowcount = await self._run(lambda: self._conn.execute(_sql(query), args).rowcount)
+        verb = query.split(None, 1)[0].upper()
+        return f"INSERT 0 {rowcount}" if verb == "INSERT" else f"{verb} {rowcount}"
+
+    async def executescript(self, script: str) -> None:
+        await self._run(self._conn.executescript, script)
+
+    async def fetch(self, query: str, *args) -> list:
+        return await self._run(lambda: self._conn.execute(_sql(query), args).fetchall())
+
+    async def fetchrow(self, query: str, *args):
+        rows = await self.fetch(query, *args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, query: str, *args):
+        row = await self.fetchrow(query, *args)
+        return row[0] if row else None
+
+    async def copy_records_to_table(self, table: str, *, records, columns) -> str:
+        """Bulk insert in one transaction (the COPY of this backend)."""
+        query = (
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})"
+        )
+        async with self.transaction():
+            await self._run(self._conn.executemany, query, records)
+        return f"COPY {len(records)}"
+
+    async def copy_from_query(self, query: str, *args, output, format: str = "csv",
+                              header: bool = False, chunk_rows: int = 1000) -> str:
+        """COPY (query) TO STDOUT as CSV: rows are read off the cursor and handed
+        to the async ``output`` in encoded chunks, never all at once."""
+        loop = asyncio.get_running_loop()
+
+        def copy():
+            cursor = self._conn.execute(_sql(query), args)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator="\n")
+            if header:
+                # "alias [type]" column names carry a converter hint
+                writer.writerow(d[0].split(" [")[0] for d in cursor.description)
+            count = 0
+            while rows := cursor.fetchmany(chunk_rows):
+                writer.writerows(rows)
+                count += len(rows)
+                # Block this thread (not the loop) until the chunk is written
+                asyncio.run_coroutine_threadsafe(output(buffer.getvalue().encode()), loop).result()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                asyncio.run_coroutine_threadsafe(output(buffer.getvalue().encode()), loop).result()
+            return count
+
+        return f"COPY {await self._run(copy)}"
+
+    @asynccontextmanager
+    async def transaction(self):
+        """BEGIN IMMEDIATE … COMMIT; nested blocks become savepoints."""
+        depth = self._depth
+        savepoint = f"sp_{depth}"
+        await self.execute("BEGIN IMMEDIATE" if depth == 0 else f"SAVEPOINT {savepoint}")
+        self._depth += 1
+        try:
+            yield
+        except BaseException:
+            self._depth -= 1
+            if depth == 0:
+                await self.execute("ROLLBACK")
+            else:
+                await self.execute(f"ROLLBACK TO {savepoint}")
+                await self.execute(f"RELEASE {savepoint}")
+            if self.on_rollback:
+                self.on_rollback()
+            raise
+        self._depth -= 1
+        await self.execute("COMMIT" if depth == 0 else f"RELEASE {savepoint}")
+
+
+_ACTIVITY_DAY = f"date({{}}, '+{ACTIVITY_UTC_OFFSET_HOURS} hours')"
+
+# Columns added after a table first shipped: (table, column, type) — SQLite
+# has no ADD COLUMN IF NOT EXISTS
+_ADDED_COLUMNS = (
+    ("reminders", "rule", "TEXT"),
+    ("reminders", "repeat_until", "TIMESTAMPTZ"),
+)
+
+_INCIDENT_HOUR = "strftime('%Y-%m-%d %H:00:00.000', {})"
+
+_INCIDENT_BACKFILL = f"""
+    INSERT INTO incident_hourly (hour, source, incidents)
+    SELECT {_INCIDENT_HOUR.format("created_at")}, source, COUNT(*) FROM messages GROUP BY 1, 2;
+"""
+
+_ACTIVITY_BACKFILL = f"""
+    INSERT INTO spot_daily_activity (spot_number, day, received)
+    SELECT to_spot, {_ACTIVITY_DAY.format("created_at")}, COUNT(*) FROM messages WHERE TRUE GROUP BY 1, 2;
+    INSERT INTO spot_daily_activity (spot_number, day, sent)
+    SELECT s.spot_number, {_ACTIVITY_DAY.format("m.created_at")}, COUNT(*)
+    FROM messages m
+    JOIN (SELECT user_id, MIN(spot_number) AS spot_number FROM parking_spots GROUP BY user_id) s
+      ON s.user_id = m.from_user_id
+    WHERE TRUE
+    GROUP BY 1, 2
+    ON CONFLICT (spot_number, day) DO UPDATE SET sent = excluded.sent;
+"""
+
+_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS users (
+        telegram_id INTEGER PRIMARY KEY,
+        username TEXT,
+        name TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT ({_NOW_SQL}),
+        delivery_status TEXT,
+        delivery_failed_at TIMESTAMPTZ
+    );
+    CREATE TABLE IF NOT EXISTS parking_spots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        spot_number INTEGER NOT NULL,
+        user_id BIGINT NOT NULL REFERENCES users(telegram_id),
+        is_temporary_free BOOLEAN NOT NULL DEFAULT FALSE,
+        free_until TIMESTAMPTZ,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT ({_NOW_SQL}),
+        CONSTRAINT parking_spots_spot_user_unique UNIQUE (spot_number, user_id)
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_user_id BIGINT REFERENCES users(telegram_id),
+        to_spot INTEGER NOT NULL,
+        message_text TEXT NOT NULL,
+        reply_text TEXT,
+        source TEXT NOT NULL DEFAULT 'private',
+        created_at TIMESTAMPTZ NOT NULL DEFAULT ({_NOW_SQL})
+    );
+    CREATE TABLE IF NOT EXISTS guest_passes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        host_user_id BIGINT NOT NULL REFERENCES users(telegram_id),
+        guest_info TEXT NOT NULL,
+        spot_number INTEGER,
+        expires_at TIMESTAMPTZ NOT NULL,
+        is_active BOOLEAN NOT NULL DEFAULT TRUE,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT ({_NOW_SQL})
+    );
+    CREATE TABLE IF NOT EXISTS announcements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id BIGINT NOT NULL,
+        text TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT ({_NOW_SQL})
+    );
+    CREATE TABLE IF NOT EXISTS moderators (
+        telegram_id INTEGER PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id BIGINT NOT NULL REFERENCES users(telegram_id),
+        spot_number INTEGER NOT NULL,
+        remind_at TIMESTAMPTZ NOT NULL,
+        is_sent BOOLEAN NOT NULL DEFAULT FALSE,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT ({_NOW_SQL}),
+        rule TEXT,
+        repeat_until TIMESTAMPTZ
+    );
+    CREATE TABLE IF NOT EXISTS bot_settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS alert_windows (
+        spot_number INTEGER PRIMARY KEY,
+        opened_at TIMESTAMPTZ NOT NULL,
+        alerts INTEGER NOT NULL DEFAULT 1,
+        message_id INTEGER,
+        reports TEXT NOT NULL,
+        dms TEXT NOT NULL DEFAULT '{{}}'
+    );
+    CREATE TABLE IF NOT EXISTS spot_daily_activity (
+        spot_number INTEGER NOT NULL,
+        day DATE NOT NULL,
+        received INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (spot_number, day)
+    );
+    CREATE TABLE IF NOT EXISTS incident_hourly (
+        hour TIMESTAMPTZ NOT NULL,
+        source TEXT NOT NULL,
+        incidents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, source)
+    );
+
+    -- Same indexes as the Postgres schema (the GIN one is messages_fts below);
+    -- idx_messages_created stands in for monthly partition pruning
+    CREATE INDEX IF NOT EXISTS idx_messages_to_spot_created ON messages (to_spot, created_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at);
+    CREATE INDEX IF NOT EXISTS idx_messages_from_user ON messages (from_user_id);
+    CREATE INDEX IF NOT EXISTS idx_parking_spots_user ON parking_spots (user_id);
+    CREATE INDEX IF NOT EXISTS idx_parking_spots_number ON parking_spots (spot_number);
+    CREATE INDEX IF NOT EXISTS idx_parking_spots_free
+        ON parking_spots (spot_number) WHERE is_temporary_free = TRUE;
+    CREATE INDEX IF NOT EXISTS idx_guest_passes_active_expires
+        ON guest_passes (expires_at) WHERE is_active = TRUE;
+    CREATE INDEX IF NOT EXISTS idx_reminders_pending
+        ON reminders (is_sent, remind_at) WHERE is_sent = FALSE;
+    CREATE INDEX IF NOT EXISTS idx_guest_passes_host_active ON guest_passes (host_user_id, is_active);
+    CREATE INDEX IF NOT EXISTS idx_users_status ON users (status);
+    CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, telegram_id);
+    CREATE INDEX IF NOT EXISTS idx_spot_daily_activity_day ON spot_daily_activity (day);
+
+    -- The spot_daily_activity rollup (see database._ACTIVITY_DDL)
+    CREATE TRIGGER IF NOT EXISTS spot_activity_rollup AFTER INSERT ON messages BEGIN
+        INSERT INTO spot_daily_activity (spot_number, day, received)
+        VALUES (new.to_spot, {_ACTIVITY_DAY.format("new.created_at")}, 1)
+        ON CONFLICT (spot_number, day) DO UPDATE SET received = received + 1;
+        INSERT INTO spot_daily_activity (spot_number, day, sent)
+        SELECT MIN(spot_number), {_ACTIVITY_DAY.format("new.created_at")}, 1
+        FROM parking_spots WHERE user_id = new.from_user_id
+        HAVING MIN(spot_number) IS NOT NULL
+        ON CONFLICT (spot_number, day) DO UPDATE SET sent = sent + 1;
+    END;
+
+    -- The incident_hourly rollup (see database._INCIDENT_DDL)
+    CREATE TRIGGER IF NOT EXISTS incident_rollup AFTER INSERT ON messages BEGIN
+        INSERT INTO incident_hourly (hour, source, incidents)
+        VALUES ({_INCIDENT_HOUR.format("new.created_at")}, new.source, 1)
+        ON CONFLICT (hour, source) DO UPDATE SET incidents = incidents + 1;
+    END;
+
+    -- Full-text index over message + reply, kept in sync by triggers
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        message_text, reply_text, content='messages', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, message_text, reply_text)
+        VALUES (new.id, new.message_text, new.reply_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, message_text, reply_text)
+        VALUES ('delete', old.id, old.message_text, old.reply_text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message_text, reply_text ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, message_text, reply_text)
+        VALUES ('delete', old.id, old.message_text, old.reply_text);
+        INSERT INTO messages_fts (rowid, message_text, reply_text)
+        VALUES (new.id, new.message_text, new.reply_text);
+    END;
+"""
+
+
+def _invalidation_triggers() -> str:
+    """TEMP triggers calling cache_invalidate() — the in-process cache_bus.WATCHED.
+
+    TEMP because the function only exists on this connection; other tools
+    opening the file must not trip over it.
+    """
+    statements = []
+    for entity, table, column in WATCHED:
+        name = f"cache_inv_{entity}"
+        statements.append(f"""
+            CREATE TEMP TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON main.{table} BEGIN
+                SELECT cache_invalidate('{entity}', new.{column});
+            END;
+            CREATE TEMP TRIGGER IF NOT EXISTS {name}_update AFTER UPDATE ON main.{table} BEGIN
+                SELECT cache_invalidate('{entity}', old.{column});
+                SELECT cache_invalidate('{entity}', new.{column});
+            END;
+            CREATE TEMP TRIGGER IF NOT EXISTS {name}_delete AFTER DELETE ON main.{table} BEGIN
+                SELECT cache_invalidate('{entity}', old.{column});
+            END;
+        """)
+    return "".join(statements)
+
+
+def _fts_query(text: str) -> str:
+    """Search words → FTS5 prefix terms, ANDed.
+
+    Without a Russian stemmer, long words lose their last two letters so
+    "машина" also finds "машину"/"машины".
+    """
+    terms = []
+    for word in re.findall(r"\w+", text.lower()):
+        if len(word) > 4:
+            word = word[:max(4, len(word) - 2)]
+        terms.append(f'"{word}"*')
+    return " ".join(terms)
+
+
+def _dump_csv_gz(path: str, rows: list) -> None:
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(_MESSAGE_COLUMNS)
+        writer.writerows(rows)
+
+
+class SQLiteDatabase(Database):
+    """Database on an embedded SQLite file (WAL mode), for single-node deployments and tests.
+
+    Selected by a ``sqlite://`` DATABASE_URL (see create_database).
+    """
+
+    # No string_agg before SQLite 3.44; the subquery supplies the order
+    _SPOT_LIST_SQL = "group_concat(s.spot_number, ' ')"
+
+    def __init__(self):
+        super().__init__()
+        self._conn: SQLiteConnection | None = None
+        # One connection: a transaction holds it until commit
+        self._lock = asyncio.Lock()
+
+    async def connect(
+        self,
+        database_url: str,
+        migrate: bool = True,
+        replica_url: str = None,
+        replica_max_lag: float = 5.0,
+        read_your_writes: float = 10.0,
+    ):
+        if replica_url:
+            logger.warning("REPLICA_DATABASE_URL is ignored by the SQLite backend")
+        loop = asyncio.get_running_loop()
+
+        def cache_invalidate(entity, key):
+            # Runs on the connection thread, before the statement returns
+            loop.call_soon_threadsafe(self._dispatch_invalidation, entity, str(key))
+
+        self._conn = SQLiteConnection(sqlite_path(database_url))
+        await self._conn.open({
+            "NOW": (0, lambda: _format_ts(datetime.now(timezone.utc))),
+            "cache_invalidate": (2, cache_invalidate),
+        })
+        # A rolled-back write may already have been re-read into a cache
+        self._conn.on_rollback = self._flush_caches
+        if migrate:
+            await self._create_tables()
+        await self._conn.executescript(_invalidation_triggers())
+        logger.info(f"SQLite database {self._conn.path} connected and tables created")
+
+    async def close(self):
+        if self._conn:
+            await self._conn.close()
+            logger.info("Database connection closed")
+
+    @asynccontextmanager
+    async def _acquire(self):
+        conn = self._uow_conn.get()
+        if conn is not None:
+            yield conn
+            return
+        async with self._lock:
+            yield self._conn
+
+    async def ping(self, timeout: float) -> None:
+        async def select_one():
+            async with self._acquire() as conn:
+                await conn.fetchval("SELECT 1")
+
+        await asyncio.wait_for(select_one(), timeout)
+
+    def pool_stats(self) -> dict:
+        return {"size": 1, "idle": 0 if self._lock.locked() else 1, "max": 1}
+
+    async def _create_tables(self):
+        async with self._acquire() as conn:
+            existing = {
+                r["name"] for r in await conn.fetch(
+                    "SELECT name FROM sqlite_master WHERE name IN ('spot_daily_activity', 'incident_hourly')"
+                )
+            }
+            await conn.executescript(_SCHEMA)
+            for table, column, ddl in _ADDED_COLUMNS:
+                columns = {r["name"] for r in await conn.fetch(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            # One-off fill of a new rollup from the messages already stored
+            if "spot_daily_activity" not in existing:
+                await conn.executescript(_ACTIVITY_BACKFILL)
+            if "incident_hourly" not in existing:
+                await conn.executescript(_INCIDENT_BACKFILL)
+
+    # === Users ===
+
+    @writes
+    async def set_delivery_status(self, telegram_id: int, status: str | None) -> None:
+        async with self._acquire() as conn:
+            await conn.execute(
+                """UPDATE users SET delivery_status = $2,
+                   delivery_failed_at = CASE WHEN $2 IS NULL THEN NULL ELSE NOW() END
+                   WHERE telegram_id = $1""",
+                telegram_id, status,
+            )
+
+    @read_only
+    async def get_unreachable_owners_page(self, limit: int, after: tuple = None, before: tuple = None):
+        where, order, args = "", "DESC", [limit]
+        if after is not None:
+            where, args = "AND (u.delivery_failed_at, u.telegram_id) < ($2, $3)", [limit, *after]
+        elif before is not None:
+            where, order, args = "AND (u.delivery_failed_at, u.telegram_id) > ($2, $3)", "ASC", [limit, *before]
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                f"""SELECT u.telegram_id, u.name, u.username, u.delivery_status,
+                           u.delivery_failed_at,
+                           (SELECT json_group_array(spot_number) FROM (
+                                SELECT ps.spot_number FROM parking_spots ps
+                                WHERE ps.user_id = u.telegram_id ORDER BY ps.spot_number
+                           )) AS "spots [json]"
+                    FROM users u
+                    WHERE u.delivery_status IS NOT NULL
+                    AND EXISTS (SELECT 1 FROM parking_spots ps WHERE ps.user_id = u.telegram_id)
+                    {where}
+                    ORDER BY u.delivery_failed_at {order}, u.telegram_id {order}
+                    LIMIT $1""",
+                *args,
+            )
+        return rows[::-1] if before is not None else rows
+
+    @read_only
+    async def get_users_page(self, limit: int, after: tuple = None, before: tuple = None):
+        where, order, args = "", "ASC", [limit]
+        if after is not None:
+            where, args = "WHERE (u.created_at, u.telegram_id) > ($2, $3)", [limit, *after]
+        elif before is not None:
+            where, order, args = "WHERE (u.created_at, u.telegram_id) < ($2, $3)", "DESC", [limit, *before]
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                f"""SELECT u.telegram_id, u.name, u.username, u.status, u.created_at,
+                           (SELECT json_group_array(spot_number) FROM (
+                                SELECT ps.spot_number FROM parking_spots ps
+                                WHERE ps.user_id = u.telegram_id ORDER BY ps.spot_number
+                           )) AS "spots [json]"
+                    FROM users u
+                    {where}
+                    ORDER BY u.created_at {order}, u.telegram_id {order}
+                    LIMIT $1""",
+                *args,
+            )
+        return rows[::-1] if before is not None else rows
+
+    # === Parking Spots ===
+
+    @writes
+    async def add_spots(self, user_id: int, spot_numbers: list[int], status: str = None) -> list[int]:
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                if status is not None:
+                    await conn.execute(
+                        "UPDATE users SET status = $1 WHERE telegram_id = $2",
+                        status, user_id,
+                    )
+                # "WHERE TRUE" keeps ON CONFLICT from parsing as a join constraint
+                rows = await conn.fetch(
+                    """INSERT INTO parking_spots (spot_number, user_id)
+                       SELECT DISTINCT value, $1 FROM json_each($2) WHERE TRUE
+                       ON CONFLICT (spot_number, user_id) DO NOTHING
+                       RETURNING spot_number""",
+                    user_id, json.dumps(spot_numbers),
+                )
+        added = {r["spot_number"] for r in rows}
+        if added:
+            self.history_cache.invalidate_user(user_id)
+        return [n for n in dict.fromkeys(spot_numbers) if n in added]
+
+    async def get_owners_for_spots(self, spot_numbers: list[int]) -> dict[int, list]:
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                """SELECT ps.spot_number, u.* FROM users u
+                   JOIN parking_spots ps ON u.telegram_id = ps.user_id
+                   WHERE ps.spot_number IN (SELECT value FROM json_each($1))
+                   ORDER BY ps.spot_number""",
+                json.dumps(spot_numbers),
+            )
+        owners: dict[int, list] = {}
+        for r in rows:
+            owners.setdefault(r["spot_number"], []).append(r)
+        return owners
+
+    # === Messages ===
+
+    @read_only
+    async def search_messages(
+        self, text: str = "", spot_number: int = None, from_user_id: int = None,
+        since=None, until=None, limit: int = 10, before=None, after=None,
+    ):
+        """Staff search over message and reply text (FTS5 prefix match), newest first."""
+        conditions = []
+        args = []
+        if text:
+            query = _fts_query(text)
+            if not query:
+                return []
+            args.append(query)
+            conditions.append(
+                f"m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ${len(args)})"
+            )
+        if spot_number is not None:
+            args.append(spot_number)
+            conditions.append(f"m.to_spot = ${len(args)}")
+        if from_user_id is not None:
+            args.append(from_user_id)
+            conditions.append(f"m.from_user_id = ${len(args)}")
+        if since is not None:
+            args.append(since)
+            conditions.append(f"m.created_at >= ${len(args)}")
+        if until is not None:
+            args.append(until)
+            conditions.append(f"m.created_at < ${len(args)}")
+        where = " AND ".join(conditions) if conditions else "TRUE"
+        return await self._fetch_messages_page(where, args, limit, before, after)
+
+    # === Expiry scheduling ===
+
+    async def get_upcoming_expiries(self) -> list[tuple]:
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                """SELECT free_until AS "deadline [timestamptz]", 'spot' AS kind FROM parking_spots
+                   WHERE is_temporary_free = TRUE AND free_until > NOW()
+                   UNION
+                   SELECT expires_at, 'pass' FROM guest_passes
+                   WHERE is_active = TRUE AND expires_at > NOW()"""
+            )
+            return [(r["deadline"], r["kind"]) for r in rows]
+
+    # === Retention ===
+
+    async def ensure_message_partitions(self, months_ahead: int = 2) -> None:
+        """No partitions here — messages is a single table."""
+
+    async def _ensure_partitions(self, conn, start: datetime, end: datetime) -> None:
+        pass
+
+    async def archive_message_partitions(self, keep_months: int, archive_dir: str) -> list[str]:
+        """Dump each month older than ``keep_months`` to gzipped CSV, then delete it.
+
+        Same file names as the Postgres partitions; rows are only deleted once
+        their dump has been written completely.
+        """
+        cutoff = _month_start(datetime.now(timezone.utc))
+        for _ in range(keep_months):
+            cutoff = _month_start(cutoff - timedelta(days=1))
+
+        os.makedirs(archive_dir, exist_ok=True)
+        paths = []
+        async with self._acquire() as conn:
+            oldest = await conn.fetchval(
+                'SELECT MIN(created_at) AS "oldest [timestamptz]" FROM messages WHERE created_at < $1',
+                cutoff,
+            )
+            month = _month_start(oldest) if oldest else cutoff
+            while month < cutoff:
+                upper = _next_month(month)
+                rows = await conn.fetch(
+                    f"""SELECT {', '.join(_MESSAGE_COLUMNS)} FROM messages
+                        WHERE created_at >= $1 AND created_at < $2 ORDER BY id""",
+                    month, upper,
+                )
+                if rows:
+                    path = os.path.join(archive_dir, f"{_partition_name(month)}.csv.gz")
+                    await asyncio.to_thread(_dump_csv_gz, path, [tuple(r) for r in rows])
+                    await conn.execute(
+                        "DELETE FROM messages WHERE created_at >= $1 AND created_at < $2",
+                        month, upper,
+                    )
+                    logger.info(f"Archived {len(rows)} messages of {month:%Y-%m} to {path}")
+                    paths.append(path)
+                month = upper
+        return paths
+
+    @writes
+    async def delete_sent_reminders(self, older_than_days: int) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                "DELETE FROM reminders WHERE is_sent = TRUE AND remind_at < $1",
+                cutoff,
+            )
+            return int(result.split()[-1])
+
+    @writes
+    async def delete_stale_guest_passes(self, older_than_days: int) -> int:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        async with self._acquire() as conn:
+            result = await conn.execute(
+                "DELETE FROM guest_passes WHERE expires_at < $1",
+                cutoff,
+            )
+            return int(result.split()[-1])
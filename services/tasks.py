@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_INITIAL = 1.0  # seconds before the first retry; doubles per consecutive failure
+BACKOFF_MAX = 300.0
+UNHEALTHY_AFTER = 3  # consecutive failures before /ready reports the task
+STOP_TIMEOUT = 10  # seconds shutdown waits for cancelled tasks to finish
+
+Factory = Callable[[], Awaitable[Any]]
+
+
+def _iso(ts: float | None) -> str | None:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds") if ts else None
+
+
+class _Job:
+    def __init__(self, name: str, kind: str, factory: Factory,
+                 interval: float | None = None, first_run: float = 0.0):
+        self.name = name
+        self.kind = kind  # "service", "every" or "once"
+        self.factory = factory
+        self.interval = interval
+        self.first_run = first_run
+        self.task: asyncio.Task | None = None
+        self.state = "starting"
+        self.runs = 0
+        self.failures = 0  # consecutive
+        self.restarts = 0
+        self.last_started: float | None = None
+        self.last_duration: float | None = None
+        self.last_result: Any = None
+        self.last_error: str | None = None
+        self.next_run: float | None = None
+
+    @property
+    def ok(self) -> bool:
+        if self.failures < UNHEALTHY_AFTER:
+            return True
+        # A restarted service that has stayed up for a while has recovered
+        return (self.kind == "service" and self.state == "running"
+                and time.time() - self.last_started > BACKOFF_MAX)
+
+    def backoff(self) -> float:
+        delay = min(BACKOFF_MAX, BACKOFF_INITIAL * 2 ** (self.failures - 1))
+        return min(delay, self.interval) if self.interval else delay
+
+    def status(self) -> dict:
+        return {
+            "kind": self.kind,
+            "state": self.state,
+            "ok": self.ok,
+            "runs": self.runs,
+            "failures": self.failures,
+            "restarts": self.restarts,
+            "last_started": _iso(self.last_started),
+            "last_duration_ms": round(self.last_duration * 1000) if self.last_duration is not None else None,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "next_run": _iso(self.next_run),
+        }
+
+
+class TaskSupervisor:
+    """Owns the process's background tasks: restarts, run metrics, shutdown.
+
+    Each task is registered by name with a ``factory`` returning a fresh
+    coroutine per run:
+
+    - ``service`` — meant to run forever; restarted with backoff whenever it
+      returns or raises.
+    - ``every`` — one unit of work, run every ``interval`` seconds after
+      ``first_run``; a failed run is retried with backoff (never later than
+      the next regular run). Its return value is kept as ``last_result``.
+    - ``once`` — runs until it succeeds once, retried with backoff.
+    """
+
+    def __init__(self):
+        self.jobs: dict[str, _Job] = {}
+
+    def service(self, name: str, factory: Factory) -> None:
+        self._start(_Job(name, "service", factory), self._run_service)
+
+    def every(self, name: str, factory: Factory, interval: float, first_run: float | None = None) -> None:
+        job = _Job(name, "every", factory, interval, interval if first_run is None else first_run)
+        self._start(job, self._run_every)
+
+    def once(self, name: str, factory: Factory, first_run: float = 0.0) -> None:
+        self._start(_Job(name, "once", factory, first_run=first_run), self._run_once)
+
+    def _start(self, job: _Job, runner) -> None:
+        if job.name in self.jobs:
+            raise ValueError(f"Task {job.name} already registered")
+        self.jobs[job.name] = job
+        job.task = asyncio.create_task(runner(job), name=f"task-{job.name}")
+
+    async def _attempt(self, job: _Job) -> bool:
+        """One run of the job's coroutine, recorded; False if it raised."""
+        job.state = "running"
+        job.next_run = None
+        job.last_started = time.time()
+        started = time.monotonic()
+        try:
+            result = await job.factory()
+        except Exception as e:
+            job.last_duration = time.monotonic() - started
+            job.last_error = f"{type(e).__name__}: {e}"
+            self._count_failure(job)
+            logger.error(
+                f"Task {job.name} failed ({job.failures} in a row): {job.last_error}",
+                exc_info=True, extra={"task": job.name},
+            )
+            return False
+        finally:
+            job.runs += 1
+        job.last_duration = time.monotonic() - started
+        job.last_result = result
+        if job.kind != "service":
+            job.failures = 0
+        return True
+
+    @staticmethod
+    def _count_failure(job: _Job) -> None:
+        # A service that ran for a long while before stopping starts its backoff over
+        if job.kind == "service" and job.last_duration > BACKOFF_MAX:
+            job.failures = 1
+        else:
+            job.failures += 1
+
+    async def _sleep(self, job: _Job, state: str, delay: float) -> None:
+        job.state = state
+        job.next_run = time.time() + delay
+        await asyncio.sleep(delay)
+
+    async def _run_service(self, job: _Job) -> None:
+        while True:
+            if await self._attempt(job):
+                # A service isn't supposed to return — count it like a crash
+                self._count_failure(job)
+                job.last_error = "exited"
+                logger.warning(f"Task {job.name} exited", extra={"task": job.name})
+            job.restarts += 1
+            await self._sleep(job, "backoff", job.backoff())
+
+    async def _run_every(self, job: _Job) -> None:
+        await self._sleep(job, "sleeping", job.first_run)
+        while True:
+            if await self._attempt(job):
+                await self._sleep(job, "sleeping", job.interval)
+            else:
+                job.restarts += 1
+                await self._sleep(job, "backoff", job.backoff())
+
+    async def _run_once(self, job: _Job) -> None:
+        await self._sleep(job, "sleeping", job.first_run)
+        while not await self._attempt(job):
+            job.restarts += 1
+            await self._sleep(job, "backoff", job.backoff())
+        job.state = "done"
+
+    def status(self) -> dict[str, dict]:
+        return {name: job.status() for name, job in self.jobs.items()}
+
+    def healthy(self) -> bool:
+        return all(job.ok for job in self.jobs.values())
+
+    async def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        """Cancel every task and wait up to ``timeout`` for them to unwind."""
+        tasks = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for job in self.jobs.values():
+            if job.state != "done":
+                job.state = "stopped"
+        if pending:
+            names = ", ".join(t.get_name() for t in pending)
+            logger.warning(f"Background tasks still running after {timeout}s: {names}")
+        logger.info(f"Stopped {len(done)} background tasks")
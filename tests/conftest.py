@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+from services.database import create_database
+
+
+@pytest.fixture
+def run():
+    """Runs a coroutine to completion on one event loop per test."""
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture
+def db(run, tmp_path):
+    """A fresh SQLite-backed Database in the test's temp directory."""
+    url = f"sqlite:///{tmp_path / 'bot.db'}"
+    database = create_database(url)
+    run(database.connect(url))
+    yield database
+    run(database.close())
@@ -0,0 +1,95 @@
+import pytest
+
+from config import SOURCE_GROUP, SOURCE_NOTIFY
+
+
+@pytest.fixture
+def users(db, run):
+    for user_id in (1, 2):
+        run(db.add_user(user_id, f"user{user_id}", f"User {user_id}"))
+    return db
+
+
+def test_add_spots_skips_duplicates(users, run):
+    assert run(users.add_spots(1, [142, 143, 142])) == [142, 143]
+    assert run(users.add_spots(1, [143, 144])) == [144]
+    assert [s["spot_number"] for s in run(users.get_user_spots(1))] == [142, 143, 144]
+    # A co-owner is a different row
+    assert run(users.add_spots(2, [142])) == [142]
+
+
+def test_add_spots_sets_status(users, run):
+    run(users.add_spots(1, [142], status="approved"))
+    assert run(users.get_user(1))["status"] == "approved"
+
+
+def test_unit_of_work_rolls_back(users, run):
+    async def failing():
+        async with users.unit_of_work() as uow:
+            await uow.add_spots(1, [150])
+            await uow.set_user_status(1, "approved")
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        run(failing())
+    assert run(users.get_user_spots(1)) == []
+    assert run(users.get_user(1))["status"] != "approved"
+
+
+def test_unit_of_work_commits(users, run):
+    async def assign():
+        async with users.unit_of_work() as uow:
+            await uow.add_spots(1, [150])
+            await uow.set_user_status(1, "approved")
+
+    run(assign())
+    assert [s["spot_number"] for s in run(users.get_user_spots(1))] == [150]
+    assert run(users.get_user(1))["status"] == "approved"
+
+
+def test_coalesce_alert_opens_then_merges(users, run):
+    opened, state = run(users.coalesce_alert(142, 600, 1, "Место 10", "перегородили", SOURCE_GROUP))
+    assert opened
+    assert state["alerts"] == 1 and state["dms"] == {}
+    run(users.add_alert_dms(142, state["message_id"], {2: 555}))
+
+    opened, merged = run(users.coalesce_alert(142, 600, 2, "Житель", "всё ещё стоит", SOURCE_NOTIFY))
+    assert not opened
+    assert merged["message_id"] == state["message_id"]
+    assert merged["alerts"] == 2
+    assert merged["reports"] == [["Место 10", "перегородили"], ["Житель", "всё ещё стоит"]]
+    assert merged["dms"] == {2: 555}
+
+    # Both alerts are one logged message
+    rows = run(users.get_messages_for_spot(142))
+    assert len(rows) == 1
+    assert rows[0]["message_text"] == "перегородили\n+ Житель: всё ещё стоит"
+
+
+def test_coalesce_alert_reopens_after_window(users, run):
+    _, first = run(users.coalesce_alert(142, 600, 1, "a", "one", SOURCE_GROUP))
+    opened, second = run(users.coalesce_alert(142, 0, 1, "a", "two", SOURCE_GROUP))
+    assert opened
+    assert second["alerts"] == 1 and second["message_id"] != first["message_id"]
+    # A DM remembered for the replaced window is ignored
+    assert run(users.add_alert_dms(142, first["message_id"], {2: 1})) is None
+
+
+def test_history_keyset_paging(users, run):
+    ids = [run(users.add_message(1, 142, f"m{i}", SOURCE_GROUP)) for i in range(7)]
+    run(users.add_message(1, 999, "other spot", SOURCE_GROUP))
+
+    def texts(rows):
+        return [r["message_text"] for r in rows]
+
+    newest = run(users.get_messages_for_spot(142, 3))
+    assert texts(newest) == ["m6", "m5", "m4"]
+    cursor = lambda row: (row["created_at"], row["id"])  # noqa: E731
+    older = run(users.get_messages_for_spot(142, 3, before=cursor(newest[-1])))
+    assert texts(older) == ["m3", "m2", "m1"]
+    oldest = run(users.get_messages_for_spot(142, 3, before=cursor(older[-1])))
+    assert texts(oldest) == ["m0"]
+    # Back towards the newest page, still newest first
+    newer = run(users.get_messages_for_spot(142, 3, after=cursor(oldest[0])))
+    assert texts(newer) == ["m3", "m2", "m1"]
+    assert [r["id"] for r in oldest + newer] == [ids[0], ids[3], ids[2], ids[1]]
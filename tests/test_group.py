@@ -0,0 +1,40 @@
+import pytest
+
+from handlers.group import parse_spot_mentions
+
+
+@pytest.mark.parametrize("text, spots, rest", [
+    ("142 перегородили выезд", [142], "перегородили выезд"),
+    ("142, 143 и 150 — выезд закрыт", [142, 143, 150], "выезд закрыт"),
+    ("перегородили 142 и 143", [142, 143], "перегородили"),
+    ("белая машина у 142 и 143", [142, 143], "белая машина у"),
+    ("№142 и №143 мешают", [142, 143], "мешают"),
+    ("место 5 и 6", [5, 6], ""),
+    ("место 142 и место 143 выезд", [142, 143], "выезд"),
+    ("машина 142, белая", [142], "машина, белая"),
+])
+def test_spot_lists(text, spots, rest):
+    assert parse_spot_mentions(text) == (spots, rest)
+
+
+@pytest.mark.parametrize("text, spots, rest", [
+    ("2 машины на 142", [142], "2 машины на"),
+    ("Место 142 и еще 5 машин", [142], "еще 5 машин"),
+    ("места 142, 143 перегородили, 2 машины", [142, 143], "перегородили, 2 машины"),
+    ("№142 стоит 10 минут", [142], "стоит 10 минут"),
+    ("ждём 3 часа у 17", [17], "ждём 3 часа у"),
+])
+def test_counts_are_not_spots(text, spots, rest):
+    assert parse_spot_mentions(text) == (spots, rest)
+
+
+def test_times_dates_and_phones_are_kept():
+    spots, rest = parse_spot_mentions("в 10:00 01.03 на м/м 12 звонить +7 999 123-45-67")
+    assert spots == [12]
+    assert rest == "в 10:00 01.03 на звонить +7 999 123-45-67"
+    assert parse_spot_mentions("звоните 8 999 123 45 67, машина 15")[0] == [15]
+
+
+def test_duplicates_and_no_spot():
+    assert parse_spot_mentions("142 и 142")[0] == [142]
+    assert parse_spot_mentions("перегородили выезд") == ([], "перегородили выезд")
@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from services.paging import (
+    compress_ranges, decode_cursor, encode_cursor, fetch_page, nav_keyboard, parse_filters, parse_nav,
+)
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 3, 1, 12, 30, 5, 123456, tzinfo=timezone.utc)
+    token = encode_cursor(created_at, 42)
+    assert "_" not in token
+    assert decode_cursor(token) == (created_at, 42)
+    # Buttons drawn before the shared format
+    assert decode_cursor(token.replace(".", "_")) == (created_at, 42)
+
+
+@pytest.mark.parametrize("token", ["", "123", "abc.1", "1.2.3"])
+def test_decode_cursor_rejects(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def make_fetch(keys):
+    """fetch(limit, after=, before=) over an ascending list of ints."""
+    async def fetch(limit, after=None, before=None):
+        if after is not None:
+            return [k for k in keys if k > after][:limit]
+        if before is not None:
+            return [k for k in keys if k < before][-limit:]
+        return keys[:limit]
+    return fetch
+
+
+def test_fetch_page_walks_both_ways(run):
+    fetch = make_fetch(list(range(1, 8)))
+    assert run(fetch_page(fetch, 3)) == ([1, 2, 3], False, True)
+    assert run(fetch_page(fetch, 3, "n", 3)) == ([4, 5, 6], True, True)
+    assert run(fetch_page(fetch, 3, "n", 6)) == ([7], True, False)
+    assert run(fetch_page(fetch, 3, "p", 7)) == ([4, 5, 6], True, True)
+    assert run(fetch_page(fetch, 3, "p", 4)) == ([1, 2, 3], False, True)
+
+
+def test_fetch_page_falls_back_to_first_page(run):
+    assert run(fetch_page(make_fetch([1, 2]), 3, "n", 9)) == ([1, 2], False, False)
+
+
+def test_nav_keyboard_and_parse_nav():
+    keyboard = nav_keyboard("usrs", [4, 5, 6], str, True, True)
+    prev, next_ = keyboard.inline_keyboard[0]
+    assert parse_nav(prev.callback_data) == ("p", "4")
+    assert parse_nav(next_.callback_data) == ("n", "6")
+    assert nav_keyboard("usrs", [1], str, False, False) is None
+    with pytest.raises(ValueError):
+        parse_nav("usrs_x_1")
+
+
+def test_compress_ranges():
+    assert compress_ranges([1, 2, 3, 5, 7, 8]) == "1–3, 5, 7–8"
+    assert compress_ranges([]) == ""
+
+
+def test_parse_filters():
+    keys = {"место": "spot", "spot": "spot", "с": "since"}
+    filters, rest = parse_filters("белая  машина Место:142 с:01.03.2026 x:1", keys)
+    assert filters == [("Место", "spot", "142"), ("с", "since", "01.03.2026")]
+    assert rest == "белая машина x:1"
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.recurrence import MSK_TZ, describe_rule, following, next_occurrence, parse_date, parse_rule
+
+FIRST = datetime(2026, 1, 15, 9, 0, tzinfo=MSK_TZ).astimezone(timezone.utc)
+
+
+def msk(*args) -> datetime:
+    return datetime(*args, tzinfo=MSK_TZ).astimezone(timezone.utc)
+
+
+def test_parse_date_is_moscow_midnight():
+    assert parse_date("01.03.2026") == datetime(2026, 2, 28, 21, 0, tzinfo=timezone.utc)
+    with pytest.raises(ValueError):
+        parse_date("32.01.2026")
+
+
+@pytest.mark.parametrize("text, rule", [
+    ("нет", None),
+    ("однократно", None),
+    ("ежемесячно", "monthly:15"),
+    ("каждый месяц 31 числа", "monthly:31"),
+    ("ежемесячно 5-го", "monthly:5"),
+    ("каждые 30 дней", "days:30"),
+    ("каждый день", "days:1"),
+    ("раз в 7 дней", "days:7"),
+])
+def test_parse_rule(text, rule):
+    assert parse_rule(text, FIRST) == (rule, None)
+
+
+def test_parse_rule_until_is_inclusive():
+    rule, until = parse_rule("ежемесячно до 15.06.2026", FIRST)
+    assert rule == "monthly:15"
+    assert until == msk(2026, 6, 16)
+
+
+@pytest.mark.parametrize("text", [
+    "ежемесячно 32", "каждые 0 дней", "каждые 400 дней", "иногда", "ежемесячно до 01.01.2026",
+])
+def test_parse_rule_rejects(text):
+    with pytest.raises(ValueError):
+        parse_rule(text, FIRST)
+
+
+def test_monthly_clamps_to_short_months_and_keeps_time():
+    jan = msk(2026, 1, 31, 9, 0)
+    feb = next_occurrence("monthly:31", jan)
+    assert feb == msk(2026, 2, 28, 9, 0)
+    assert next_occurrence("monthly:31", feb) == msk(2026, 3, 31, 9, 0)
+    assert next_occurrence("monthly:15", msk(2026, 12, 15, 9, 0)) == msk(2027, 1, 15, 9, 0)
+
+
+def test_following_skips_missed_occurrences():
+    now = FIRST + timedelta(days=10, hours=1)
+    assert following("days:3", FIRST, None, now) == FIRST + timedelta(days=12)
+    assert following(None, FIRST, None, now) is None
+
+
+def test_following_stops_at_until():
+    until = FIRST + timedelta(days=7)
+    assert following("days:7", FIRST, until, FIRST) is None
+    assert following("days:6", FIRST, until, FIRST) == FIRST + timedelta(days=6)
+
+
+def test_describe_rule():
+    assert describe_rule(None) == ""
+    assert describe_rule("monthly:15") == "ежемесячно, 15-го"
+    assert describe_rule("days:1") == "каждый день"
+    assert describe_rule("days:30", msk(2026, 6, 16)) == "каждые 30 дн., до 15.06.2026"
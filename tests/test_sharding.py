@@ -0,0 +1,28 @@
+from services.sharding import shard_for, update_key
+
+
+def test_shard_for_is_stable_and_in_range():
+    for shards in (1, 2, 5, 16):
+        for key in (0, 1, 42, -1001234567890, 2**40):
+            shard = shard_for(key, shards)
+            assert 0 <= shard < shards
+            assert shard == shard_for(key, shards)
+
+
+def test_shard_for_moves_keys_only_to_the_new_shard():
+    keys = range(-5000, 5000)
+    moved = 0
+    for key in keys:
+        before, after = shard_for(key, 4), shard_for(key, 5)
+        if before != after:
+            assert after == 4
+            moved += 1
+    # ~1/5 of the keys move
+    assert 0.15 < moved / len(keys) < 0.25
+
+
+def test_update_key_prefers_sender_then_chat():
+    assert update_key({"update_id": 1, "message": {"from": {"id": 7}, "chat": {"id": -100}}}) == 7
+    assert update_key({"update_id": 1, "my_chat_member": {"chat": {"id": -100}}}) == -100
+    assert update_key({"update_id": 1, "poll_answer": {"user": {"id": 9}}}) == 9
+    assert update_key({"update_id": 5, "poll": {"id": "x"}}) == 5
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from services import tasks as tasks_module
+from services.log import LogThrottle
+from services.tasks import TaskSupervisor
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(tasks_module, "BACKOFF_INITIAL", 0.001)
+
+
+def supervise(run, register, seconds=0.2):
+    async def go():
+        supervisor = TaskSupervisor()
+        register(supervisor)
+        await asyncio.sleep(seconds)
+        status = supervisor.status()
+        healthy = supervisor.healthy()
+        await supervisor.stop()
+        return status, healthy, supervisor.status()
+    return run(go())
+
+
+def test_service_that_keeps_returning_is_unhealthy(run):
+    async def quits():
+        return None
+
+    status, healthy, _ = supervise(run, lambda s: s.service("quits", quits))
+    assert status["quits"]["failures"] >= tasks_module.UNHEALTHY_AFTER
+    assert status["quits"]["last_error"] == "exited"
+    assert not healthy
+
+
+def test_periodic_job_recovers_after_failures(run):
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("boom")
+        return {"calls": len(calls)}
+
+    status, healthy, _ = supervise(run, lambda s: s.every("flaky", flaky, 10, first_run=0))
+    job = status["flaky"]
+    assert job["state"] == "sleeping"
+    assert job["failures"] == 0 and job["restarts"] == 2
+    assert job["last_result"] == {"calls": 3}
+    assert healthy
+
+
+def test_once_and_stop(run):
+    async def forever():
+        await asyncio.sleep(3600)
+
+    def register(s):
+        s.once("broadcast", lambda: asyncio.sleep(0, result=5))
+        s.service("forever", forever)
+
+    status, _, stopped = supervise(run, register, seconds=0.05)
+    assert status["broadcast"]["state"] == "done"
+    assert status["broadcast"]["last_result"] == 5
+    assert stopped["broadcast"]["state"] == "done"
+    assert stopped["forever"]["state"] == "stopped"
+
+
+def test_log_throttle_counts_and_forgets_idle_keys(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("services.log.time.monotonic", lambda: now[0])
+    throttle = LogThrottle(period=10)
+    assert throttle.allow("a") == 0
+    assert throttle.allow("a") is None
+    assert throttle.allow("a") is None
+    now[0] = 11
+    assert throttle.allow("a") == 2
+
+    for key in range(100):
+        throttle.allow(key)
+    now[0] = 30
+    throttle.allow("b")
+    assert len(throttle._last) == 1